@@ -2,38 +2,79 @@
 
 import os
 import io
+import sys
 import streamlit as st
 from pypdf import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from pymongo import MongoClient
 import anthropic
 from dotenv import load_dotenv
 import base64
+from itertools import islice
+
+# Shared pipeline modules live in ../src
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from data_ingestion import extract_pages
+from db_client import get_database, check_health, cached_check
+from lexical_index import load_or_create, index_path
+from pdf_chunk_store import PDFChunkStore, PDF_RETRIEVAL_TOP_K
+from context_packer import pack_context
+from answer_cache import get_default_cache as get_answer_cache
+from conversation_memory import ConversationMemory, anthropic_summarizer
+from llm_streaming import CancelToken, stream_answer
+from prompt_cache import PromptCacheStats, build_system
 
 # Load environment variables
 load_dotenv()
 
-# MongoDB setup
-MONGODB_URI = os.getenv("MONGODB_URI")
-client = MongoClient(MONGODB_URI)
-db = client.pdf_database
-pdf_collection = db.pdf_chunks
+# Must be the first Streamlit call, before the cached factories below can render a spinner
+st.set_page_config(layout="wide")
+
+# MongoDB setup: the shared pooled client connects lazily on first use
+db = get_database("pdf_database")
+
+@st.cache_resource
+def get_chunk_store():
+    store = PDFChunkStore(db, lexical_index=load_or_create("pdf_chunks"), lexical_index_path=index_path("pdf_chunks"),
+                          answer_cache=get_answer_cache())
+    store.ensure_indexes()
+    store.adopt_legacy_chunks()
+    store.collect_garbage()
+    store.sync_lexical_index()
+    return store
 
-# Anthropic setup
-anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+chunk_store = get_chunk_store()
+
+# Anthropic setup, once per process rather than once per rerun
+@st.cache_resource
+def get_anthropic_client():
+    return anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+
+anthropic_client = get_anthropic_client()
+CHAT_MODEL = "claude-3-opus-20240229"
+answer_cache = get_answer_cache()
 
 # Initialize session state
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+# What the model sees of the history: the last turns verbatim and a summary of the rest, updated in the background
+if 'memory' not in st.session_state:
+    st.session_state.memory = ConversationMemory(anthropic_summarizer(anthropic_client))
+# A new question cancels the answer still streaming for the previous one
+if 'cancel_token' not in st.session_state:
+    st.session_state.cancel_token = CancelToken()
+# Prompt cache reads and writes reported by the API, summed over the session
+if 'prompt_cache_stats' not in st.session_state:
+    st.session_state.prompt_cache_stats = PromptCacheStats()
 
 def process_pdf(file, selected_ranges):
     try:
-        pdf = PdfReader(file)
+        # Extracted once per distinct upload, then served from the extraction cache
+        pages = extract_pages(file.getvalue())
         
         text = ""
         for name, start_page, end_page in selected_ranges:
-            for page_num in range(start_page - 1, min(end_page, len(pdf.pages))):
-                text += pdf.pages[page_num].extract_text() + "\n"
+            for page_num in range(start_page - 1, min(end_page, len(pages))):
+                text += pages[page_num] + "\n"
         
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=500,
@@ -41,53 +82,80 @@ def process_pdf(file, selected_ranges):
         )
         chunks = text_splitter.split_text(text)
         
-        # Store chunks in MongoDB
-        pdf_collection.delete_many({"filename": file.name})  # Remove existing chunks for this file
-        for chunk in chunks:
-            pdf_collection.insert_one({
-                "content": chunk, 
-                "filename": file.name,
-                "sections": [name for name, _, _ in selected_ranges]
-            })
+        # Store chunks in MongoDB: bulk-written, then swapped in atomically for readers
+        stored = chunk_store.replace_file(file.name, chunks, selected_ranges, file_bytes=len(file.getvalue()))
         
-        return f"Processed and stored {len(chunks)} chunks from {file.name}"
+        return f"Processed and stored {stored} chunks from {file.name}"
     except Exception as e:
         return f"Error processing PDF: {str(e)}"
 
-def query_pdf_content(query, excluded_pdfs, max_tokens=8000):
-    all_chunks = list(pdf_collection.find({"filename": {"$nin": excluded_pdfs}}, {"content": 1, "_id": 0}))
+def catalog_overview(excluded_pdfs):
+    """The stored PDFs with their sections and page ranges. It changes only on upload, so it is part of the cached prompt prefix."""
+    lines = []
+    for summary in chunk_store.list_summaries():
+        if summary["_id"] in excluded_pdfs:
+            continue
+        lines.append(f"- {summary['_id']}")
+        page_ranges = {r["section"]: r for r in summary.get("page_ranges", [])}
+        for section in summary.get("sections", []):
+            page_range = page_ranges.get(section)
+            lines.append(f"  - {section}" + (f" (pages {page_range['start_page']}-{page_range['end_page']})" if page_range else ""))
+    return "Stored PDFs and sections:\n" + "\n".join(lines) if lines else ""
+
+def query_pdf_content(query, excluded_pdfs, max_tokens=8000, on_text=None):
+    """
+    Answer a question from the stored PDFs, streaming the answer into on_text as it is generated.
+
+    Returns the answer, or None if a newer question cancelled it.
+    """
+    should_cancel = st.session_state.cancel_token.start()
+    # The most relevant chunks first; only they are read from MongoDB
+    chunks = chunk_store.search(query, excluded=excluded_pdfs)
+    if not chunks:
+        # Nothing shares a word with the question, so fall back to the start of the documents
+        chunks = list(islice(chunk_store.iter_chunks(excluded_pdfs, {"content": 1, "filename": 1, "chunk_index": 1}),
+                             PDF_RETRIEVAL_TOP_K))
     
-    context = ""
-    for chunk in all_chunks:
-        if len(context) + len(chunk['content']) > max_tokens:
-            break
-        context += chunk['content'] + "\n"
+    # max_tokens is a token budget: the best distinct chunks that fit, neighbours joined per file.
+    # Files are laid out by name, so the same chunks always give the same text.
+    packed = pack_context([{"_id": chunk["_id"], "content": chunk["content"], "score": chunk.get("score"),
+                            "source": chunk.get("filename", ""), "position": chunk.get("chunk_index")} for chunk in chunks],
+                          max_tokens, order="source")
+    context = packed.text
     
-    chat_history = "\n".join([f"User: {msg['user']}\nAssistant: {msg['assistant']}" for msg in st.session_state.chat_history])
+    chat_history = st.session_state.memory.render()
     
-    system_prompt = f"""You are an AI assistant that answers questions based on the following PDF content and chat history:
+    # Stable to volatile: the instructions and the list of stored PDFs are cached as the prompt
+    # prefix; the PDF content retrieved for this question follows them uncached, and the history,
+    # which changes every turn, goes with the question in the messages
+    system_prompt = build_system(
+        "You are an AI assistant that answers questions based on the following PDF content and the chat history "
+        "given with the question. Answer the user's questions based on this information. If asked to create a table, "
+        "use markdown format to generate it. Be comprehensive and detailed in your responses.",
+        catalog_overview(excluded_pdfs),
+        volatile=f"PDF Content:\n{context}")
+    content = f"Chat history:\n{chat_history}\n\nQuestion: {query}" if chat_history else query
 
-PDF Content:
-{context}
-
-Chat History:
-{chat_history}
-
-Answer the user's questions based on this information. If asked to create a table, use markdown format to generate it. Be comprehensive and detailed in your responses."""
+    # The history is part of the prompt, so it is part of the key: first questions are shared
+    # across sessions, follow-ups only hit within the same conversation
+    chunk_ids = [chunk["_id"] for chunk in packed.chunks]
+    cached = answer_cache.get(query, CHAT_MODEL, chunk_ids, extra=chat_history) if answer_cache else None
+    if cached:
+        if on_text:
+            on_text(cached.answer)
+        return cached.answer
 
     try:
-        response = anthropic_client.messages.create(
-            model="claude-3-opus-20240229",
-            max_tokens=1000,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user",
-                    "content": query
-                }
-            ]
-        )
-        return response.content[0].text
+        result = stream_answer(anthropic_client, CHAT_MODEL, system_prompt, [{"role": "user", "content": content}],
+                               max_tokens=1000, on_text=on_text, should_cancel=should_cancel)
+        if result.usage:
+            st.session_state.prompt_cache_stats.record(result.usage)
+        if not result.complete:
+            return None
+        answer = result.text
+        if answer_cache:
+            answer_cache.put(query, CHAT_MODEL, chunk_ids, answer, extra=chat_history)
+        return answer
     except anthropic.BadRequestError as e:
         return f"An error occurred: {str(e)}"
 
@@ -101,8 +169,6 @@ def display_pdf(file):
         st.error(f"Error displaying PDF: {str(e)}")
 
 # Streamlit UI
-st.set_page_config(layout="wide")
-
 col1, col2 = st.columns([2, 1])
 
 with col1:
@@ -147,8 +213,13 @@ with col1:
 
     query = st.text_input("Ask a question about the PDFs:")
     if st.button("Send"):
-        answer = query_pdf_content(query, [])  # We're not using excluded_pdfs here
-        st.session_state.chat_history.append({"user": query, "assistant": answer})
+        with chat_container:
+            st.write(f"**User:** {query}")
+            placeholder = st.empty()
+        answer = query_pdf_content(query, [], on_text=lambda text: placeholder.markdown(f"**Assistant:** {text}"))  # We're not using excluded_pdfs here
+        if answer is not None:
+            st.session_state.chat_history.append({"user": query, "assistant": answer})
+            st.session_state.memory.add_turn(query, answer)
         st.experimental_rerun()
 
 with col2:
@@ -161,32 +232,35 @@ with col2:
 
     # Stored PDFs and Sections
     st.subheader("Stored PDFs and Sections")
-    stored_pdfs = pdf_collection.distinct("filename")
-    for pdf in stored_pdfs:
-        st.write(f"PDF: {pdf}")
-        sections = pdf_collection.distinct("sections", {"filename": pdf})
-        for section in sections:
-            st.write(f"- {section}")
+    # One cached find on the per-file summaries, however many PDFs are stored
+    for summary in chunk_store.list_summaries():
+        pdf = summary["_id"]
+        st.write(f"PDF: {pdf} ({summary.get('chunk_count', 0)} chunks, {summary.get('content_bytes', 0) / 1024:.0f} KB of text)")
+        page_ranges = {r["section"]: r for r in summary.get("page_ranges", [])}
+        for section in summary.get("sections", []):
+            page_range = page_ranges.get(section)
+            st.write(f"- {section}" + (f" (pages {page_range['start_page']}-{page_range['end_page']})" if page_range else ""))
         if st.button(f"Delete {pdf}", key=f"delete_{pdf}"):
-            pdf_collection.delete_many({"filename": pdf})
+            chunk_store.delete_file(pdf)
             st.success(f"Deleted {pdf}")
             st.experimental_rerun()
 
 # Connection status
 st.sidebar.title("Connection Status")
-try:
-    client.admin.command('ismaster')
+# Both checks are cached, so reruns don't ping MongoDB or spend an Anthropic request
+mongo_ok, mongo_error = check_health()
+if mongo_ok:
     st.sidebar.success("Connected to MongoDB")
-except Exception as e:
-    st.sidebar.error(f"Failed to connect to MongoDB: {e}")
-
-try:
-    anthropic_client.messages.create(
-        model="claude-3-opus-20240229",
-        max_tokens=1,
-        system="Test",
-        messages=[{"role": "user", "content": "Test"}]
-    )
+else:
+    st.sidebar.error(f"Failed to connect to MongoDB: {mongo_error}")
+
+anthropic_ok, anthropic_error = cached_check("anthropic", lambda: anthropic_client.models.list(limit=1), ttl=300)
+if anthropic_ok:
     st.sidebar.success("Anthropic API is working")
-except Exception as e:
-    st.sidebar.error(f"Failed to connect to Anthropic API: {e}")
\ No newline at end of file
+else:
+    st.sidebar.error(f"Failed to connect to Anthropic API: {anthropic_error}")
+
+prompt_cache_stats = st.session_state.prompt_cache_stats
+if prompt_cache_stats.calls:
+    st.sidebar.caption(f"Prompt cache: {prompt_cache_stats.read_ratio:.0%} of prompt tokens read from the cache "
+                       f"over {prompt_cache_stats.calls} answers")
\ No newline at end of file
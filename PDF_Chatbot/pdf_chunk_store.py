@@ -0,0 +1,361 @@
+# pdf_chunk_store.py
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.database import Database
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+
+from lexical_index import BM25Index
+from answer_cache import AnswerCache
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Chunks per insert_many call
+PDF_INSERT_BATCH_SIZE = int(os.getenv('PDF_INSERT_BATCH_SIZE', 1000))
+# Seconds the per-file summaries are reused before pdf_files is read again.
+# Writes through the store invalidate them immediately.
+PDF_SUMMARY_TTL = float(os.getenv('PDF_SUMMARY_TTL', 60))
+# Chunks returned by search() for one question
+PDF_RETRIEVAL_TOP_K = int(os.getenv('PDF_RETRIEVAL_TOP_K', 20))
+# Seconds a replaced generation is kept for readers that looked up the pointer before the switch
+PDF_GENERATION_GRACE = float(os.getenv('PDF_GENERATION_GRACE', 300))
+
+# Fields of a pointer document that describe the published generation
+PUBLISHED_FIELDS = ["generation", "previous_generation", "sections", "page_ranges", "chunk_count", "content_bytes", "file_bytes", "updated_at"]
+
+def older_than(generation: Any) -> Dict[str, Any]:
+    """Query on `generation` matching the generations older than the given one."""
+    if isinstance(generation, ObjectId):
+        return {"generation": {"$type": "objectId", "$lt": generation}}
+    return {"$or": [{"generation": {"$lt": generation}}, {"generation": {"$type": "objectId"}}]}
+
+def generation_order(generation: Any) -> Tuple[int, Any]:
+    """Sort key placing the ObjectId generations of older versions before the numbered ones."""
+    return (0, generation.binary) if isinstance(generation, ObjectId) else (1, generation)
+
+class PDFChunkStore:
+    """
+    Chunks of uploaded PDFs, replaced atomically per file.
+
+    Each upload writes its chunks under a new generation with batched insert_many
+    calls. Generations are numbered per file by a counter on the file's pointer
+    document in `pdf_files`, so newer uploads have larger generations (the
+    ObjectId generations of older versions count as older than any number).
+    Readers only see the generation named by the pointer, so a half-written
+    upload is invisible. Once every chunk is written the pointer is switched with
+    a single-document update, which MongoDB applies atomically.
+
+    The replaced generation is not deleted at the switch: a reader that looked up
+    the pointer just before may still be streaming it. It is kept until the next
+    upload of the file, or until collect_garbage() runs after the grace period.
+
+    The pointer document also holds the file's summary (sections, page ranges,
+    chunk count, sizes), so listing stored files is one find on pdf_files.
+
+    When given a lexical index, the store keeps it in step with the published
+    chunks: search() ranks chunks with BM25 in memory and reads only the top-k
+    from MongoDB. The index records which generation of each file it holds, so
+    sync_lexical_index() can catch up with uploads made by other processes.
+
+    When given an answer cache, answers built from a file's chunks are dropped
+    when the file is replaced or deleted.
+    """
+
+    def __init__(self, db: Database, batch_size: int = PDF_INSERT_BATCH_SIZE,
+                 lexical_index: Optional[BM25Index] = None, lexical_index_path: Optional[str] = None,
+                 answer_cache: Optional[AnswerCache] = None):
+        self.chunks = db.pdf_chunks
+        self.files = db.pdf_files
+        self.batch_size = batch_size
+        self.lexical_index = lexical_index
+        self.lexical_index_path = lexical_index_path
+        self.answer_cache = answer_cache
+        self._summaries: Optional[List[Dict[str, Any]]] = None
+        self._summaries_loaded_at = 0.0
+        self._summaries_lock = threading.Lock()
+
+    def ensure_indexes(self):
+        """Index the (filename, generation) pairs readers and cleanup filter on."""
+        self.chunks.create_index([("filename", ASCENDING), ("generation", ASCENDING)], name="filename_generation")
+
+    def adopt_legacy_chunks(self) -> int:
+        """
+        Give chunks written before generations existed a generation and a pointer, so readers keep seeing them.
+
+        Returns:
+            int: The number of files adopted.
+        """
+        adopted = 0
+        for filename in self.chunks.distinct("filename", {"generation": {"$exists": False}}):
+            generation = self._next_generation(filename)
+            self.chunks.update_many({"filename": filename, "generation": {"$exists": False}},
+                                    {"$set": {"generation": generation}})
+            # One-off per legacy file, so the summary is computed from the chunks directly
+            sizes = [len(doc.get("content", "").encode('utf-8')) for doc in
+                     self.chunks.find({"filename": filename, "generation": generation}, {"content": 1, "_id": 0})]
+            result = self.files.update_one({"_id": filename, "generation": {"$exists": False}}, {"$set": {
+                "generation": generation,
+                "sections": self.chunks.distinct("sections", {"filename": filename, "generation": generation}),
+                "page_ranges": [],
+                "chunk_count": len(sizes),
+                "content_bytes": sum(sizes),
+                "updated_at": datetime.now(timezone.utc)
+            }})
+            if result.matched_count:
+                adopted += 1
+            else:
+                # The file has a newer upload; the legacy chunks are garbage
+                self.chunks.delete_many({"filename": filename, "generation": generation})
+        if adopted:
+            self.invalidate_summaries()
+            logger.info(f"Adopted legacy chunks of {adopted} files")
+        return adopted
+
+    def replace_file(self, filename: str, chunks: Sequence[str], page_ranges: Sequence[Tuple[str, int, int]],
+                     file_bytes: int = 0) -> int:
+        """
+        Replace a file's chunks without readers ever seeing a partial set.
+
+        Args:
+            filename (str): The uploaded file's name.
+            chunks (Sequence[str]): The chunk texts, in document order.
+            page_ranges (Sequence[Tuple[str, int, int]]): The (section name, start page, end page) ranges the chunks came from.
+            file_bytes (int): Size of the uploaded PDF, for the summary.
+
+        Returns:
+            int: The number of chunks stored.
+        """
+        generation = self._next_generation(filename)
+        sections = [name for name, _, _ in page_ranges]
+        chunk_ids = []
+        try:
+            for i in range(0, len(chunks), self.batch_size):
+                result = self.chunks.insert_many([{
+                    "content": chunk,
+                    "filename": filename,
+                    "sections": sections,
+                    "generation": generation,
+                    "chunk_index": i + offset
+                } for offset, chunk in enumerate(chunks[i:i+self.batch_size])], ordered=False)
+                chunk_ids.extend(result.inserted_ids)
+            summary = {
+                "sections": sections,
+                "page_ranges": [{"section": name, "start_page": start, "end_page": end} for name, start, end in page_ranges],
+                "chunk_count": len(chunks),
+                "content_bytes": sum(len(chunk.encode('utf-8')) for chunk in chunks),
+                "file_bytes": file_bytes
+            }
+            published = self._publish(filename, generation, summary)
+        except Exception:
+            # Whatever failed (a write error, a lost connection, a timeout), the unpublished chunks are garbage
+            self._discard(filename, generation)
+            raise
+        self.invalidate_summaries()
+        if not published:
+            # A newer upload of the same file was published while this one was writing
+            self._discard(filename, generation)
+            logger.info(f"Discarded superseded upload of {filename}")
+            return 0
+        self._invalidate_answers({"filename": filename, **older_than(generation)})
+        removed = self.collect_garbage(filename)
+        logger.info(f"Stored {len(chunks)} chunks of {filename}, removed {removed} old chunks")
+        self._index_file(filename, generation, zip(chunk_ids, chunks))
+        self._save_lexical_index()
+        return len(chunks)
+
+    def _next_generation(self, filename: str) -> int:
+        """Allocate the file's next generation number, creating its pointer document (unpublished) if needed."""
+        pointer = self.files.find_one_and_update({"_id": filename}, {"$inc": {"next_generation": 1}},
+                                                 projection={"next_generation": 1}, upsert=True,
+                                                 return_document=ReturnDocument.AFTER)
+        return pointer["next_generation"]
+
+    def _publish(self, filename: str, generation: int, fields: Dict[str, Any]) -> bool:
+        """
+        Point the file at `generation` unless it already points at a newer one. Returns whether it did.
+
+        The replaced generation is then recorded as previous_generation, which
+        collect_garbage() keeps through the grace period.
+        """
+        pointer = {**fields, "generation": generation, "previous_generation": None, "updated_at": datetime.now(timezone.utc)}
+        before = self.files.find_one_and_update({"_id": filename, "$or": [{"generation": {"$exists": False}},
+                                                                          older_than(generation)]},
+                                                {"$set": pointer}, projection={"generation": 1},
+                                                return_document=ReturnDocument.BEFORE)
+        if before is None:
+            return False
+        if before.get("generation") is not None:
+            self.files.update_one({"_id": filename, "generation": generation},
+                                  {"$set": {"previous_generation": before["generation"]}})
+        return True
+
+    def _discard(self, filename: str, generation: int):
+        """Delete the chunks of an upload that was not published, unless the pointer does name it after all."""
+        try:
+            # A publish that raised (e.g. on a lost connection) may still have been applied
+            if self.files.find_one({"_id": filename, "generation": generation}, {"_id": 1}) is None:
+                self.chunks.delete_many({"filename": filename, "generation": generation})
+        except Exception as e:
+            logger.error(f"Error discarding upload of {filename}; collect_garbage() will remove it later: {str(e)}")
+
+    def collect_garbage(self, filename: Optional[str] = None, grace: float = PDF_GENERATION_GRACE) -> int:
+        """
+        Delete replaced generations no reader can still be streaming.
+
+        The generation replaced by the current one is kept for `grace` seconds after
+        the switch; older ones, including uploads that failed before publishing, are
+        deleted. Uploads still being written have newer generations than the
+        published one and are left alone.
+
+        Args:
+            filename (Optional[str]): The file to clean up, or None for every published file.
+            grace (float): Seconds to keep the replaced generation.
+
+        Returns:
+            int: The number of chunks deleted.
+        """
+        query = {"generation": {"$exists": True}}
+        if filename is not None:
+            query["_id"] = filename
+        deleted = 0
+        for pointer in self.files.find(query, {"generation": 1, "previous_generation": 1, "updated_at": 1}):
+            older = {"filename": pointer["_id"], **older_than(pointer["generation"])}
+            generations = sorted(self.chunks.distinct("generation", older), key=generation_order)
+            updated_at = pointer.get("updated_at")
+            if updated_at is not None and updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)  # MongoDB returns naive UTC datetimes
+            if generations and updated_at is not None and \
+                    (datetime.now(timezone.utc) - updated_at).total_seconds() < grace:
+                # The replaced generation; pointers published before it was recorded keep the newest older one
+                replaced = pointer.get("previous_generation")
+                generations.remove(replaced if replaced in generations else generations[-1])
+            if generations:
+                deleted += self.chunks.delete_many({"filename": pointer["_id"],
+                                                    "generation": {"$in": generations}}).deleted_count
+        return deleted
+
+    def _invalidate_answers(self, chunk_filter: Dict[str, Any]):
+        """Drop cached answers built from the chunks matching the filter, before they are deleted."""
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate_chunks(doc["_id"] for doc in self.chunks.find(chunk_filter, {"_id": 1}))
+
+    def _index_file(self, filename: str, generation: Any, chunks: Iterator[Tuple[ObjectId, str]]):
+        """Replace a file's chunks in the lexical index."""
+        if self.lexical_index is None:
+            return
+        self.lexical_index.remove_where("filename", filename)
+        self.lexical_index.add_many((str(chunk_id), content, {"filename": filename}) for chunk_id, content in chunks)
+        self.lexical_index.meta.setdefault("generations", {})[filename] = str(generation)
+
+    def _save_lexical_index(self):
+        if self.lexical_index is not None and self.lexical_index_path and self.lexical_index.dirty:
+            try:
+                self.lexical_index.save(self.lexical_index_path)
+            except Exception as e:
+                logger.error(f"Error saving lexical index: {str(e)}")
+
+    def sync_lexical_index(self) -> int:
+        """
+        Bring the lexical index in line with the published generations, reading only files that changed.
+
+        The published generations come from the cached summaries, so calling this
+        before every search costs nothing until the summaries expire.
+
+        Returns:
+            int: The number of files re-indexed or dropped.
+        """
+        if self.lexical_index is None:
+            return 0
+        published = {doc["_id"]: doc["generation"] for doc in self.list_summaries()}
+        indexed = self.lexical_index.meta.setdefault("generations", {})
+        changed = 0
+        for filename in [name for name in indexed if name not in published]:
+            self.lexical_index.remove_where("filename", filename)
+            del indexed[filename]
+            changed += 1
+        for filename, generation in published.items():
+            if indexed.get(filename) != str(generation):
+                docs = self.chunks.find({"filename": filename, "generation": generation}, {"content": 1})
+                self._index_file(filename, generation, ((doc["_id"], doc["content"]) for doc in docs))
+                changed += 1
+        if changed:
+            logger.info(f"Synced {changed} files into the lexical index")
+            self._save_lexical_index()
+        return changed
+
+    def search(self, query: str, k: int = PDF_RETRIEVAL_TOP_K, excluded: Sequence[str] = ()) -> List[Dict[str, Any]]:
+        """
+        Rank published chunks against a query with BM25 and fetch only the top k.
+
+        The excluded files are filtered inside the index, before ranking.
+
+        Returns:
+            List[Dict[str, Any]]: The chunks (_id, content, filename, chunk_index) with a "score", best first.
+                                  Empty when no chunk shares a term with the query.
+        """
+        if self.lexical_index is None:
+            return []
+        self.sync_lexical_index()
+        ranked = self.lexical_index.search(query, k, exclude={"filename": list(excluded)})
+        if not ranked:
+            return []
+        ids = [ObjectId(doc_id) for doc_id, _ in ranked]
+        found = {doc["_id"]: doc for doc in self.chunks.find({"_id": {"$in": ids}}, {"content": 1, "filename": 1, "chunk_index": 1})}
+        return [{**found[chunk_id], "score": score} for chunk_id, (_, score) in zip(ids, ranked) if chunk_id in found]
+
+    def current_generations(self, excluded: Sequence[str] = ()) -> Dict[str, Any]:
+        """The published generation of every file not in `excluded`, by filename."""
+        return {doc["_id"]: doc["generation"] for doc in
+                self.files.find({"_id": {"$nin": list(excluded)}, "generation": {"$exists": True}}, {"generation": 1})}
+
+    def iter_chunks(self, excluded: Sequence[str] = (), projection: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """Stream the published chunks of every file not in `excluded`."""
+        generations = self.current_generations(excluded)
+        if not generations:
+            return iter(())
+        return self.chunks.find({"$or": [{"filename": filename, "generation": generation}
+                                         for filename, generation in generations.items()]},
+                                projection or {"content": 1, "_id": 0})
+
+    def list_summaries(self, max_age: float = PDF_SUMMARY_TTL) -> List[Dict[str, Any]]:
+        """
+        Summaries of the published files, sorted by filename, from one find on pdf_files.
+
+        The result is shared by every session of the process and reused for max_age
+        seconds; writes through this store refresh it on the next call.
+
+        Returns:
+            List[Dict[str, Any]]: Pointer documents with _id (the filename), generation, sections,
+                                  page_ranges, chunk_count, content_bytes, file_bytes and updated_at.
+        """
+        with self._summaries_lock:
+            if self._summaries is None or time.monotonic() - self._summaries_loaded_at > max_age:
+                self._summaries = list(self.files.find({"generation": {"$exists": True}}).sort("_id", ASCENDING))
+                self._summaries_loaded_at = time.monotonic()
+            return self._summaries
+
+    def invalidate_summaries(self):
+        with self._summaries_lock:
+            self._summaries = None
+
+    def delete_file(self, filename: str):
+        """Unpublish a file, then delete its chunks. The pointer keeps its generation counter."""
+        self.files.update_one({"_id": filename}, {"$unset": {field: "" for field in PUBLISHED_FIELDS}})
+        self.invalidate_summaries()
+        self._invalidate_answers({"filename": filename})
+        self.chunks.delete_many({"filename": filename})
+        if self.lexical_index is not None:
+            self.lexical_index.remove_where("filename", filename)
+            self.lexical_index.meta.get("generations", {}).pop(filename, None)
+            self._save_lexical_index()
@@ -0,0 +1,309 @@
+# ann_index.py
+
+import os
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+from ingestion_manifest import MANIFEST_PATH
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Indexes are persisted next to the ingestion manifest, one file per manufacturer
+ANN_INDEX_DIR = Path(os.getenv('ANN_INDEX_DIR', MANIFEST_PATH.parent / 'ann'))
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', 16))
+# Below this many vectors a flat scan is as fast as probing lists, so the index stays untrained
+ANN_MIN_TRAIN_SIZE = int(os.getenv('ANN_MIN_TRAIN_SIZE', 1024))
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so dot product equals cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, using argpartition."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+class IVFFlatIndex:
+    """
+    Inverted-file index over L2-normalized float32 vectors (cosine similarity).
+
+    Vectors are clustered into `nlist` k-means cells. A query scores the cell
+    centroids, then scans only the vectors in its `nprobe` best cells. Upserts
+    assign new vectors to their nearest existing centroid, so updates are cheap.
+    The centroids are retrained once the index has grown 4x since the last training.
+    Collections smaller than ANN_MIN_TRAIN_SIZE are searched exhaustively.
+    """
+
+    def __init__(self, nprobe: int = ANN_NPROBE, min_train_size: int = ANN_MIN_TRAIN_SIZE):
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.ids: List[Any] = []
+        # Row storage grows by doubling so incremental upserts stay amortized O(batch)
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self.dirty = False
+        # The data version the vectors reflect, saved with the index
+        self.version: Optional[str] = None
+        self._row_of: Dict[Any, int] = {}
+        self._lists: Optional[List[np.ndarray]] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._matrix[:len(self.ids)]
+
+    @vectors.setter
+    def vectors(self, matrix: np.ndarray):
+        self._matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+    def _append_rows(self, vectors: np.ndarray):
+        n, needed = len(self.ids), len(self.ids) + len(vectors)
+        if needed > len(self._matrix):
+            grown = np.zeros((max(needed, 2 * len(self._matrix), 64), vectors.shape[1]), dtype=np.float32)
+            if n:
+                grown[:n] = self._matrix[:n]
+            self._matrix = grown
+        self._matrix[n:needed] = vectors
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def train(self, iterations: int = 10, sample_size: int = 20000, seed: int = 0):
+        """Run spherical k-means on (a sample of) the indexed vectors and reassign every vector."""
+        with self._lock:
+            n = len(self.ids)
+            nlist = max(1, min(4096, int(4 * np.sqrt(n))))
+            rng = np.random.default_rng(seed)
+            sample = self.vectors[rng.choice(n, size=min(n, sample_size), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=min(nlist, len(sample)), replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = np.bincount(labels, minlength=len(centroids)) == 0
+                sums[empty] = centroids[empty]  # Keep empty cells where they were
+                centroids = normalize_rows(sums)
+            self.centroids = centroids
+            self.assignments = self._assign(self.vectors)
+            self.trained_size = n
+            self._lists = None
+            self.dirty = True
+            logger.info(f"Trained IVF index: {n} vectors in {len(centroids)} lists")
+
+    def upsert(self, ids: Sequence[Any], vectors: np.ndarray):
+        """Add vectors, replacing any existing vector with the same ID."""
+        if len(ids) == 0:
+            return
+        vectors = normalize_rows(vectors)
+        with self._lock:
+            new_rows = []
+            for i, doc_id in enumerate(ids):
+                row = self._row_of.get(doc_id)
+                if row is None:
+                    new_rows.append(i)
+                else:
+                    self.vectors[row] = vectors[i]
+                    if self.trained:
+                        self.assignments[row] = self._assign(vectors[i:i+1])[0]
+            if new_rows:
+                self._append_rows(vectors[new_rows])
+                start = len(self.ids)
+                for offset, i in enumerate(new_rows):
+                    self.ids.append(ids[i])
+                    self._row_of[ids[i]] = start + offset
+                if self.trained:
+                    self.assignments = np.concatenate([self.assignments, self._assign(vectors[new_rows])])
+            self._lists = None
+            self.dirty = True
+
+            n = len(self.ids)
+            if (not self.trained and n >= self.min_train_size) or (self.trained and n >= 4 * self.trained_size):
+                self.train()
+
+    def remove(self, ids: Sequence[Any]) -> int:
+        """Remove vectors by ID. Unknown IDs are ignored."""
+        with self._lock:
+            rows = [self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of]
+            if not rows:
+                return 0
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[rows] = False
+            self.vectors = self.vectors[keep]
+            self.ids = [doc_id for doc_id, kept in zip(self.ids, keep) if kept]
+            if self.trained:
+                self.assignments = self.assignments[keep]
+            self._row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            self._lists = None
+            self.dirty = True
+            return len(rows)
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+        return self._lists
+
+    def search(self, query: np.ndarray, k: int = 5, nprobe: Optional[int] = None) -> Tuple[List[Any], np.ndarray]:
+        """
+        Approximate top-k by cosine similarity.
+
+        Returns:
+            Tuple[List[Any], np.ndarray]: The IDs and scores of the best matches, best first.
+        """
+        query = normalize_rows(query)[0]
+        with self._lock:
+            if len(self.ids) == 0:
+                return [], np.zeros(0, dtype=np.float32)
+            if not self.trained:
+                rows = np.arange(len(self.ids))
+            else:
+                lists = self._inverted_lists()
+                probe = top_k(self.centroids @ query, nprobe or self.nprobe)
+                rows = np.concatenate([lists[c] for c in probe])
+            scores = self.vectors[rows] @ query
+            best = top_k(scores, k)
+            return [self.ids[rows[i]] for i in best], scores[best]
+
+    def search_exact(self, query: np.ndarray, k: int = 5) -> Tuple[List[Any], np.ndarray]:
+        """Brute-force top-k over every vector, for measuring recall."""
+        query = normalize_rows(query)[0]
+        with self._lock:
+            scores = self.vectors @ query
+            best = top_k(scores, k)
+            return [self.ids[i] for i in best], scores[best]
+
+    def save(self, path: Path):
+        """Write the index atomically to an .npz file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp.npz")
+        with self._lock:
+            np.savez(tmp_path,
+                     ids=np.array([str(doc_id) for doc_id in self.ids]),
+                     vectors=self.vectors,
+                     centroids=self.centroids if self.trained else np.zeros((0, 0), dtype=np.float32),
+                     assignments=self.assignments,
+                     trained_size=np.array(self.trained_size),
+                     version=np.array(self.version or ""))
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "IVFFlatIndex":
+        """Load an index written by save()."""
+        index = cls(**kwargs)
+        with np.load(path) as data:
+            index.ids = data["ids"].tolist()
+            index.vectors = data["vectors"].astype(np.float32)
+            index.centroids = data["centroids"] if data["centroids"].size else None
+            index.assignments = data["assignments"].astype(np.int32)
+            index.trained_size = int(data["trained_size"])
+            version = str(data["version"]) if "version" in data.files else ""
+        index.version = version or None
+        index._row_of = {doc_id: row for row, doc_id in enumerate(index.ids)}
+        return index
+
+def index_path(manufacturer: str) -> Path:
+    return ANN_INDEX_DIR / f"{manufacturer}.npz"
+
+def evaluate(index: IVFFlatIndex, queries: np.ndarray, k: int = 10, nprobe: Optional[int] = None) -> Dict[str, float]:
+    """
+    Compare approximate search with exact brute-force search.
+
+    Returns:
+        Dict[str, float]: recall@k and mean/p95 latency in milliseconds for both searches.
+    """
+    recalls, ann_times, exact_times = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        approx_ids, _ = index.search(query, k, nprobe)
+        ann_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        exact_ids, _ = index.search_exact(query, k)
+        exact_times.append(time.perf_counter() - start)
+        recalls.append(len(set(approx_ids) & set(exact_ids)) / max(1, len(exact_ids)))
+    return {
+        "recall": float(np.mean(recalls)),
+        "ann_ms_mean": float(np.mean(ann_times) * 1000),
+        "ann_ms_p95": float(np.percentile(ann_times, 95) * 1000),
+        "exact_ms_mean": float(np.mean(exact_times) * 1000),
+        "exact_ms_p95": float(np.percentile(exact_times, 95) * 1000)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and benchmark the local ANN index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Rebuild a manufacturer's index from MongoDB")
+    build_parser.add_argument("--manufacturer", required=True)
+    bench_parser = subparsers.add_parser("benchmark", help="Report recall and latency against brute force")
+    bench_parser.add_argument("--manufacturer", help="Benchmark the persisted index of this manufacturer")
+    bench_parser.add_argument("--synthetic", type=int, default=0, help="Benchmark on N random clustered vectors instead")
+    bench_parser.add_argument("--dim", type=int, default=1024)
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--k", type=int, default=10)
+    bench_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from mongodb_integration import MongoDBHandler
+        mongo_handler = MongoDBHandler()
+        mongo_handler.connect()
+        try:
+            index = mongo_handler.build_ann_index(args.manufacturer)
+            print(f"Built index for {args.manufacturer}: {len(index)} vectors")
+        finally:
+            mongo_handler.close_connection()
+        return
+
+    rng = np.random.default_rng(42)
+    if args.synthetic:
+        centers = normalize_rows(rng.standard_normal((64, args.dim)))
+        vectors = centers[rng.integers(0, 64, args.synthetic)] + 0.08 * rng.standard_normal((args.synthetic, args.dim))
+        index = IVFFlatIndex()
+        index.upsert([f"v{i}" for i in range(args.synthetic)], vectors)
+    elif args.manufacturer:
+        index = IVFFlatIndex.load(index_path(args.manufacturer))
+    else:
+        parser.error("benchmark needs --manufacturer or --synthetic")
+    # Queries are perturbed copies of indexed vectors, like paraphrased questions
+    sample = index.vectors[rng.choice(len(index), size=min(args.queries, len(index)), replace=False)]
+    queries = sample + 0.05 * rng.standard_normal(sample.shape).astype(np.float32)
+
+    print(f"{len(index)} vectors, {len(index.centroids) if index.trained else 0} lists, k={args.k}")
+    for nprobe in args.nprobe:
+        result = evaluate(index, queries, args.k, nprobe)
+        print(f"nprobe={nprobe:>3}  recall@{args.k}={result['recall']:.3f}  "
+              f"ann={result['ann_ms_mean']:.2f}ms (p95 {result['ann_ms_p95']:.2f})  "
+              f"exact={result['exact_ms_mean']:.2f}ms (p95 {result['exact_ms_p95']:.2f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# answer_cache.py
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence
+import numpy as np
+from dotenv import load_dotenv
+
+from cache_paths import CACHE_DIR
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_PATH = Path(os.getenv('ANSWER_CACHE_PATH', CACHE_DIR / 'answers.sqlite3'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 10000))
+# Seconds an answer is served after it was generated
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 7 * 24 * 3600))
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') != '0'
+# Cosine similarity between query embeddings above which a differently worded question
+# over the same chunks reuses an answer; 0 disables the semantic path
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv('ANSWER_CACHE_SEMANTIC_THRESHOLD', 0.95))
+
+# SQLite limits the number of parameters per statement
+_LOOKUP_BATCH = 500
+
+def normalize_query(query: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation, so trivially different questions share a key."""
+    return re.sub(r"[\s?!.]+$", "", " ".join(query.lower().split()))
+
+def context_key(model: str, chunk_ids: Iterable[Any], extra: str = "") -> str:
+    """Key of what an answer was generated from: the model, the set of chunk IDs and any other prompt input."""
+    ids = "\0".join(sorted({str(chunk_id) for chunk_id in chunk_ids}))
+    return hashlib.sha256(f"{model}\0{extra}\0{ids}".encode('utf-8')).hexdigest()
+
+def answer_key(query: str, context: str) -> str:
+    return hashlib.sha256(f"{context}\0{normalize_query(query)}".encode('utf-8')).hexdigest()
+
+@dataclass
+class CachedAnswer:
+    """An answer served from the cache."""
+    answer: str
+    # "exact" for the same normalized question, "semantic" for a similar one
+    match: str
+    similarity: float
+    age_s: float
+
+class AnswerCache:
+    """
+    Local SQLite cache of LLM answers keyed by (normalized query, chunk IDs, model).
+
+    Because the retrieved chunk IDs are part of the key, an answer is only reused
+    when the question would be answered from exactly the same evidence. The
+    semantic path relaxes the question, not the evidence: among answers generated
+    from the same chunks, one whose query embedding is close enough is reused.
+
+    Entries expire ttl seconds after they were written, hits refresh last_used,
+    and beyond max_entries the least recently used tenth is evicted. Chunk IDs are
+    recorded per answer, so re-ingesting or deleting chunks drops every answer
+    built from them via invalidate_chunks().
+    """
+
+    def __init__(self, path: Path = ANSWER_CACHE_PATH, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl: float = ANSWER_CACHE_TTL, semantic_threshold: float = ANSWER_CACHE_SEMANTIC_THRESHOLD):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                context TEXT NOT NULL,
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                query_vector BLOB,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_chunks (
+                key TEXT NOT NULL REFERENCES answers (key) ON DELETE CASCADE,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (chunk_id, key)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answer_chunks_key ON answer_chunks (key)")
+        self._conn.commit()
+
+    def get(self, query: str, model: str, chunk_ids: Sequence[Any], query_vector: Optional[Sequence[float]] = None,
+            extra: str = "") -> Optional[CachedAnswer]:
+        """
+        Look up the answer to a question over the given chunks.
+
+        Args:
+            query (str): The user's question.
+            model (str): The model that would answer it.
+            chunk_ids (Sequence[Any]): IDs of the chunks sent as context; order doesn't matter.
+            query_vector (Optional[Sequence[float]]): The question's embedding, enabling the semantic path.
+            extra (str): Any other prompt input the answer depends on, e.g. the chat history.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer, or None on a miss.
+        """
+        context = context_key(model, chunk_ids, extra)
+        key = answer_key(query, context)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT answer, created_at FROM answers WHERE key = ? AND created_at > ?",
+                                     (key, now - self.ttl)).fetchone()
+            hit = CachedAnswer(row[0], "exact", 1.0, now - row[1]) if row else None
+            if hit is None and query_vector is not None and self.semantic_threshold > 0:
+                hit, key = self._semantic_lookup(context, query_vector, now)
+            if hit is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            if hit.match == "semantic":
+                self.semantic_hits += 1
+        return hit
+
+    def _semantic_lookup(self, context: str, query_vector: Sequence[float], now: float):
+        # Called with the lock held. Only answers over the same chunks are candidates,
+        # so this scans a handful of rows through the context index.
+        rows = self._conn.execute(
+            "SELECT key, query_vector, answer, created_at FROM answers "
+            "WHERE context = ? AND query_vector IS NOT NULL AND created_at > ?", (context, now - self.ttl)).fetchall()
+        query = np.asarray(query_vector, dtype=np.float32)
+        # Vectors from another embedding model have another size and can't be compared
+        rows = [row for row in rows if len(row[1]) == query.nbytes]
+        if not rows or not np.any(query):
+            return None, None
+        matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        similarities = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.semantic_threshold:
+            return None, None
+        key, _, answer, created_at = rows[best]
+        return CachedAnswer(answer, "semantic", float(similarities[best]), now - created_at), key
+
+    def put(self, query: str, model: str, chunk_ids: Sequence[Any], answer: str,
+            query_vector: Optional[Sequence[float]] = None, extra: str = ""):
+        """Store an answer, evicting least recently used entries if over budget. Arguments match get()."""
+        context = context_key(model, chunk_ids, extra)
+        key = answer_key(query, context)
+        vector = np.asarray(query_vector, dtype=np.float32).tobytes() if query_vector is not None else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, context, model, normalize_query(query), vector, answer, now, now))
+            self._conn.execute("DELETE FROM answer_chunks WHERE key = ?", (key,))
+            self._conn.executemany("INSERT OR IGNORE INTO answer_chunks VALUES (?, ?)",
+                                   [(key, chunk_id) for chunk_id in {str(chunk_id) for chunk_id in chunk_ids}])
+            self._conn.commit()
+            self._evict(now)
+
+    def invalidate_chunks(self, chunk_ids: Iterable[Any]) -> int:
+        """
+        Drop every answer generated from any of these chunks, e.g. after they were re-ingested or deleted.
+
+        Returns:
+            int: The number of answers dropped.
+        """
+        ids = [str(chunk_id) for chunk_id in chunk_ids]
+        removed = 0
+        with self._lock:
+            for i in range(0, len(ids), _LOOKUP_BATCH):
+                batch = ids[i:i+_LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                removed += self._conn.execute(
+                    f"DELETE FROM answers WHERE key IN (SELECT key FROM answer_chunks WHERE chunk_id IN ({placeholders}))",
+                    batch).rowcount
+            self._conn.commit()
+        if removed:
+            logger.info(f"Invalidated {removed} cached answers")
+        return removed
+
+    def _evict(self, now: float):
+        # Called with the lock held
+        self._conn.execute("DELETE FROM answers WHERE created_at <= ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            target = int(self.max_entries * 0.9)
+            self._conn.execute("""
+                DELETE FROM answers WHERE key IN (
+                    SELECT key FROM answers ORDER BY last_used ASC LIMIT ?
+                )
+            """, (count - target,))
+            logger.info(f"Evicted {count - target} answers from the cache")
+        self._conn.commit()
+
+    def clear(self) -> int:
+        """Remove every answer."""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM answers").rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counts for this process and the size of the cache."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            models = dict(self._conn.execute("SELECT model, COUNT(*) FROM answers GROUP BY model").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "models": models
+        }
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache() -> Optional[AnswerCache]:
+    """Return the process-wide answer cache, or None when ANSWER_CACHE_ENABLED=0."""
+    global _default_cache
+    if _default_cache is None and ANSWER_CACHE_ENABLED:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = AnswerCache()
+    return _default_cache
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and clear the answer cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show entry count and models")
+    subparsers.add_parser("clear", help="Remove every cached answer")
+    args = parser.parse_args()
+
+    cache = AnswerCache()
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"Cache file: {cache.path}")
+        print(f"Entries: {stats['entries']} of {cache.max_entries}, TTL {cache.ttl / 3600:.1f} h")
+        for model, count in stats["models"].items():
+            print(f"  {model}: {count}")
+    elif args.command == "clear":
+        print(f"Removed {cache.clear()} answers")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# cache_paths.py
+
+import os
+from pathlib import Path
+
+# Root of the repository (the directory that contains src/ and data/)
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# All local caches, manifests and indexes live under this directory
+CACHE_DIR = Path(os.getenv('CACHE_DIR', PROJECT_ROOT / '.cache'))
+
+def cache_path(*parts: str) -> Path:
+    """
+    Return a path inside CACHE_DIR, creating its parent directory if needed.
+    """
+    path = CACHE_DIR.joinpath(*parts)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,201 @@
+# context_packer.py
+
+import os
+import re
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# tiktoken encoding used to count tokens. Claude's tokenizer is not available locally,
+# so counts are scaled by CONTEXT_TOKEN_SAFETY to stay under the real budget.
+CONTEXT_TOKENIZER = os.getenv('CONTEXT_TOKENIZER', 'cl100k_base')
+CONTEXT_TOKEN_SAFETY = float(os.getenv('CONTEXT_TOKEN_SAFETY', 1.1))
+# Chunks at least this similar (Jaccard over word shingles) to an already packed chunk are skipped
+CONTEXT_DEDUPE_THRESHOLD = float(os.getenv('CONTEXT_DEDUPE_THRESHOLD', 0.8))
+SHINGLE_SIZE = 3
+
+_HEURISTIC_RE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+def heuristic_token_count(text: str) -> int:
+    """
+    Estimate BPE tokens without a tokenizer: short words are one token, long words
+    one per 6 letters, numbers one per 3 digits and punctuation one each. It tends
+    to overcount slightly, which is the safe side for a budget.
+    """
+    count = 0
+    for piece in _HEURISTIC_RE.findall(text):
+        if piece[0].isalpha():
+            count += 1 + (len(piece) - 1) // 6
+        elif piece[0].isdigit():
+            count += (len(piece) + 2) // 3
+        else:
+            count += 1
+    return count
+
+@lru_cache(maxsize=None)
+def get_token_counter(encoding: str = CONTEXT_TOKENIZER) -> Callable[[str], int]:
+    """
+    Return a function that counts tokens with tiktoken, or the heuristic when tiktoken
+    or its encoding file is unavailable (it is downloaded on first use; set
+    TIKTOKEN_CACHE_DIR to ship it with an offline deployment).
+    """
+    try:
+        import tiktoken
+        tokenizer = tiktoken.get_encoding(encoding)
+        logger.info(f"Counting context tokens with tiktoken '{encoding}'")
+        return lambda text: len(tokenizer.encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable ({str(e)}), estimating context tokens heuristically")
+        return heuristic_token_count
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the default counter."""
+    return get_token_counter()(text)
+
+def truncate_to_tokens(text: str, max_tokens: int, counter: Optional[Callable[[str], int]] = None) -> str:
+    """Keep the start of text, cut at a word boundary to at most max_tokens."""
+    counter = counter or get_token_counter()
+    if counter(text) <= max_tokens:
+        return text
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if counter(" ".join(words[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """Word n-grams of the lower-cased, whitespace-normalized text."""
+    words = text.lower().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i+size]) for i in range(len(words) - size + 1)}
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def trim_overlap(previous: str, following: str, max_overlap: int = 400, min_overlap: int = 20) -> str:
+    """
+    Drop the start of `following` that repeats the end of `previous`.
+
+    Adjacent chunks from the text splitter overlap by up to chunk_overlap characters,
+    so joining them verbatim pays for the same text twice.
+    """
+    longest = min(max_overlap, len(previous), len(following))
+    for size in range(longest, min_overlap - 1, -1):
+        if previous.endswith(following[:size]):
+            return following[size:]
+    return following
+
+@dataclass
+class PackedContext:
+    """Outcome of pack_context."""
+    text: str = ""
+    # The packed chunks, in the order they appear in text
+    chunks: List[Dict[str, Any]] = field(default_factory=list)
+    tokens_used: int = 0
+    budget: int = 0
+    skipped_duplicates: int = 0
+    skipped_over_budget: int = 0
+
+def default_header(source: str, first: Dict[str, Any], last: Dict[str, Any]) -> str:
+    return f"[{source}]" if source else ""
+
+def pack_context(chunks: Sequence[Dict[str, Any]], budget: int,
+                 counter: Optional[Callable[[str], int]] = None,
+                 dedupe_threshold: float = CONTEXT_DEDUPE_THRESHOLD,
+                 header: Callable[[str, Dict[str, Any], Dict[str, Any]], str] = default_header,
+                 separator: str = "\n\n", safety: float = CONTEXT_TOKEN_SAFETY, order: str = "score") -> PackedContext:
+    """
+    Pack the best chunks into a token budget.
+
+    Chunks are taken by descending "score" (input order when absent). A chunk is
+    skipped if it nearly duplicates one already packed, or if it no longer fits;
+    smaller chunks further down may still fit. The packed chunks are then laid out
+    by source, in the order of each source's best chunk, and chunks with consecutive
+    "position" values are joined into one passage with their overlap removed, so
+    neighbouring text reads continuously under a single header. With order="source"
+    sources are sorted by name instead, so the same chunks always give the same text,
+    whatever their scores, and a cached prompt prefix can be reused.
+
+    Args:
+        chunks (Sequence[Dict[str, Any]]): Dicts with "content" and optionally "score",
+                                           "source" (e.g. the filename) and "position" (chunk index).
+        budget (int): Maximum tokens of the returned text.
+        counter (Optional[Callable[[str], int]]): Token counter. Default is get_token_counter().
+        dedupe_threshold (float): Shingle Jaccard similarity at which a chunk counts as a duplicate.
+        header (Callable): Builds the line above each passage from (source, first chunk, last chunk).
+        separator (str): Text between passages.
+        safety (float): Counted tokens are multiplied by this before comparing with the budget.
+        order (str): "score" to lay out the best sources first, "source" for a stable order.
+
+    Returns:
+        PackedContext: The text, the packed chunks, tokens used and what was skipped.
+    """
+    counter = counter or get_token_counter()
+    result = PackedContext(budget=budget)
+    ranked = sorted(enumerate(chunks), key=lambda item: (-(item[1].get("score") or 0.0), item[0]))
+
+    # Selection: every chunk is costed with its own header and separator, an upper
+    # bound on its share of the final text, where adjacent chunks share a header
+    selected: List[Dict[str, Any]] = []
+    selected_shingles: List[Set[str]] = []
+    remaining = budget / safety
+    for _, chunk in ranked:
+        content = chunk.get("content") or ""
+        chunk_shingles = shingles(content)
+        if any(jaccard(chunk_shingles, other) >= dedupe_threshold for other in selected_shingles):
+            result.skipped_duplicates += 1
+            continue
+        cost = counter(content) + counter(header(chunk.get("source", ""), chunk, chunk)) + counter(separator) + 1
+        if cost > remaining:
+            result.skipped_over_budget += 1
+            continue
+        remaining -= cost
+        selected.append(chunk)
+        selected_shingles.append(chunk_shingles)
+
+    # Layout: group by source, then join runs of consecutive positions
+    source_order: List[str] = []
+    by_source: Dict[str, List[Dict[str, Any]]] = {}
+    for chunk in selected:
+        source = chunk.get("source", "")
+        if source not in by_source:
+            source_order.append(source)
+            by_source[source] = []
+        by_source[source].append(chunk)
+    if order == "source":
+        source_order.sort()
+    passages = []
+    for source in source_order:
+        group = by_source[source]
+        if all(chunk.get("position") is not None for chunk in group):
+            group.sort(key=lambda chunk: chunk["position"])
+        run = [group[0]]
+        for chunk in group[1:] + [None]:
+            if (chunk is not None and chunk.get("position") is not None and run[-1].get("position") is not None
+                    and chunk["position"] == run[-1]["position"] + 1):
+                run.append(chunk)
+                continue
+            text = run[0]["content"]
+            for following in run[1:]:
+                text += " " + trim_overlap(text, following["content"]).lstrip()
+            title = header(source, run[0], run[-1])
+            passages.append(f"{title}\n{text}" if title else text)
+            result.chunks.extend(run)
+            run = [chunk]
+    result.text = separator.join(passages)
+    result.tokens_used = counter(result.text)
+    return result
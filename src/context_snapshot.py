@@ -0,0 +1,107 @@
+# context_snapshot.py
+
+import os
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List
+from dotenv import load_dotenv
+
+from lexical_index import BM25Index
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Chunks whose content and metadata the snapshot keeps in memory; beyond this only the
+# lexical index and samples are kept and matched chunks are fetched from MongoDB. 0 disables snapshots.
+CONTEXT_SNAPSHOT_MAX_CHUNKS = int(os.getenv('CONTEXT_SNAPSHOT_MAX_CHUNKS', 100000))
+# First chunks per manufacturer kept for overviews and comparison tables
+CONTEXT_SNAPSHOT_SAMPLE_SIZE = int(os.getenv('CONTEXT_SNAPSHOT_SAMPLE_SIZE', 10))
+
+def _document_order(doc: Dict[str, Any]):
+    metadata = doc.get("metadata", {})
+    return str(metadata.get("filename", "")), metadata.get("chunk_index", 0), str(doc["_id"])
+
+@dataclass
+class ContextSnapshot:
+    """
+    Everything the chatbot reads per prompt, materialized at one data version.
+
+    Built in a single pass over the chunks: their content and metadata by id,
+    the first chunks of each manufacturer in document order, the chunk count per
+    manufacturer and per section and a BM25 index. It is only valid for `version`; the owner
+    compares that with the stored data version and rebuilds when an ingest has
+    bumped it.
+    """
+    version: Any
+    documents: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    samples: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    section_counts: Dict[str, int] = field(default_factory=dict)
+    lexical: BM25Index = field(default_factory=BM25Index)
+    # Whether documents holds every chunk, so a miss means the chunk doesn't exist
+    complete: bool = True
+    built_at: float = field(default_factory=time.time)
+    build_ms: float = 0.0
+
+    @classmethod
+    def build(cls, version: Any, docs: Iterable[Dict[str, Any]], lexical_fields: Callable[[Dict[str, Any]], Dict[str, str]],
+              max_chunks: int = CONTEXT_SNAPSHOT_MAX_CHUNKS, sample_size: int = CONTEXT_SNAPSHOT_SAMPLE_SIZE) -> "ContextSnapshot":
+        """
+        Build a snapshot from chunks read at `version`.
+
+        Args:
+            version (Any): The data version read before the chunks were.
+            docs (Iterable[Dict[str, Any]]): Chunks with _id, content, metadata and the promoted manufacturer field.
+            lexical_fields (Callable): The filterable BM25 fields of a chunk.
+            max_chunks (int): Keep the content and metadata of at most this many chunks.
+            sample_size (int): First chunks kept per manufacturer.
+
+        Returns:
+            ContextSnapshot: The snapshot.
+        """
+        start = time.perf_counter()
+        snapshot = cls(version=version)
+        firsts: Dict[str, List[Dict[str, Any]]] = {}
+        for doc in docs:
+            doc_id = str(doc["_id"])
+            manufacturer = doc.get("manufacturer") or doc.get("metadata", {}).get("manufacturer", "")
+            chunk = {"_id": doc["_id"], "content": doc.get("content", ""), "metadata": doc.get("metadata", {})}
+            snapshot.counts[manufacturer] = snapshot.counts.get(manufacturer, 0) + 1
+            section = doc.get("section") or chunk["metadata"].get("section")
+            if section:
+                snapshot.section_counts[section] = snapshot.section_counts.get(section, 0) + 1
+            snapshot.lexical.add(doc_id, chunk["content"], lexical_fields(doc))
+            if snapshot.complete:
+                if len(snapshot.documents) < max_chunks:
+                    snapshot.documents[doc_id] = chunk
+                else:
+                    snapshot.complete = False
+                    snapshot.documents.clear()
+            # Chunks arrive in _id order; trimming whenever the list doubles keeps the first sample_size in document order
+            first = firsts.setdefault(manufacturer, [])
+            first.append(chunk)
+            if len(first) > 2 * sample_size:
+                first.sort(key=_document_order)
+                del first[sample_size:]
+        snapshot.samples = {manufacturer: sorted(first, key=_document_order)[:sample_size] for manufacturer, first in firsts.items()}
+        snapshot.build_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"Built context snapshot of {len(snapshot.lexical)} chunks at data version {version} in {snapshot.build_ms:.0f}ms"
+                    + ("" if snapshot.complete else " (content over CONTEXT_SNAPSHOT_MAX_CHUNKS, fetched per query)"))
+        return snapshot
+
+    def get_documents(self, ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """The held chunks among `ids`, by string id."""
+        found = {}
+        for doc_id in ids:
+            doc = self.documents.get(str(doc_id))
+            if doc is not None:
+                found[str(doc_id)] = doc
+        return found
+
+    def age(self) -> float:
+        return time.time() - self.built_at
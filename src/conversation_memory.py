@@ -0,0 +1,198 @@
+# conversation_memory.py
+
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from context_packer import get_token_counter, truncate_to_tokens
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Most recent turns kept verbatim, and the most tokens they may take together
+CHAT_HISTORY_TURNS = int(os.getenv('CHAT_HISTORY_TURNS', 6))
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv('CHAT_HISTORY_MAX_TOKENS', 3000))
+# Hard cap on the running summary of older turns
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', 500))
+# A small, fast model is enough to fold turns into the summary
+CHAT_SUMMARY_MODEL = os.getenv('CHAT_SUMMARY_MODEL', 'claude-3-haiku-20240307')
+
+Turn = Dict[str, str]
+# (previous summary, turns to fold in) -> new summary
+Summarizer = Callable[[str, List[Turn]], str]
+
+# Folds of every conversation in the process run here, off the request path
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+def format_turn(turn: Turn) -> str:
+    return f"User: {turn['user']}\nAssistant: {turn['assistant']}"
+
+class ConversationMemory:
+    """
+    Chat history with bounded size: the last turns verbatim, older ones folded into a summary.
+
+    add_turn() keeps at most keep_turns turns (and max_recent_tokens tokens) verbatim;
+    a single turn longer than max_recent_tokens is truncated to fit.
+    Turns pushed out are folded into the running summary by `summarize` on a background
+    thread, so the request that added them doesn't wait. Until a fold finishes, its
+    turns are rendered verbatim from the newest back, within the summary's budget.
+    The summary is truncated to summary_max_tokens whatever the summarizer returns, so
+    render() never exceeds summary_max_tokens * 2 + max_recent_tokens, however long
+    the conversation gets.
+    """
+
+    def __init__(self, summarize: Summarizer, keep_turns: int = CHAT_HISTORY_TURNS,
+                 max_recent_tokens: int = CHAT_HISTORY_MAX_TOKENS, summary_max_tokens: int = CHAT_SUMMARY_MAX_TOKENS,
+                 counter: Optional[Callable[[str], int]] = None, executor: Optional[ThreadPoolExecutor] = None):
+        self.summarize = summarize
+        self.keep_turns = keep_turns
+        self.max_recent_tokens = max_recent_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self._counter = counter or get_token_counter()
+        self._executor = executor or _executor
+        self._lock = threading.Lock()
+        self.summary = ""
+        self.folded_turns = 0
+        self._recent: Deque[Tuple[Turn, int]] = deque()
+        self._recent_tokens = 0
+        # Pushed out of the recent turns but not yet in the summary
+        self._pending: List[Tuple[Turn, int]] = []
+        self._future: Optional[Future] = None
+
+    def add_turn(self, user: str, assistant: str):
+        """Record a finished turn and, if older turns were pushed out, fold them into the summary in the background."""
+        turn, tokens = self._fit_turn({"user": user, "assistant": assistant})
+        with self._lock:
+            self._recent.append((turn, tokens))
+            self._recent_tokens += tokens
+            while len(self._recent) > 1 and (len(self._recent) > self.keep_turns or self._recent_tokens > self.max_recent_tokens):
+                old = self._recent.popleft()
+                self._recent_tokens -= old[1]
+                self._pending.append(old)
+            self._schedule_fold()
+
+    def _fit_turn(self, turn: Turn) -> Tuple[Turn, int]:
+        """
+        Truncate a turn that alone exceeds max_recent_tokens, so the newest turn,
+        which is always kept verbatim, stays within the bound.
+
+        The question keeps at most half of the budget, or more if the answer is short.
+
+        Returns:
+            Tuple[Turn, int]: The turn and its tokens.
+        """
+        tokens = self._counter(format_turn(turn))
+        if tokens <= self.max_recent_tokens:
+            return turn, tokens
+        available = max(0, self.max_recent_tokens - self._counter(format_turn({"user": "", "assistant": ""})))
+        user = truncate_to_tokens(turn["user"], max(available // 2, available - self._counter(turn["assistant"])),
+                                  self._counter)
+        assistant_budget = available - self._counter(user)
+        while True:
+            assistant = truncate_to_tokens(turn["assistant"], max(0, assistant_budget), self._counter)
+            fitted = {"user": user, "assistant": assistant}
+            tokens = self._counter(format_turn(fitted))
+            # Token counts of the parts don't always add up exactly; cut further until the whole fits
+            if tokens <= self.max_recent_tokens or not assistant:
+                break
+            assistant_budget -= tokens - self.max_recent_tokens
+        logger.info(f"Truncated a chat turn to {tokens} tokens to fit CHAT_HISTORY_MAX_TOKENS")
+        return fitted, tokens
+
+    def _schedule_fold(self):
+        # Called with the lock held. One fold at a time per conversation; turns that
+        # arrive meanwhile are picked up when it finishes.
+        if self._pending and self._future is None:
+            self._future = self._executor.submit(self._fold)
+
+    def _fold(self):
+        with self._lock:
+            turns = [turn for turn, _ in self._pending]
+            summary = self.summary
+        try:
+            new_summary = truncate_to_tokens(self.summarize(summary, turns).strip(), self.summary_max_tokens, self._counter)
+        except Exception as e:
+            logger.error(f"Error summarizing {len(turns)} chat turns: {str(e)}")
+            with self._lock:
+                # Retried when the next turn is added
+                self._future = None
+            return
+        with self._lock:
+            self.summary = new_summary
+            del self._pending[:len(turns)]
+            self.folded_turns += len(turns)
+            self._future = None
+            self._schedule_fold()
+
+    def render(self) -> str:
+        """The history for the prompt: the summary, any turns still being folded, then the recent turns."""
+        with self._lock:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation:\n{self.summary}")
+            budget = self.summary_max_tokens
+            unfolded = []
+            for turn, tokens in reversed(self._pending):
+                if tokens > budget:
+                    break
+                budget -= tokens
+                unfolded.append(format_turn(turn))
+            parts.extend(reversed(unfolded))
+            parts.extend(format_turn(turn) for turn, _ in self._recent)
+        return "\n".join(parts)
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until pending turns are folded, e.g. before saving or in scripts."""
+        while True:
+            with self._lock:
+                future = self._future
+            if future is None:
+                return
+            future.result(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "recent_turns": len(self._recent),
+                "recent_tokens": self._recent_tokens,
+                "pending_turns": len(self._pending),
+                "folded_turns": self.folded_turns,
+                "summary_tokens": self._counter(self.summary) if self.summary else 0
+            }
+
+def anthropic_summarizer(client: Any, model: str = CHAT_SUMMARY_MODEL,
+                         max_tokens: int = CHAT_SUMMARY_MAX_TOKENS) -> Summarizer:
+    """
+    A summarizer that asks Claude to fold turns into the running summary.
+
+    Args:
+        client (Any): An anthropic.Anthropic client.
+        model (str): The model to summarize with.
+        max_tokens (int): Output limit of the summary.
+
+    Returns:
+        Summarizer: The summarize callable for ConversationMemory.
+    """
+    def summarize(summary: str, turns: List[Turn]) -> str:
+        response = client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            system="You maintain the running summary of a conversation about HVAC product documents. "
+                   "Merge the new turns into the summary. Keep model codes, figures, the user's requirements "
+                   "and any decisions; drop pleasantries and repetition. Reply with the updated summary only, "
+                   f"in under {int(max_tokens * 0.6)} words.",
+            messages=[{
+                "role": "user",
+                "content": f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n" + "\n\n".join(format_turn(turn) for turn in turns)
+            }]
+        )
+        return response.content[0].text
+    return summarize
@@ -1,29 +1,140 @@
 # data_ingestion.py
 
 import os
+import io
 import logging
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Union
 from pypdf import PdfReader
 from langchain.docstore.document import Document
 
+from cache_paths import PROJECT_ROOT
+from extraction_cache import file_hash, get_default_cache
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_pdf(file_path: str) -> str:
+DATA_DIR = Path(os.getenv('DATA_DIR', PROJECT_ROOT / 'data'))
+
+# Page-sharded extraction settings. Files below the threshold are extracted
+# serially because process start-up costs more than it saves on short PDFs.
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv('PDF_PARALLEL_PAGE_THRESHOLD', 50))
+# Each worker gets several small shards so a few slow, image-heavy pages
+# don't leave the other processes idle.
+SHARDS_PER_WORKER = 4
+
+def _open_pdf(source: Union[str, bytes]) -> PdfReader:
+    """
+    Open a PDF from a file path or from its raw bytes.
+    """
+    return PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+def _extract_page_range(source: Union[str, bytes], start: int, end: int) -> List[str]:
+    """
+    Extract the text of pages [start, end) from a PDF. Runs inside worker processes.
+    """
+    pdf = _open_pdf(source)
+    pages = []
+    for page_num in range(start, end):
+        logger.debug(f"Processing page {page_num + 1}")
+        pages.append(pdf.pages[page_num].extract_text() or "")
+    return pages
+
+def _page_shards(num_pages: int, num_shards: int) -> List[Tuple[int, int]]:
+    """
+    Split num_pages into at most num_shards contiguous (start, end) ranges.
+    """
+    num_shards = min(num_pages, num_shards)
+    shard_size = -(-num_pages // num_shards)  # ceiling division
+    return [(start, min(start + shard_size, num_pages)) for start in range(0, num_pages, shard_size)]
+
+def _extract_all_pages(source: Union[str, bytes], name: str,
+                       workers: int, parallel_threshold: int) -> List[str]:
+    """
+    Extract every page of a PDF, using a process pool for large files.
+    """
+    num_pages = len(_open_pdf(source).pages)
+
+    if workers <= 1 or num_pages < parallel_threshold:
+        logger.info(f"Extracting {num_pages} pages from {name} serially")
+        return _extract_page_range(source, 0, num_pages)
+
+    # Raw bytes are pickled once per shard, so only paths get the finer sharding
+    num_shards = workers if isinstance(source, bytes) else workers * SHARDS_PER_WORKER
+    shards = _page_shards(num_pages, num_shards)
+    logger.info(f"Extracting {num_pages} pages from {name} in {len(shards)} shards using {workers} processes")
+    pages: List[str] = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_extract_page_range, source, start, end) for start, end in shards]
+        # Collect in submission order so the pages stay in document order
+        for future in futures:
+            pages.extend(future.result())
+    return pages
+
+def extract_pages(source: Union[str, bytes],
+                  workers: Optional[int] = None,
+                  parallel_threshold: int = PDF_PARALLEL_PAGE_THRESHOLD,
+                  use_cache: bool = True,
+                  content_hash: Optional[str] = None) -> List[str]:
+    """
+    Extract the text of every page of a PDF, in page order.
+
+    Unchanged files are served from the extraction cache, so each distinct
+    file content is only parsed once per extractor version.
+
+    Args:
+        source (Union[str, bytes]): Path to the PDF file, or its raw bytes.
+        workers (Optional[int]): Number of worker processes. Defaults to PDF_EXTRACT_WORKERS.
+        parallel_threshold (int): Minimum page count before a process pool is used.
+        use_cache (bool): Read from and write to the extraction cache.
+        content_hash (Optional[str]): The file_hash of source, when the caller already has it.
+
+    Returns:
+        List[str]: One string per page.
+    """
+    workers = workers or PDF_EXTRACT_WORKERS
+    name = "<bytes>" if isinstance(source, bytes) else source
+
+    if not use_cache:
+        return _extract_all_pages(source, name, workers, parallel_threshold)
+
+    cache = get_default_cache()
+    content_hash = content_hash or file_hash(source)
+    pages = cache.get(content_hash)
+    if pages is not None:
+        logger.info(f"Loaded {len(pages)} pages of {name} from the extraction cache")
+        return pages
+
+    pages = _extract_all_pages(source, name, workers, parallel_threshold)
+    cache.put(content_hash, pages, source=name)
+    return pages
+
+def load_pdf(file_path: str,
+             workers: Optional[int] = None,
+             per_page: bool = False,
+             content_hash: Optional[str] = None) -> Union[str, List[str]]:
     """
     Load a PDF file and extract its text content.
+
+    Args:
+        file_path (str): Path to the PDF file.
+        workers (Optional[int]): Number of worker processes for large files. Defaults to PDF_EXTRACT_WORKERS.
+        per_page (bool): Return a list with the text of each page instead of a single string.
+        content_hash (Optional[str]): The file_hash of the file, when the caller already has it.
+
+    Returns:
+        Union[str, List[str]]: The document text, or the per-page texts when per_page is True.
     """
     try:
         logger.info(f"Loading PDF: {file_path}")
-        with open(file_path, 'rb') as file:
-            pdf = PdfReader(file)
-            text = ""
-            for page_num, page in enumerate(pdf.pages, 1):
-                logger.debug(f"Processing page {page_num} of {file_path}")
-                text += page.extract_text() + "\n"  # Add a newline between pages
+        pages = extract_pages(file_path, workers=workers, content_hash=content_hash)
         logger.info(f"Successfully extracted text from {file_path}")
-        return text.strip()  # Remove leading/trailing whitespace
+        if per_page:
+            return pages
+        return "\n".join(pages).strip()  # Newline between pages, no leading/trailing whitespace
     except FileNotFoundError:
         logger.error(f"File not found: {file_path}")
         raise
@@ -36,39 +147,73 @@ def process_pdf(file_path: str, manufacturer: str) -> Document:
     Process a single PDF file and return a Document object.
     """
     try:
-        text = load_pdf(file_path)
+        content_hash = file_hash(file_path)
+        text = load_pdf(file_path, content_hash=content_hash)
         return Document(
             page_content=text,
             metadata={
                 "source": file_path,
                 "filename": os.path.basename(file_path),
-                "manufacturer": manufacturer
+                "manufacturer": manufacturer,
+                "file_hash": content_hash
             }
         )
     except Exception as e:
         logger.error(f"Error processing {file_path}: {str(e)}")
         return None
 
-def ingest_data() -> Dict[str, List[Document]]:
+def discover_pdfs(data_dir: Path = DATA_DIR) -> Dict[str, List[str]]:
     """
-    Ingest data from specified PDF files.
+    Find the PDF catalogs under data/<manufacturer>/*.pdf.
+
+    Args:
+        data_dir (Path): The data directory to scan. Default is DATA_DIR.
+
+    Returns:
+        Dict[str, List[str]]: Manufacturer name (the capitalised directory name,
+                              e.g. "daikin" -> "Daikin") to sorted PDF paths.
+    """
+    pdf_paths = {}
+    data_dir = Path(data_dir)
+    if not data_dir.is_dir():
+        logger.warning(f"Data directory not found: {data_dir}")
+        return pdf_paths
+
+    for manufacturer_dir in sorted(data_dir.iterdir()):
+        if not manufacturer_dir.is_dir() or manufacturer_dir.name.startswith('.'):
+            continue
+        paths = sorted(str(path) for path in manufacturer_dir.iterdir() if path.suffix.lower() == '.pdf')
+        if paths:
+            pdf_paths[manufacturer_dir.name.capitalize()] = paths
+
+    logger.info(f"Discovered {sum(len(paths) for paths in pdf_paths.values())} PDFs "
+                f"for {len(pdf_paths)} manufacturers in {data_dir}")
+    return pdf_paths
+
+def ingest_data(pdf_paths: Optional[Dict[str, List[str]]] = None) -> Dict[str, List[Document]]:
+    """
+    Ingest data from PDF files.
+
+    Args:
+        pdf_paths (Optional[Dict[str, List[str]]]): Manufacturer name to PDF paths.
+                                                    Defaults to everything found by discover_pdfs.
+
+    Returns:
+        Dict[str, List[Document]]: Manufacturer name to one Document per PDF.
     """
     all_documents = {}
-    
-    # Define the paths and manufacturers
-    pdf_paths = {
-        "Daikin": r"B:\Angelo Data\GitHub\Quotation_Project_HACV\data\daikin\Split.pdf",
-        "Melco": r"B:\Angelo Data\GitHub\Quotation_Project_HACV\data\melco\Mr. Slim.pdf"
-    }
-
-    for manufacturer, path in pdf_paths.items():
-        logger.info(f"Processing {manufacturer} PDF: {path}")
-        document = process_pdf(path, manufacturer)
-        if document:
-            all_documents[manufacturer] = [document]
-            logger.info(f"Successfully processed {manufacturer} PDF")
-        else:
-            logger.warning(f"Failed to process {manufacturer} PDF")
+    if pdf_paths is None:
+        pdf_paths = discover_pdfs()
+
+    for manufacturer, paths in pdf_paths.items():
+        for path in paths:
+            logger.info(f"Processing {manufacturer} PDF: {path}")
+            document = process_pdf(path, manufacturer)
+            if document:
+                all_documents.setdefault(manufacturer, []).append(document)
+                logger.info(f"Successfully processed {manufacturer} PDF {path}")
+            else:
+                logger.warning(f"Failed to process {manufacturer} PDF {path}")
 
     logger.info(f"Data ingestion complete. Processed {len(all_documents)} manufacturers.")
     return all_documents
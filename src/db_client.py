@@ -0,0 +1,104 @@
+# db_client.py
+
+import os
+import time
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from pymongo import MongoClient
+from pymongo.database import Database
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MONGODB_URI = os.getenv('MONGODB_URI')
+# Connection pool and timeouts of the shared client
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', 50))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', 300000))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 30000))
+# How long a health check result is reused before the server is pinged again
+HEALTH_CHECK_TTL = float(os.getenv('HEALTH_CHECK_TTL', 30))
+
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+_health: Dict[str, Tuple[float, bool, Optional[str]]] = {}
+_health_lock = threading.Lock()
+
+def get_client() -> MongoClient:
+    """
+    Return the process-wide MongoClient, creating it on first use.
+
+    MongoClient is thread-safe and keeps its own connection pool, so one instance
+    serves every handler, thread and Streamlit rerun in the process. Creating it
+    doesn't contact the server; connections are opened on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGODB_URI,
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+                    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS
+                )
+                logger.info(f"Created shared MongoDB client (max pool size {MONGODB_MAX_POOL_SIZE})")
+    return _client
+
+def get_database(name: str) -> Database:
+    """Return a database on the shared client."""
+    return get_client()[name]
+
+def cached_check(name: str, probe: Callable[[], None], ttl: float = HEALTH_CHECK_TTL, force: bool = False) -> Tuple[bool, Optional[str]]:
+    """
+    Run a health probe at most once per ttl seconds and reuse its result in between.
+
+    Args:
+        name (str): Key of the check, e.g. "mongodb".
+        probe (Callable[[], None]): Raises if the service is unhealthy.
+        ttl (float): Seconds a result stays valid.
+        force (bool): Run the probe even if a fresh result is cached.
+
+    Returns:
+        Tuple[bool, Optional[str]]: Whether the service is healthy, and the error message if not.
+    """
+    now = time.monotonic()
+    with _health_lock:
+        cached = _health.get(name)
+        if cached and not force and now - cached[0] < ttl:
+            return cached[1], cached[2]
+    try:
+        probe()
+        result = (True, None)
+    except Exception as e:
+        result = (False, str(e))
+    with _health_lock:
+        _health[name] = (time.monotonic(), *result)
+    return result
+
+def check_health(force: bool = False) -> Tuple[bool, Optional[str]]:
+    """Ping MongoDB through the shared client, cached for HEALTH_CHECK_TTL seconds."""
+    return cached_check("mongodb", lambda: get_client().admin.command('ping'), force=force)
+
+def close_client():
+    """Close the shared client. Only for process shutdown; handlers never close it."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            logger.info("Closed shared MongoDB client")
+
+atexit.register(close_client)
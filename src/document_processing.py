@@ -1,5 +1,5 @@
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 from data_ingestion import ingest_data  # Import the ingest_data function
@@ -8,6 +8,61 @@ from data_ingestion import ingest_data  # Import the ingest_data function
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Version of the chunks the splitter produces; files ingested with an older one are re-ingested.
+# 2: chunks carry the section heading they fall under.
+CHUNK_FORMAT_VERSION = 2
+
+# Section headings are short lines of words in upper or title case
+HEADING_MAX_CHARS = 60
+HEADING_MAX_WORDS = 8
+_MINOR_WORDS = {"a", "an", "and", "as", "at", "by", "for", "in", "of", "on", "or", "the", "to", "with", "&", "-", "/"}
+
+def heading_text(line: str) -> Optional[str]:
+    """
+    Return the line as a section heading if it looks like one, else None.
+
+    Catalog headings ("SPECIFICATIONS", "Indoor Units", "Installation Guide:") are
+    short lines in upper or title case without digits or sentence punctuation, so
+    model codes and spec-table rows don't count.
+    """
+    line = " ".join(line.split()).rstrip(":").strip()
+    words = line.split(" ")
+    if not line or len(line) > HEADING_MAX_CHARS or len(words) > HEADING_MAX_WORDS or line[-1] in ".,;!?":
+        return None
+    if any(c.isdigit() for c in line) or sum(c.isalpha() for c in line) < max(4, 0.8 * len(line.replace(" ", ""))):
+        return None
+    if line.isupper() or all(word[0].isupper() or word.lower() in _MINOR_WORDS for word in words):
+        return line
+    return None
+
+def chunk_section(chunk: str, section: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Find the section of a chunk, given the section in effect before it.
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: The chunk's section (its first line if that
+                                             is a heading, else `section`), and the
+                                             section in effect after it.
+    """
+    lines = [line for line in chunk.splitlines() if line.strip()]
+    first = heading_text(lines[0]) if lines else None
+    after = next((heading for heading in map(heading_text, reversed(lines)) if heading), None)
+    return first or section, after or section
+
+def make_chunk_id(file_hash: str, chunk_index: int) -> str:
+    """
+    Build a deterministic chunk ID from the source file's content hash and the chunk's position.
+    """
+    return f"{file_hash[:24]}:{chunk_index:05d}"
+
+def _make_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+
 def split_documents(documents: List[Document], 
                     chunk_size: int = 1000, 
                     chunk_overlap: int = 200) -> List[Document]:
@@ -24,32 +79,65 @@ def split_documents(documents: List[Document],
     """
     logger.info(f"Splitting {len(documents)} documents into chunks (size: {chunk_size}, overlap: {chunk_overlap})")
     
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        is_separator_regex=False,
-    )
+    text_splitter = _make_text_splitter(chunk_size, chunk_overlap)
 
     split_docs = []
     for doc in documents:
         try:
             chunks = text_splitter.split_text(doc.page_content)
+            section = None
             for i, chunk in enumerate(chunks):
-                split_docs.append(Document(
-                    page_content=chunk,
-                    metadata={
-                        **doc.metadata,
-                        "chunk_index": i,
-                        "total_chunks": len(chunks)
-                    }
-                ))
+                chunk_section_name, section = chunk_section(chunk, section)
+                metadata = {
+                    **doc.metadata,
+                    "chunk_index": i,
+                    "total_chunks": len(chunks)
+                }
+                if chunk_section_name:
+                    metadata["section"] = chunk_section_name
+                if "file_hash" in doc.metadata:
+                    metadata["chunk_id"] = make_chunk_id(doc.metadata["file_hash"], i)
+                split_docs.append(Document(page_content=chunk, metadata=metadata))
         except Exception as e:
             logger.error(f"Error splitting document {doc.metadata.get('source', 'Unknown')}: {str(e)}")
 
     logger.info(f"Split {len(documents)} documents into {len(split_docs)} chunks")
     return split_docs
 
+def iter_split_pages(pages: Iterable[str],
+                     metadata: Dict[str, Any],
+                     chunk_size: int = 1000,
+                     chunk_overlap: int = 200) -> Iterator[Document]:
+    """
+    Lazily split a file's pages into chunks, one page at a time.
+
+    Chunks never span a page boundary. chunk_index runs across the whole file so
+    chunk IDs stay unique per file, and each chunk records the page it came from
+    and the section heading it falls under, carried across pages.
+
+    Args:
+        pages (Iterable[str]): The text of each page, in order.
+        metadata (Dict[str, Any]): Metadata shared by every chunk of the file.
+        chunk_size (int): The size of each chunk in characters. Default is 1000.
+        chunk_overlap (int): The overlap between chunks in characters. Default is 200.
+
+    Yields:
+        Document: The chunks of the file, in order.
+    """
+    text_splitter = _make_text_splitter(chunk_size, chunk_overlap)
+    chunk_index = 0
+    section = None
+    for page_num, page_text in enumerate(pages, 1):
+        for chunk in text_splitter.split_text(page_text):
+            chunk_section_name, section = chunk_section(chunk, section)
+            chunk_metadata = {**metadata, "page": page_num, "chunk_index": chunk_index}
+            if chunk_section_name:
+                chunk_metadata["section"] = chunk_section_name
+            if "file_hash" in metadata:
+                chunk_metadata["chunk_id"] = make_chunk_id(metadata["file_hash"], chunk_index)
+            yield Document(page_content=chunk, metadata=chunk_metadata)
+            chunk_index += 1
+
 def process_manufacturer_data(manufacturer_data: Dict[str, List[Document]]) -> Dict[str, List[Document]]:
     """
     Process the data for all manufacturers by splitting their documents.
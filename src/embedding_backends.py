@@ -0,0 +1,165 @@
+# embedding_backends.py
+
+import os
+import logging
+import urllib.error
+from abc import ABC, abstractmethod
+from typing import List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+from embedding_dispatcher import HTTPEmbeddingClient, estimate_tokens
+from embedding_cache import normalize_text
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'voyage')
+VOYAGE_MODEL = os.getenv('VOYAGE_MODEL', 'voyage-2')
+HASHED_EMBEDDING_DIMENSIONS = int(os.getenv('HASHED_EMBEDDING_DIMENSIONS', 1024))
+
+# Voyage's total-tokens-per-request limit for each model
+VOYAGE_BATCH_TOKEN_LIMITS = {
+    "voyage-2": 320000,
+    "voyage-large-2": 120000,
+    "voyage-3": 320000,
+    "voyage-3-lite": 1000000,
+    "voyage-3-large": 120000
+}
+# Token counts are estimated, so batches are packed to a fraction of the limit
+EMBED_BATCH_TOKEN_SAFETY = float(os.getenv('EMBED_BATCH_TOKEN_SAFETY', 0.75))
+EMBED_MAX_BATCH_SIZE = int(os.getenv('EMBED_MAX_BATCH_SIZE', 128))
+
+class EmbeddingBackend(ABC):
+    """
+    Interface for embedding providers.
+
+    `model` identifies the vector space: it keys the embedding cache and is
+    recorded in the ingestion manifest, so switching backends re-embeds everything.
+    """
+
+    name = "base"
+    model = "base"
+    # Per-request limits used to pack batches
+    max_batch_tokens = 120000
+    max_batch_size = 128
+
+    def count_tokens(self, text: str) -> int:
+        """Estimated token count of a text, used to pack batches under max_batch_tokens."""
+        return estimate_tokens(text)
+
+    @abstractmethod
+    def embed(self, texts: List[str], input_type: Optional[str] = None) -> List[List[float]]:
+        """Embed a batch of texts. input_type is "document" or "query"."""
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Whether a failed request is worth retrying."""
+        return True
+
+class VoyageBackend(EmbeddingBackend):
+    """
+    Voyage AI embeddings. The client is created on first use, so importing the
+    pipeline doesn't need an API key. Set VOYAGE_API_BASE to send requests to a
+    proxy or a local stub server instead.
+    """
+
+    name = "voyage"
+
+    def __init__(self, model: str = VOYAGE_MODEL):
+        self.model = model
+        self.max_batch_tokens = int(VOYAGE_BATCH_TOKEN_LIMITS.get(model, 120000) * EMBED_BATCH_TOKEN_SAFETY)
+        self.max_batch_size = EMBED_MAX_BATCH_SIZE
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            if os.getenv('VOYAGE_API_BASE'):
+                self._client = HTTPEmbeddingClient(os.getenv('VOYAGE_API_BASE'), api_key=os.getenv('VOYAGE_API_KEY'))
+            else:
+                import voyageai
+                self._client = voyageai.Client(api_key=os.getenv('VOYAGE_API_KEY'))
+        return self._client
+
+    def embed(self, texts: List[str], input_type: Optional[str] = None) -> List[List[float]]:
+        return self.client.embed(texts, model=self.model, input_type=input_type).embeddings
+
+    def is_retryable(self, error: Exception) -> bool:
+        # Client errors won't succeed on retry; rate limits, timeouts and server errors might
+        import voyageai
+        if isinstance(error, (voyageai.error.AuthenticationError,
+                              voyageai.error.InvalidRequestError,
+                              voyageai.error.MalformedRequestError)):
+            return False
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code == 429 or error.code >= 500
+        return True
+
+class HashedNgramBackend(EmbeddingBackend):
+    """
+    Local CPU embeddings from hashed character n-grams, computed with NumPy.
+
+    Each text is lower-cased and whitespace-normalized, then every character
+    n-gram (3 to 5 bytes by default) is hashed with a polynomial rolling hash
+    into one of `dimensions` signed buckets. Counts are log-scaled and the
+    vector is L2-normalized, so dot product is cosine similarity. No IDF is
+    applied, which keeps the function stateless: a document embedded today
+    and a query embedded tomorrow always land in the same space.
+
+    It needs no network access and no model files. It is meant for offline
+    ingests, tests and retrieval benchmarks, not for answer quality. Model codes
+    such as "FTXM35R" do match well, because they share many n-grams.
+    """
+
+    name = "hashed"
+    _PRIME = np.uint64(1099511628211)
+    # Local and per-text, so batching only bounds memory per call
+    max_batch_tokens = 1000000
+    max_batch_size = 1024
+
+    def __init__(self, dimensions: int = HASHED_EMBEDDING_DIMENSIONS, ngram_range=(3, 5)):
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+        self.model = f"hashed-ngram-{ngram_range[0]}-{ngram_range[1]}-{dimensions}"
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        data = np.frombuffer(f" {normalize_text(text).lower()} ".encode('utf-8'), dtype=np.uint8).astype(np.uint64)
+        vector = np.zeros(self.dimensions, dtype=np.float64)
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            if len(data) < n:
+                break
+            # Rolling hash of every n-gram at once: h = sum(byte[i+k] * P^(n-1-k)), mod 2^64
+            hashes = np.zeros(len(data) - n + 1, dtype=np.uint64)
+            for k in range(n):
+                hashes = hashes * self._PRIME + data[k:len(data) - n + 1 + k]
+            hashes ^= hashes >> np.uint64(29)
+            buckets = (hashes % np.uint64(self.dimensions)).astype(np.int64)
+            signs = np.where((hashes >> np.uint64(63)) == 0, 1.0, -1.0)
+            vector += np.bincount(buckets, weights=signs, minlength=self.dimensions)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts: List[str], input_type: Optional[str] = None) -> List[List[float]]:
+        with np.errstate(over='ignore'):  # uint64 overflow is the intended modulo
+            return [self._embed_one(text).astype(np.float32).tolist() for text in texts]
+
+BACKENDS = {
+    VoyageBackend.name: VoyageBackend,
+    HashedNgramBackend.name: HashedNgramBackend
+}
+
+def get_backend(name: Optional[str] = None) -> EmbeddingBackend:
+    """
+    Create the embedding backend named by `name`, or by EMBEDDING_BACKEND ("voyage" or "hashed").
+    """
+    name = name or EMBEDDING_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}'. Available: {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]()
+    logger.info(f"Using embedding backend '{backend.name}' (model: {backend.model})")
+    return backend
@@ -0,0 +1,207 @@
+# embedding_cache.py
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from array import array
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+
+from cache_paths import CACHE_DIR
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = Path(os.getenv('EMBEDDING_CACHE_PATH', CACHE_DIR / 'embeddings.sqlite3'))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 500000))
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', '1') != '0'
+
+# SQLite limits the number of parameters per statement
+_LOOKUP_BATCH = 500
+
+def normalize_text(text: str) -> str:
+    """Collapse runs of whitespace, which PDF extraction produces inconsistently."""
+    return " ".join(text.split())
+
+def cache_key(text: str, model: str, input_type: Optional[str]) -> str:
+    """Key for one embedding: hash of the normalized text, model name and input type."""
+    return hashlib.sha256(f"{model}\0{input_type or ''}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """
+    Local SQLite cache of embeddings keyed by (normalized text hash, model, input_type).
+
+    Vectors are stored as packed float32. Every hit refreshes the entry's
+    last_used time, and once max_entries is exceeded the least recently used
+    tenth of the cache is evicted. The entry count is kept as a running total, so
+    puts don't count the table; it is recounted when evicting, which also picks up
+    entries written by other processes.
+    """
+
+    def __init__(self, path: Path = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                input_type TEXT,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._count_entries()
+
+    def get_many(self, texts: List[str], model: str, input_type: Optional[str]) -> List[Optional[List[float]]]:
+        """
+        Look up a batch of texts.
+
+        Returns:
+            List[Optional[List[float]]]: The cached vector for each text, or None on a miss.
+        """
+        keys = [cache_key(text, model, input_type) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[i:i+_LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+                if rows:
+                    self._conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                                       [time.time(), *batch])
+            self._conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [found.get(key) for key in keys]
+
+    def get(self, text: str, model: str, input_type: Optional[str]) -> Optional[List[float]]:
+        return self.get_many([text], model, input_type)[0]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]], model: str, input_type: Optional[str]):
+        """Store a batch of embeddings, evicting least recently used entries if over budget."""
+        now = time.time()
+        rows = [(cache_key(text, model, input_type), model, input_type, array('f', vector).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._count += len({row[0] for row in rows}) - self._count_existing([row[0] for row in rows])
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+            if self._count > self.max_entries:
+                self._evict()
+
+    def put(self, text: str, vector: List[float], model: str, input_type: Optional[str]):
+        self.put_many([text], [vector], model, input_type)
+
+    def _count_entries(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _count_existing(self, keys: List[str]) -> int:
+        """Number of distinct keys already in the cache, looked up through the primary key."""
+        keys = list(set(keys))
+        existing = 0
+        for i in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[i:i+_LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            existing += self._conn.execute(
+                f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", batch).fetchone()[0]
+        return existing
+
+    def _evict(self):
+        # Called with the lock held
+        count = self._count = self._count_entries()
+        if count <= self.max_entries:
+            return
+        target = int(self.max_entries * 0.9)
+        self._conn.execute("""
+            DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+            )
+        """, (count - target,))
+        self._conn.commit()
+        self._count = target
+        logger.info(f"Evicted {count - target} embeddings from the cache")
+
+    def prune(self, max_entries: int) -> int:
+        """Evict least recently used entries until at most max_entries remain."""
+        with self._lock:
+            count = self._count_entries()
+            excess = max(0, count - max_entries)
+            if excess:
+                self._conn.execute("""
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?
+                    )
+                """, (excess,))
+                self._conn.commit()
+            self._count = count - excess
+        return excess
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counts for this process and the size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+            models = dict(self._conn.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "vector_bytes": size,
+            "models": models
+        }
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache, or None when EMBEDDING_CACHE_ENABLED=0."""
+    global _default_cache
+    if _default_cache is None and EMBEDDING_CACHE_ENABLED:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = EmbeddingCache()
+    return _default_cache
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune the embedding cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show entry count, size and models")
+    prune_parser = subparsers.add_parser("prune", help="Evict least recently used entries")
+    prune_parser.add_argument("--max-entries", type=int, required=True)
+    args = parser.parse_args()
+
+    cache = EmbeddingCache()
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"Cache file: {cache.path}")
+        print(f"Entries: {stats['entries']} of {cache.max_entries} ({stats['vector_bytes'] / (1024 * 1024):.2f} MB of vectors)")
+        for model, count in stats["models"].items():
+            print(f"  {model}: {count}")
+    elif args.command == "prune":
+        print(f"Removed {cache.prune(args.max_entries)} entries")
+
+if __name__ == "__main__":
+    main()
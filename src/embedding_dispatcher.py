@@ -0,0 +1,287 @@
+# embedding_dispatcher.py
+
+import json
+import zlib
+import time
+import random
+import logging
+import threading
+import urllib.request
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate for budgeting (about 4 characters per token for English text).
+    """
+    return max(1, len(text) // 4)
+
+def pack_batches(token_counts: List[int], max_tokens: int, max_items: int) -> List[List[int]]:
+    """
+    Greedily pack items into batches by token count, keeping input order.
+
+    A batch is closed when adding the next item would exceed max_tokens or
+    max_items. An item that alone exceeds max_tokens gets a batch of its own,
+    and the provider truncates it.
+
+    Args:
+        token_counts (List[int]): Estimated tokens of each item.
+        max_tokens (int): Token budget per batch.
+        max_items (int): Maximum number of items per batch.
+
+    Returns:
+        List[List[int]]: The item indices of each batch.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+class RateLimiter:
+    """
+    Thread-safe token-bucket limiter for a requests-per-minute and a tokens-per-minute budget.
+
+    Either budget can be None to leave it unlimited. Each bucket holds up to one
+    minute of budget and refills continuously.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute or 0.0
+        self._tokens = tokens_per_minute or 0.0
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens: int = 0):
+        """Block until one request carrying `tokens` tokens fits in the budget."""
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)  # A single oversized request must still go through
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens
+                    return
+            time.sleep(wait)
+
+@dataclass
+class DispatchResult:
+    """Per-batch outcome of EmbeddingDispatcher.dispatch, in the order the batches were given."""
+    embeddings: List[Optional[List[List[float]]]]
+    errors: Dict[int, str] = field(default_factory=dict)
+    retries: int = 0
+    # (chunks, estimated tokens, seconds) of each successful request
+    timings: List[Tuple[int, int, float]] = field(default_factory=list)
+
+    @property
+    def failed_batches(self) -> List[int]:
+        return sorted(self.errors)
+
+    def throughput(self) -> Dict[str, float]:
+        """Aggregate chunks/s and tokens/s over the successful requests."""
+        seconds = sum(timing[2] for timing in self.timings)
+        chunks = sum(timing[0] for timing in self.timings)
+        tokens = sum(timing[1] for timing in self.timings)
+        return {
+            "chunks": chunks,
+            "tokens": tokens,
+            "chunks_per_s": chunks / seconds if seconds else 0.0,
+            "tokens_per_s": tokens / seconds if seconds else 0.0
+        }
+
+class EmbeddingDispatcher:
+    """
+    Runs embedding requests concurrently within a rate budget, retrying failures.
+
+    Up to max_in_flight batches are sent at once. The executor is shared by every
+    dispatch() call on the same dispatcher, so the concurrency limit and the rate
+    budget hold process-wide even when several pipeline workers embed at the same time.
+    """
+
+    def __init__(self,
+                 embed_fn: Callable[[List[str]], List[List[float]]],
+                 max_in_flight: int = 4,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_retries: int = 5,
+                 backoff_base: float = 1.0,
+                 backoff_max: float = 60.0,
+                 is_retryable: Callable[[Exception], bool] = lambda e: True,
+                 token_estimator: Callable[[str], int] = estimate_tokens):
+        self.embed_fn = embed_fn
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.is_retryable = is_retryable
+        self.token_estimator = token_estimator
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed")
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential backoff with jitter, so retried batches don't arrive in lockstep
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run_batch(self, texts: List[str]) -> Dict[str, Any]:
+        tokens = sum(self.token_estimator(text) for text in texts)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            try:
+                start = time.perf_counter()
+                embeddings = self.embed_fn(texts)
+                elapsed = time.perf_counter() - start
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+                logger.info(f"Embedded batch of {len(texts)} chunks (~{tokens} tokens) in {elapsed:.2f}s: "
+                            f"{len(texts) / elapsed if elapsed else 0:.1f} chunks/s, "
+                            f"{tokens / elapsed if elapsed else 0:.0f} tokens/s")
+                return {"embeddings": embeddings, "retries": attempt, "timing": (len(texts), tokens, elapsed)}
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    return {"error": f"{type(e).__name__}: {str(e)}", "retries": attempt}
+                delay = self._backoff(attempt)
+                logger.warning(f"Embedding batch of {len(texts)} failed ({type(e).__name__}: {str(e)}), "
+                               f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+                attempt += 1
+
+    def dispatch(self, batches: List[List[str]]) -> DispatchResult:
+        """
+        Embed every batch and wait for all of them.
+
+        Args:
+            batches (List[List[str]]): The texts of each request.
+
+        Returns:
+            DispatchResult: The embeddings of each batch (None for batches that still
+                            failed after retries) and the error of each failed batch.
+        """
+        futures = [self._executor.submit(self._run_batch, texts) for texts in batches]
+        result = DispatchResult(embeddings=[None] * len(batches))
+        for i, future in enumerate(futures):
+            outcome = future.result()
+            result.retries += outcome["retries"]
+            if "error" in outcome:
+                result.errors[i] = outcome["error"]
+            else:
+                result.embeddings[i] = outcome["embeddings"]
+                result.timings.append(outcome["timing"])
+        return result
+
+class HTTPEmbeddingClient:
+    """
+    Minimal client for a Voyage-compatible embeddings endpoint (POST {base_url}/embeddings).
+
+    Used when VOYAGE_API_BASE points at a proxy or at a local stub server.
+    """
+
+    class Result:
+        def __init__(self, embeddings: List[List[float]], total_tokens: int):
+            self.embeddings = embeddings
+            self.total_tokens = total_tokens
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, timeout: float = 60.0):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def embed(self, texts: List[str], model: str, input_type: Optional[str] = None) -> "HTTPEmbeddingClient.Result":
+        body = json.dumps({"input": texts, "model": model, "input_type": input_type}).encode('utf-8')
+        request = urllib.request.Request(f"{self.base_url}/embeddings", data=body, method="POST",
+                                         headers={"Content-Type": "application/json",
+                                                  "Authorization": f"Bearer {self.api_key or ''}"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = json.load(response)
+        data = sorted(payload["data"], key=lambda item: item["index"])
+        return self.Result([item["embedding"] for item in data], payload.get("usage", {}).get("total_tokens", 0))
+
+class StubEmbeddingServer:
+    """
+    Local Voyage-compatible embeddings server for exercising the dispatcher offline.
+
+    Returns small deterministic vectors after `latency` seconds. The first requests
+    get the HTTP statuses in `fail_statuses`, one each, then a `failure_rate`
+    fraction of requests fails with HTTP 429 or 503.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.05, failure_rate: float = 0.2, dimensions: int = 8,
+                 fail_statuses: Optional[List[int]] = None):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server.lock:
+                    server.requests += 1
+                    status = server.fail_statuses.pop(0) if server.fail_statuses else None
+                time.sleep(server.latency)
+                if status is None and random.random() < server.failure_rate:
+                    status = random.choice([429, 503])
+                if status is not None:
+                    self.send_response(status)
+                    self.end_headers()
+                    return
+                data = [{"object": "embedding", "index": i,
+                         "embedding": [float((zlib.crc32(text.encode("utf-8")) >> shift) % 1000) / 1000 for shift in range(server.dimensions)]}
+                        for i, text in enumerate(payload["input"])]
+                body = json.dumps({"object": "list", "data": data, "model": payload["model"],
+                                   "usage": {"total_tokens": sum(estimate_tokens(t) for t in payload["input"])}})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body.encode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.dimensions = dimensions
+        self.fail_statuses = list(fail_statuses or [])
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> "StubEmbeddingServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,194 @@
+# extraction_cache.py
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Union
+import pypdf
+from dotenv import load_dotenv
+
+from cache_paths import CACHE_DIR
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Bump the suffix whenever the way we post-process extracted text changes.
+# The pypdf version is part of the key because its layout output changes between releases.
+EXTRACTOR_VERSION = f"pypdf-{pypdf.__version__}-v1"
+
+EXTRACTION_CACHE_DIR = Path(os.getenv('EXTRACTION_CACHE_DIR', CACHE_DIR / 'extraction'))
+EXTRACTION_CACHE_MAX_MB = float(os.getenv('EXTRACTION_CACHE_MAX_MB', 512))
+
+def file_hash(source: Union[str, bytes]) -> str:
+    """
+    Compute the SHA-256 of a file's content.
+
+    Args:
+        source (Union[str, bytes]): A file path, or the raw file bytes.
+
+    Returns:
+        str: The hex digest.
+    """
+    hasher = hashlib.sha256()
+    if isinstance(source, bytes):
+        hasher.update(source)
+    else:
+        with open(source, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                hasher.update(block)
+    return hasher.hexdigest()
+
+class ExtractionCache:
+    """
+    On-disk cache of per-page PDF text, keyed by file content hash and extractor version.
+
+    Each entry is one gzipped JSON file. An entry's mtime is refreshed on every hit,
+    so eviction removes the least recently used entries first.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path] = EXTRACTION_CACHE_DIR,
+                 max_bytes: int = int(EXTRACTION_CACHE_MAX_MB * 1024 * 1024),
+                 version: str = EXTRACTOR_VERSION):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.version = version
+
+    def _entry_path(self, content_hash: str, version: Optional[str] = None) -> Path:
+        return self.cache_dir / f"{content_hash}.{version or self.version}.json.gz"
+
+    def get(self, content_hash: str) -> Optional[List[str]]:
+        """Return the cached pages for a content hash, or None on a miss."""
+        path = self._entry_path(content_hash)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                entry = json.load(file)
+            os.utime(path)  # Mark as recently used
+            return entry["pages"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {path.name}: {str(e)}")
+            path.unlink(missing_ok=True)
+            return None
+
+    def put(self, content_hash: str, pages: List[str], source: str = ""):
+        """Store the pages for a content hash, then evict old entries if over budget."""
+        path = self._entry_path(content_hash)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        entry = {
+            "version": self.version,
+            "source": source,
+            "created": time.time(),
+            "pages": pages
+        }
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, path)  # Atomic, so readers never see a partial entry
+        except Exception as e:
+            logger.error(f"Error writing extraction cache entry for {source}: {str(e)}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        self.prune()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """List cache entries, most recently used first."""
+        entries = []
+        for path in self.cache_dir.glob("*.json.gz"):
+            content_hash, version = path.name[:-len(".json.gz")].split(".", 1)
+            stat = path.stat()
+            entries.append({
+                "path": path,
+                "hash": content_hash,
+                "version": version,
+                "bytes": stat.st_size,
+                "last_used": stat.st_mtime
+            })
+        return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+    def total_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self.entries())
+
+    def prune(self, max_bytes: Optional[int] = None, drop_stale: bool = True) -> int:
+        """
+        Evict entries until the cache fits in max_bytes.
+
+        Args:
+            max_bytes (Optional[int]): Size budget. Defaults to the cache's max_bytes.
+            drop_stale (bool): Also remove entries written by another extractor version.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = 0
+        total = 0
+        for entry in self.entries():
+            stale = drop_stale and entry["version"] != self.version
+            if stale or total + entry["bytes"] > max_bytes:
+                entry["path"].unlink(missing_ok=True)
+                removed += 1
+            else:
+                total += entry["bytes"]
+        if removed:
+            logger.info(f"Evicted {removed} extraction cache entries ({total} bytes remain)")
+        return removed
+
+    def clear(self) -> int:
+        """Remove every entry."""
+        return self.prune(max_bytes=0)
+
+_default_cache = None
+
+def get_default_cache() -> ExtractionCache:
+    """Return the process-wide extraction cache."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ExtractionCache()
+    return _default_cache
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune the PDF extraction cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show entry count and total size")
+    subparsers.add_parser("list", help="List entries, most recently used first")
+    prune_parser = subparsers.add_parser("prune", help="Evict least recently used entries")
+    prune_parser.add_argument("--max-mb", type=float, default=EXTRACTION_CACHE_MAX_MB,
+                              help="Size budget in megabytes")
+    subparsers.add_parser("clear", help="Remove every entry")
+    args = parser.parse_args()
+
+    cache = get_default_cache()
+    if args.command == "stats":
+        entries = cache.entries()
+        stale = sum(1 for entry in entries if entry["version"] != cache.version)
+        print(f"Cache directory: {cache.cache_dir}")
+        print(f"Extractor version: {cache.version}")
+        print(f"Entries: {len(entries)} ({stale} stale)")
+        print(f"Size: {cache.total_bytes() / (1024 * 1024):.2f} MB of {cache.max_bytes / (1024 * 1024):.2f} MB")
+    elif args.command == "list":
+        for entry in cache.entries():
+            with gzip.open(entry["path"], 'rt', encoding='utf-8') as file:
+                data = json.load(file)
+            last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry["last_used"]))
+            print(f"{entry['hash'][:12]}  {entry['version']}  {len(data['pages']):>5} pages  "
+                  f"{entry['bytes'] / 1024:>9.1f} KB  {last_used}  {data.get('source', '')}")
+    elif args.command == "prune":
+        removed = cache.prune(max_bytes=int(args.max_mb * 1024 * 1024))
+        print(f"Removed {removed} entries")
+    elif args.command == "clear":
+        removed = cache.clear()
+        print(f"Removed {removed} entries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# ingestion_manifest.py
+
+import os
+import json
+import time
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+
+from cache_paths import CACHE_DIR
+from extraction_cache import file_hash
+from document_processing import CHUNK_FORMAT_VERSION
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = Path(os.getenv('INGEST_MANIFEST_PATH', CACHE_DIR / 'ingest_manifest.json'))
+MANIFEST_VERSION = 1
+
+@dataclass
+class IngestionPlan:
+    """Files to ingest or drop on this run, as manifest-style entries."""
+    added: List[Dict[str, Any]] = field(default_factory=list)
+    changed: List[Dict[str, Any]] = field(default_factory=list)
+    unchanged: List[Dict[str, Any]] = field(default_factory=list)
+    removed: List[Dict[str, Any]] = field(default_factory=list)
+    # Manifest entries for changed files as they were before this run
+    previous: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def to_ingest(self) -> Dict[str, List[str]]:
+        """Added and changed files, grouped by manufacturer."""
+        pdf_paths: Dict[str, List[str]] = {}
+        for entry in self.added + self.changed:
+            pdf_paths.setdefault(entry["manufacturer"], []).append(entry["path"])
+        return pdf_paths
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        return (f"{len(self.added)} added, {len(self.changed)} changed, "
+                f"{len(self.unchanged)} unchanged, {len(self.removed)} removed")
+
+class IngestionManifest:
+    """
+    Record of every ingested PDF: content hash, mtime, size, chunk IDs and embedding model.
+
+    Files are keyed by their path relative to the data directory, so the
+    manifest stays valid if the checkout moves.
+    """
+
+    def __init__(self, path: Path = MANIFEST_PATH):
+        self.path = Path(path)
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self):
+        """Load the manifest from disk. A missing or unreadable manifest starts empty."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get("version") != MANIFEST_VERSION:
+                logger.warning(f"Ignoring manifest with version {data.get('version')}")
+                return
+            self.files = data["files"]
+            logger.info(f"Loaded ingestion manifest with {len(self.files)} files from {self.path}")
+        except FileNotFoundError:
+            logger.info(f"No ingestion manifest at {self.path}, starting a new one")
+        except Exception as e:
+            logger.error(f"Error loading ingestion manifest {self.path}: {str(e)}")
+
+    def save(self):
+        """Write the manifest atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, file, indent=2)
+        os.replace(tmp_path, self.path)
+        logger.info(f"Saved ingestion manifest with {len(self.files)} files to {self.path}")
+
+    def plan(self, discovered: Dict[str, List[str]], data_dir: Path, embedding_model: str) -> IngestionPlan:
+        """
+        Compare the files on disk with the manifest.
+
+        A file whose mtime and size match its entry is assumed unchanged without
+        hashing it. Otherwise the content hash decides. Every file counts as changed
+        when the embedding model or the chunk format (CHUNK_FORMAT_VERSION) differs
+        from the one it was ingested with.
+
+        Args:
+            discovered (Dict[str, List[str]]): Manufacturer name to PDF paths, as returned by discover_pdfs.
+            data_dir (Path): The directory the paths are relative to.
+            embedding_model (str): The embedding model this run will use.
+
+        Returns:
+            IngestionPlan: The added, changed, unchanged and removed files.
+        """
+        plan = IngestionPlan()
+        seen = set()
+        for manufacturer, paths in discovered.items():
+            for path in paths:
+                key = self.key_for(path, data_dir)
+                seen.add(key)
+                stat = os.stat(path)
+                entry = {
+                    "key": key,
+                    "path": path,
+                    "manufacturer": manufacturer,
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size
+                }
+                old = self.files.get(key)
+                same_model = (old is not None and old.get("embedding_model") == embedding_model
+                              and old.get("chunk_format", 1) == CHUNK_FORMAT_VERSION)
+                if same_model and old["mtime"] == stat.st_mtime and old["size"] == stat.st_size:
+                    plan.unchanged.append({**old, **entry})
+                    continue
+
+                entry["file_hash"] = file_hash(path)
+                if old is None:
+                    plan.added.append(entry)
+                elif same_model and old["file_hash"] == entry["file_hash"]:
+                    # Touched but not modified: just refresh the stat fields
+                    old.update(mtime=stat.st_mtime, size=stat.st_size)
+                    plan.unchanged.append({**old, **entry})
+                else:
+                    plan.changed.append(entry)
+                    plan.previous[key] = old
+
+        plan.removed = [{"key": key, **entry} for key, entry in self.files.items() if key not in seen]
+        logger.info(f"Ingestion plan: {plan.summary()}")
+        return plan
+
+    def record(self, key: str, path: str, manufacturer: str, content_hash: str,
+               chunk_ids: List[str], embedding_model: str):
+        """Record a successfully ingested file."""
+        stat = os.stat(path)
+        self.files[key] = {
+            "manufacturer": manufacturer,
+            "file_hash": content_hash,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "chunk_ids": chunk_ids,
+            "embedding_model": embedding_model,
+            "chunk_format": CHUNK_FORMAT_VERSION,
+            "ingested_at": time.time()
+        }
+
+    def forget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Drop a file from the manifest, returning its old entry."""
+        return self.files.pop(key, None)
+
+    @staticmethod
+    def key_for(path: str, data_dir: Path) -> str:
+        return Path(path).resolve().relative_to(Path(data_dir).resolve()).as_posix()
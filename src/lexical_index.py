@@ -0,0 +1,287 @@
+# lexical_index.py
+
+import os
+import re
+import json
+import gzip
+import math
+import logging
+import argparse
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+from cache_paths import CACHE_DIR
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_DIR = Path(os.getenv('LEXICAL_INDEX_DIR', CACHE_DIR / 'bm25'))
+BM25_K1 = float(os.getenv('BM25_K1', 1.2))
+BM25_B = float(os.getenv('BM25_B', 0.75))
+
+# Words, numbers and codes joined by - . / (e.g. "puz-zm100vka", "r32", "3.5")
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-case word tokens for BM25.
+
+    Product codes are kept whole and also split into their parts, so "PUZ-ZM100VKA"
+    matches a query for the full code as well as one for "zm100vka".
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part and part not in _STOPWORDS)
+    return tokens
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over chunks, with filterable fields.
+
+    Each document carries a few string fields (e.g. filename, manufacturer, section).
+    search() takes include/exclude filters on them, resolved through a
+    field -> value -> slots map before scoring, so filtering costs in proportion
+    to the documents it matches rather than the whole index. Postings map each term to
+    {document slot: term frequency}. Every document keeps its term counts, so
+    removing or replacing one updates the postings exactly.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._slot_of: Dict[str, int] = {}
+        self._doc_ids: List[Optional[str]] = []
+        self._terms: List[Optional[Dict[str, int]]] = []
+        self._fields: List[Optional[Dict[str, str]]] = []
+        self._by_field: Dict[str, Dict[str, set]] = {}
+        self._lengths: List[int] = []
+        self._free: List[int] = []
+        self._total_length = 0
+        # Arbitrary metadata persisted with the index, e.g. what it was built from
+        self.meta: Dict[str, Any] = {}
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._slot_of
+
+    def add(self, doc_id: str, text: str, fields: Optional[Dict[str, str]] = None):
+        """Index a document, replacing any previous version with the same id."""
+        self.add_many([(doc_id, text, fields)])
+
+    def add_many(self, docs: Iterable[Tuple[str, str, Optional[Dict[str, str]]]]):
+        """Index (doc_id, text, fields) tuples."""
+        with self._lock:
+            for doc_id, text, fields in docs:
+                doc_id = str(doc_id)
+                if doc_id in self._slot_of:
+                    self._remove_slot(self._slot_of[doc_id])
+                terms = dict(Counter(tokenize(text)))
+                slot = self._free.pop() if self._free else len(self._doc_ids)
+                if slot == len(self._doc_ids):
+                    self._doc_ids.append(None)
+                    self._terms.append(None)
+                    self._fields.append(None)
+                    self._lengths.append(0)
+                self._doc_ids[slot] = doc_id
+                self._terms[slot] = terms
+                self._fields[slot] = dict(fields or {})
+                self._lengths[slot] = sum(terms.values())
+                self._total_length += self._lengths[slot]
+                self._slot_of[doc_id] = slot
+                for term, count in terms.items():
+                    self._postings.setdefault(term, {})[slot] = count
+                for field, value in self._fields[slot].items():
+                    self._by_field.setdefault(field, {}).setdefault(value, set()).add(slot)
+            self.dirty = True
+
+    def _remove_slot(self, slot: int):
+        # Called with the lock held
+        for term in self._terms[slot]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(slot, None)
+                if not postings:
+                    del self._postings[term]
+        for field, value in self._fields[slot].items():
+            slots = self._by_field[field][value]
+            slots.discard(slot)
+            if not slots:
+                del self._by_field[field][value]
+        del self._slot_of[self._doc_ids[slot]]
+        self._total_length -= self._lengths[slot]
+        self._doc_ids[slot] = self._terms[slot] = self._fields[slot] = None
+        self._lengths[slot] = 0
+        self._free.append(slot)
+
+    def remove(self, doc_ids: Iterable[str]) -> int:
+        """Remove documents by id. Returns how many were indexed."""
+        removed = 0
+        with self._lock:
+            for doc_id in doc_ids:
+                slot = self._slot_of.get(str(doc_id))
+                if slot is not None:
+                    self._remove_slot(slot)
+                    removed += 1
+            if removed:
+                self.dirty = True
+        return removed
+
+    def remove_where(self, field: str, value: str) -> int:
+        """Remove every document whose `field` equals `value`, e.g. all chunks of one file."""
+        with self._lock:
+            slots = self._by_field.get(field, {}).get(value, ())
+            return self.remove([self._doc_ids[slot] for slot in list(slots)])
+
+    def field_values(self, field: str) -> Dict[str, int]:
+        """How many documents have each value of a field."""
+        with self._lock:
+            return {value: len(slots) for value, slots in self._by_field.get(field, {}).items()}
+
+    def _slots_with(self, field: str, values: Sequence[str]) -> np.ndarray:
+        by_value = self._by_field.get(field, {})
+        slots = [slot for value in values for slot in by_value.get(value, ())]
+        return np.asarray(slots, dtype=np.int64)
+
+    def _allowed(self, include: Optional[Dict[str, Sequence[str]]], exclude: Optional[Dict[str, Sequence[str]]]) -> Optional[np.ndarray]:
+        """Boolean mask over slots for the filters, or None when nothing is filtered."""
+        include = {field: values for field, values in (include or {}).items() if values is not None}
+        exclude = {field: values for field, values in (exclude or {}).items() if values}
+        if not include and not exclude:
+            return None
+        allowed = np.ones(len(self._doc_ids), dtype=bool)
+        for field, values in include.items():
+            matching = np.zeros(len(self._doc_ids), dtype=bool)
+            matching[self._slots_with(field, values)] = True
+            allowed &= matching
+        for field, values in exclude.items():
+            allowed[self._slots_with(field, values)] = False
+        return allowed
+
+    def search(self, query: str, k: int = 10, include: Optional[Dict[str, Sequence[str]]] = None,
+               exclude: Optional[Dict[str, Sequence[str]]] = None) -> List[Tuple[str, float]]:
+        """
+        Rank documents against a query with BM25.
+
+        Args:
+            query (str): The query text.
+            k (int): Number of results.
+            include (Optional[Dict[str, Sequence[str]]]): Only documents whose field value is in the list, e.g. {"manufacturer": ["Daikin"]}.
+            exclude (Optional[Dict[str, Sequence[str]]]): Skip documents whose field value is in the list, e.g. {"filename": ["old.pdf"]}.
+
+        Returns:
+            List[Tuple[str, float]]: (doc_id, score) pairs, best first. Documents sharing no term with the query are not returned.
+        """
+        terms = Counter(tokenize(query))
+        with self._lock:
+            n_docs = len(self._slot_of)
+            if not terms or not n_docs:
+                return []
+            allowed = self._allowed(include, exclude)
+            lengths = np.asarray(self._lengths, dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * lengths / (self._total_length / n_docs))
+            scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+            for term, query_count in terms.items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                slots = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+                tf = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                scores[slots] += query_count * idf * tf * (self.k1 + 1) / (tf + norm[slots])
+            if allowed is not None:
+                scores[~allowed] = 0
+            candidates = np.flatnonzero(scores > 0)
+            if not len(candidates):
+                return []
+            k = min(k, len(candidates))
+            best = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            best = best[np.argsort(-scores[best], kind="stable")]
+            return [(self._doc_ids[slot], float(scores[slot])) for slot in best]
+
+    def save(self, path: Path):
+        """Write the documents' term counts and fields atomically as gzipped JSON; postings are rebuilt on load."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with self._lock:
+            payload = {
+                "k1": self.k1,
+                "b": self.b,
+                "meta": self.meta,
+                "docs": [[doc_id, terms, fields] for doc_id, terms, fields in zip(self._doc_ids, self._terms, self._fields)
+                         if doc_id is not None]
+            }
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        """Load an index written by save()."""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        index = cls(payload["k1"], payload["b"])
+        index.meta = payload.get("meta", {})
+        for slot, (doc_id, terms, fields) in enumerate(payload["docs"]):
+            index._doc_ids.append(doc_id)
+            index._terms.append(terms)
+            index._fields.append(fields)
+            index._lengths.append(sum(terms.values()))
+            index._slot_of[doc_id] = slot
+            for term, count in terms.items():
+                index._postings.setdefault(term, {})[slot] = count
+            for field, value in fields.items():
+                index._by_field.setdefault(field, {}).setdefault(value, set()).add(slot)
+        index._total_length = sum(index._lengths)
+        return index
+
+def index_path(name: str) -> Path:
+    return LEXICAL_INDEX_DIR / f"{name}.json.gz"
+
+def load_or_create(name: str) -> BM25Index:
+    """Load a named index from LEXICAL_INDEX_DIR, or start an empty one if it is missing or unreadable."""
+    path = index_path(name)
+    if path.exists():
+        try:
+            return BM25Index.load(path)
+        except Exception as e:
+            logger.warning(f"Could not load lexical index {path}, starting empty: {str(e)}")
+    return BM25Index()
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a persisted BM25 index.")
+    parser.add_argument("name", help="Index name, e.g. pdf_chunks or products")
+    parser.add_argument("query", nargs="?", help="Query text; omit to print index statistics")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    index = load_or_create(args.name)
+    if not args.query:
+        print(f"{index_path(args.name)}: {len(index)} documents, {len(index._postings)} terms")
+        return
+    for doc_id, score in index.search(args.query, args.k):
+        print(f"{score:8.3f}  {doc_id}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# llm_streaming.py
+
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+from prompt_cache import describe_usage
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between two renders of a growing answer; each render is a message to the browser
+STREAM_RENDER_INTERVAL = float(os.getenv('STREAM_RENDER_INTERVAL', 0.05))
+
+@dataclass
+class StreamResult:
+    """Outcome of stream_answer."""
+    text: str = ""
+    # True when should_cancel stopped the stream before the model finished
+    cancelled: bool = False
+    stop_reason: Optional[str] = None
+    # Time to the first text token and to the end of the stream
+    ttft_ms: Optional[float] = None
+    total_ms: float = 0.0
+    usage: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        """Whether the answer is whole and may be stored in history and caches."""
+        return not self.cancelled and self.stop_reason is not None
+
+def stream_answer(client: Any, model: str, system: Any, messages: List[Dict[str, Any]], max_tokens: int = 1000,
+                  on_text: Optional[Callable[[str], None]] = None, should_cancel: Optional[Callable[[], bool]] = None,
+                  render_interval: float = STREAM_RENDER_INTERVAL) -> StreamResult:
+    """
+    Generate an answer with the streaming Messages API, rendering it as it arrives.
+
+    on_text receives the whole answer so far, at most once per render_interval and
+    once more at the end. Leaving the stream early (should_cancel returning True, or
+    an exception raised by on_text, such as Streamlit stopping the script for a
+    rerun) closes the HTTP response, so the model stops generating for us.
+
+    Args:
+        client (Any): An anthropic.Anthropic client.
+        model (str): The model name.
+        system (Any): The system prompt, a string or a list of content blocks.
+        messages (List[Dict[str, Any]]): The conversation messages.
+        max_tokens (int): Output token limit.
+        on_text (Optional[Callable[[str], None]]): Renders the partial answer.
+        should_cancel (Optional[Callable[[], bool]]): Polled after every chunk.
+        render_interval (float): Minimum seconds between on_text calls.
+
+    Returns:
+        StreamResult: The text, whether it was cancelled, time to first token and usage.
+    """
+    result = StreamResult()
+    start = time.perf_counter()
+    parts: List[str] = []
+    last_render = 0.0
+    with client.messages.stream(model=model, max_tokens=max_tokens, system=system, messages=messages) as stream:
+        for text in stream.text_stream:
+            now = time.perf_counter()
+            if result.ttft_ms is None:
+                result.ttft_ms = (now - start) * 1000
+            parts.append(text)
+            if should_cancel is not None and should_cancel():
+                result.cancelled = True
+                break
+            if on_text is not None and now - last_render >= render_interval:
+                on_text("".join(parts))
+                last_render = now
+        if not result.cancelled:
+            final = stream.get_final_message()
+            result.stop_reason = final.stop_reason
+            result.usage = {name: value for name, value in vars(final.usage).items() if isinstance(value, int)}
+    result.text = "".join(parts)
+    result.total_ms = (time.perf_counter() - start) * 1000
+    if on_text is not None:
+        on_text(result.text)
+    ttft = f"{result.ttft_ms:.0f}ms" if result.ttft_ms is not None else "n/a"
+    logger.info(f"Streamed {len(result.text)} characters from {model}: first token {ttft}, total {result.total_ms:.0f}ms"
+                + (" (cancelled)" if result.cancelled else f"; {describe_usage(result.usage)}"))
+    return result
+
+class CancelToken:
+    """
+    Cancels the previous answer of a session when a new question starts.
+
+    Keep one in the session state and call start() for every question. It returns a
+    should_cancel callable that turns True once a newer question has started.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def start(self) -> Callable[[], bool]:
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        return lambda: self._generation != generation
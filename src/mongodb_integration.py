@@ -1,11 +1,27 @@
 import os
 import logging
-from typing import Dict, List, Any
-from pymongo import MongoClient, ASCENDING
-from pymongo.errors import ConnectionFailure, OperationFailure
+import argparse
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Sequence, Tuple, Union
+import numpy as np
+from pymongo import ASCENDING, InsertOne, ReplaceOne, ReturnDocument
+from pymongo.operations import SearchIndexModel
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, OperationFailure
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 
+from db_client import get_client, check_health
+from vector_codec import VECTOR_ENCODING, encode_vector, decode_vector, decode_vectors
+from ann_index import IVFFlatIndex, index_path
+from vector_search import ExactSearchEngine, delete_snapshot
+import lexical_index
+from answer_cache import AnswerCache, get_default_cache as get_answer_cache
+from context_snapshot import ContextSnapshot, CONTEXT_SNAPSHOT_MAX_CHUNKS, CONTEXT_SNAPSHOT_SAMPLE_SIZE
+
 print(f"OS environment MONGODB_URI: {os.environ.get('MONGODB_URI')}")
 # Load environment variables
 load_dotenv()
@@ -26,19 +42,139 @@ if MONGODB_URI:
 else:
     print("MongoDB URI not found in .env file")
 DB_NAME = 'product_comparison'  # You can change the database name
+# Every manufacturer's chunks live in one collection, filtered by the top-level manufacturer field
+PRODUCTS_COLLECTION = os.getenv('PRODUCTS_COLLECTION', 'products')
+# Collections written by older versions, one per manufacturer, migrated with `python mongodb_integration.py migrate`
+LEGACY_COLLECTION_SUFFIX = '_products'
+# Metadata fields copied to the top level of each chunk so they can be indexed and filtered on
+PROMOTED_FIELDS = ("manufacturer", "filename", "chunk_index", "page", "section")
+# Number of operations sent per bulk_write call
+MONGODB_BULK_BATCH_SIZE = int(os.getenv('MONGODB_BULK_BATCH_SIZE', 1000))
+# Documents per network round trip when reading, and per _id-range query when paginating
+MONGODB_CURSOR_BATCH_SIZE = int(os.getenv('MONGODB_CURSOR_BATCH_SIZE', 500))
+MONGODB_PAGE_SIZE = int(os.getenv('MONGODB_PAGE_SIZE', 5000))
+# Chunk _ids are chunk ID strings, older documents have ObjectIds. BSON orders all strings
+# before all ObjectIds, so pagination walks one type range after the other.
+_ID_TYPES = ("string", "objectId")
+# How retrieve_similar_documents searches: atlas ($vectorSearch only), ann (local IVF index),
+# exact (local brute force), or auto (atlas, else exact for collections up to
+# EXACT_SEARCH_MAX_VECTORS vectors, else ann)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'auto')
+RETRIEVAL_MODES = ("auto", "atlas", "ann", "exact")
+EXACT_SEARCH_MAX_VECTORS = int(os.getenv('EXACT_SEARCH_MAX_VECTORS', 200000))
+# Seconds auto mode searches locally after the server rejected $vectorSearch for a reason
+# that can go away, such as a missing or still building vector index
+VECTOR_SEARCH_RETRY_TTL = float(os.getenv('VECTOR_SEARCH_RETRY_TTL', 300))
+# Server error code for an unknown aggregation stage: not Atlas, $vectorSearch will never work
+_UNRECOGNIZED_STAGE_CODE = 40324
+# Hybrid search: the k constant of reciprocal rank fusion, and candidates taken from each ranking per result
+RRF_K = int(os.getenv('RRF_K', 60))
+HYBRID_CANDIDATES_PER_RESULT = int(os.getenv('HYBRID_CANDIDATES_PER_RESULT', 4))
+# Name of the BM25 index over the products collection, under LEXICAL_INDEX_DIR
+LEXICAL_INDEX_NAME = 'products'
+# Each ingest run (and each single-document edit) bumps the products collection's version
+# here once it is done, so processes holding state derived from the chunks (context
+# snapshot, local engines) notice the change
+DATA_VERSIONS_COLLECTION = 'data_versions'
+# Seconds a data version read is reused before MongoDB is asked again
+DATA_VERSION_CHECK_TTL = float(os.getenv('DATA_VERSION_CHECK_TTL', 5))
+
+def _to_id(document_id: str):
+    """Chunks use their deterministic chunk ID as _id; older documents use ObjectIds."""
+    return ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """
+    Fuse rankings with reciprocal rank fusion: each document scores sum(1 / (k + rank)).
+
+    Only ranks are used, so BM25 scores and cosine similarities need no calibration.
+
+    Returns:
+        List[Tuple[str, float]]: (doc_id, fused score) pairs, best first.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+@dataclass
+class HybridSearchResult:
+    """Outcome of hybrid_search: the fused documents, best first, and the latency of each stage in milliseconds."""
+    documents: List[Dict[str, Any]] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+    # The query embedding, or None if the vector stage failed
+    query_vector: Optional[List[float]] = None
+
+def _manufacturer_filter(manufacturer: Union[str, List[str]]) -> Dict[str, Any]:
+    """Query filter for one manufacturer or a list of them."""
+    if isinstance(manufacturer, str):
+        return {"manufacturer": manufacturer}
+    return {"manufacturer": {"$in": list(manufacturer)}}
 
 class MongoDBHandler:
-    def __init__(self):
+    def __init__(self, vector_encoding: str = VECTOR_ENCODING, bulk_batch_size: int = MONGODB_BULK_BATCH_SIZE,
+                 retrieval_mode: str = RETRIEVAL_MODE, answer_cache: Optional[AnswerCache] = None):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}'. Available: {', '.join(RETRIEVAL_MODES)}")
         self.client = None
         self.db = None
+        self.vector_encoding = vector_encoding
+        self.bulk_batch_size = bulk_batch_size
+        self._indexes_ensured = False
+        self._vector_index_ensured = False
+        # Set to False after $unionWith fails once (MongoDB before 4.4)
+        self._union_available = True
+        # Local ANN indexes per manufacturer, used when $vectorSearch is unavailable
+        self._ann_indexes: Dict[str, IVFFlatIndex] = {}
+        self._ann_lock = threading.Lock()
+        # Until then (monotonic time) auto mode skips $vectorSearch, see _vector_search_failed
+        self._vector_search_retry_at = 0.0
+        self.retrieval_mode = retrieval_mode
+        # Exact search engines per manufacturer, dropped whenever the manufacturer's chunks change
+        self._exact_engines: Dict[str, ExactSearchEngine] = {}
+        self._exact_lock = threading.Lock()
+        # BM25 index over every manufacturer's chunks, for hybrid search
+        self._lexical_index: Optional[lexical_index.BM25Index] = None
+        self._lexical_lock = threading.Lock()
+        # Runs the two stages of hybrid search; threads are only started on first use
+        self._search_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid-search")
+        # Cached LLM answers built from chunks this handler rewrites or deletes are dropped
+        self.answer_cache = answer_cache if answer_cache is not None else get_answer_cache()
+        # The last data version read, with when it was read
+        self._data_version: Optional[Tuple[Any, float]] = None
+        # Chunks, samples and BM25 index materialized at one data version, shared by every caller.
+        # A newer one is built by a background thread while the old one keeps serving.
+        self._snapshot: Optional[ContextSnapshot] = None
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_thread: Optional[threading.Thread] = None
+
+    def _encode_document(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a copy of doc with its vector packed for storage."""
+        if doc.get("vector") is None:
+            return doc
+        return {**doc, "vector": encode_vector(doc["vector"], self.vector_encoding)}
+
+    @staticmethod
+    def _decode_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Decode a stored vector (packed or legacy array) into a float32 NumPy array in place."""
+        if doc.get("vector") is not None:
+            doc["vector"] = decode_vector(doc["vector"])
+        return doc
 
     def connect(self):
-        """Establish a connection to MongoDB."""
+        """
+        Attach to the shared, pooled MongoDB client.
+
+        The server is pinged at most once per HEALTH_CHECK_TTL seconds per process,
+        so handlers created on every Streamlit rerun don't pay a round trip.
+        """
         try:
-            self.client = MongoClient(MONGODB_URI)
+            self.client = get_client()
             self.db = self.client[DB_NAME]
-            # The ismaster command is cheap and does not require auth.
-            self.client.admin.command('ismaster')
+            healthy, error = check_health()
+            if not healthy:
+                raise ConnectionFailure(error)
             logger.info("Successfully connected to MongoDB")
         except ConnectionFailure:
             logger.error("Server not available")
@@ -48,65 +184,638 @@ class MongoDBHandler:
             raise
 
     def close_connection(self):
-        """Close the MongoDB connection."""
+        """Save local indexes and release the handler. The shared client stays open for other handlers."""
+        self.save_ann_indexes()
+        self.save_lexical_index()
         if self.client:
-            self.client.close()
-            logger.info("Closed MongoDB connection")
+            self.client = None
+            self.db = None
+            logger.info("Released MongoDB connection")
+
+    @property
+    def products(self):
+        return self.db[PRODUCTS_COLLECTION]
+
+    @property
+    def data_versions(self):
+        return self.db[DATA_VERSIONS_COLLECTION]
+
+    def data_version(self, max_age: float = DATA_VERSION_CHECK_TTL) -> Any:
+        """The data version of the products collection (None before the first write), re-read at most every max_age seconds."""
+        cached = self._data_version
+        if cached is not None and time.monotonic() - cached[1] < max_age:
+            return cached[0]
+        doc = self.data_versions.find_one({"_id": PRODUCTS_COLLECTION}, {"version": 1})
+        version = doc["version"] if doc else None
+        self._data_version = (version, time.monotonic())
+        return version
+
+    def bump_data_version(self):
+        """
+        Give the products collection a new data version once a batch of writes is done.
+
+        Called once per ingest run, not per stored batch, so readers rebuild their
+        derived state once. This handler updates its own local engines as it writes;
+        those that reflected the previous version are stamped with the new one, so
+        they stay in use unless another process wrote in between. The context
+        snapshot keeps serving until its background rebuild is swapped in.
+        """
+        try:
+            version = ObjectId()
+            previous = self.data_versions.find_one_and_update(
+                {"_id": PRODUCTS_COLLECTION}, {"$set": {"version": version, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True, return_document=ReturnDocument.BEFORE)
+            previous_key = str((previous or {}).get("version"))
+            with self._ann_lock:
+                for index in self._ann_indexes.values():
+                    if index.version == previous_key:
+                        index.version = str(version)
+            with self._exact_lock:
+                for engine in self._exact_engines.values():
+                    if engine.version == previous_key:
+                        engine.version = str(version)
+            self._data_version = (version, time.monotonic())
+        except Exception as e:
+            logger.error(f"Error bumping the data version: {str(e)}")
+
+    def context_snapshot(self, max_age: float = DATA_VERSION_CHECK_TTL) -> Optional[ContextSnapshot]:
+        """
+        Return the context snapshot, rebuilding it in the background after the data version changes.
+
+        The handler is shared (e.g. cached once per Streamlit process), so every session
+        reads the same snapshot and a prompt costs at most one data version read per
+        max_age seconds. When the version has moved on, the current snapshot is still
+        returned while a background thread builds the new one; only the first call
+        builds synchronously, as there is nothing to serve yet.
+
+        Returns:
+            Optional[ContextSnapshot]: The snapshot, or None if CONTEXT_SNAPSHOT_MAX_CHUNKS is 0 or it can't be built.
+        """
+        if CONTEXT_SNAPSHOT_MAX_CHUNKS <= 0:
+            return None
+        try:
+            version = self.data_version(max_age)
+            snapshot = self._snapshot
+            if snapshot is not None:
+                if snapshot.version != version:
+                    self._start_snapshot_rebuild(version)
+                return snapshot
+            with self._snapshot_lock:
+                if self._snapshot is None:
+                    self._install_snapshot(self._build_snapshot(version))
+                return self._snapshot
+        except Exception as e:
+            logger.error(f"Error building context snapshot: {str(e)}")
+            return None
+
+    def _build_snapshot(self, version: Any) -> ContextSnapshot:
+        fields = ["content", "metadata", "manufacturer", "filename", "section"]
+        return ContextSnapshot.build(version, (doc for manufacturer in self.list_manufacturers()
+                                               for doc in self.iter_documents(manufacturer, fields=fields)),
+                                     self._lexical_fields)
+
+    def _install_snapshot(self, snapshot: ContextSnapshot):
+        """Swap in a built snapshot and its BM25 index."""
+        with self._lexical_lock:
+            self._lexical_index = snapshot.lexical
+        self._snapshot = snapshot
+        self.save_lexical_index()
 
-    def create_vector_index(self, collection_name: str):
-        """Create a vector index for similarity search."""
+    def _start_snapshot_rebuild(self, version: Any):
+        """Build the snapshot at `version` on a background thread, unless a rebuild is already running."""
+        with self._snapshot_lock:
+            if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+                return
+            self._snapshot_thread = threading.Thread(target=self._rebuild_snapshot, args=(version,),
+                                                     name="context-snapshot", daemon=True)
+            self._snapshot_thread.start()
+
+    def _rebuild_snapshot(self, version: Any):
         try:
-            self.db[collection_name].create_index([("vector", ASCENDING)], name="vector_index")
-            logger.info(f"Created vector index for collection {collection_name}")
-        except OperationFailure as e:
-            logger.error(f"Error creating vector index: {str(e)}")
+            logger.info(f"Data version changed to {version}, rebuilding the context snapshot in the background")
+            self._install_snapshot(self._build_snapshot(version))
+        except Exception as e:
+            logger.error(f"Error rebuilding context snapshot: {str(e)}")
+
+    def _version_key(self) -> str:
+        """The current data version as stamped on local engines and their saved files."""
+        return str(self.data_version())
+
+    def ensure_indexes(self, dimensions: int = None):
+        """
+        Create the indexes of the products collection. Runs at most once per handler.
 
-    def store_vectorized_data(self, vectorized_data: Dict[str, List[Dict[str, Any]]]):
-        """Store the vectorized data in MongoDB."""
+        - (manufacturer, filename, chunk_index): per-manufacturer and per-file listing in
+          document order, comparison tables and deleting a file's chunks.
+        - (manufacturer, section, chunk_index): section filters within a manufacturer.
+        - (manufacturer, _id): _id-range pagination within a manufacturer (iter_documents).
+        - "vector_index", an Atlas Vector Search index over the vector with manufacturer
+          and section as pre-filters, when dimensions are known. Outside Atlas search
+          indexes are unsupported and retrieval uses the local engines.
+
+        create_index is a no-op on the server when an identical index already exists.
+        """
+        collection = self.products
+        if not self._indexes_ensured:
+            try:
+                collection.create_index([("manufacturer", ASCENDING), ("filename", ASCENDING), ("chunk_index", ASCENDING)],
+                                        name="manufacturer_filename_chunk")
+                collection.create_index([("manufacturer", ASCENDING), ("section", ASCENDING), ("chunk_index", ASCENDING)],
+                                        name="manufacturer_section_chunk")
+                collection.create_index([("manufacturer", ASCENDING), ("_id", ASCENDING)], name="manufacturer_id")
+                self._indexes_ensured = True
+            except Exception as e:
+                logger.error(f"Error creating indexes on {PRODUCTS_COLLECTION}: {str(e)}")
+        if dimensions is None or self._vector_index_ensured:
+            return
+        self._vector_index_ensured = True
+        try:
+            if any(index.get("name") == "vector_index" for index in collection.list_search_indexes()):
+                return
+            collection.create_search_index(SearchIndexModel(
+                definition={"fields": [
+                    {"type": "vector", "path": "vector", "numDimensions": dimensions, "similarity": "cosine"},
+                    {"type": "filter", "path": "manufacturer"},
+                    {"type": "filter", "path": "section"}
+                ]},
+                name="vector_index",
+                type="vectorSearch"
+            ))
+            logger.info(f"Created vector search index for collection {PRODUCTS_COLLECTION}")
+        except Exception as e:
+            logger.warning(f"Vector search index unavailable for {PRODUCTS_COLLECTION}, using local search: {str(e)}")
+
+    def _ann_index(self, manufacturer: str) -> IVFFlatIndex:
+        """
+        Return the manufacturer's local ANN index at the current data version.
+
+        It is loaded from disk if the saved index was stamped with that version,
+        otherwise built from MongoDB. An index in memory from an older version
+        (another process has ingested since) is replaced the same way.
+        """
+        version = self._version_key()
+        with self._ann_lock:
+            index = self._ann_indexes.get(manufacturer)
+            if index is None or index.version != version:
+                index = None
+                path = index_path(manufacturer)
+                if path.exists():
+                    try:
+                        index = IVFFlatIndex.load(path)
+                    except Exception as e:
+                        logger.warning(f"Could not load ANN index for {manufacturer}, rebuilding: {str(e)}")
+                    if index is not None and index.version != version:
+                        index = None
+                if index is None:
+                    index = IVFFlatIndex()
+                    ids, matrix = self.get_vectors(manufacturer)
+                    if ids:
+                        index.upsert([str(doc_id) for doc_id in ids], matrix)
+                    index.version = version
+                self._ann_indexes[manufacturer] = index
+            return index
+
+    def build_ann_index(self, manufacturer: str) -> IVFFlatIndex:
+        """Rebuild a manufacturer's local ANN index from the vectors in MongoDB and save it."""
+        index = IVFFlatIndex()
+        index.version = self._version_key()
+        ids, matrix = self.get_vectors(manufacturer)
+        if ids:
+            index.upsert([str(doc_id) for doc_id in ids], matrix)
+            index.train()
+        index.save(index_path(manufacturer))
+        with self._ann_lock:
+            self._ann_indexes[manufacturer] = index
+        logger.info(f"Built ANN index for {manufacturer} with {len(index)} vectors")
+        return index
+
+    def _exact_engine(self, manufacturer: str) -> ExactSearchEngine:
+        """
+        Return the manufacturer's exact search engine at the current data version,
+        memory-mapping its snapshot if that was saved at this version or building one from MongoDB.
+        """
+        version = self._version_key()
+        with self._exact_lock:
+            engine = self._exact_engines.get(manufacturer)
+            if engine is None or engine.version != version:
+                engine = ExactSearchEngine.load_snapshot(manufacturer)
+                if engine is None or engine.version != version:
+                    ids, matrix = self.get_vectors(manufacturer)
+                    engine = ExactSearchEngine([str(doc_id) for doc_id in ids], matrix, version=version)
+                    if len(engine):
+                        engine.save_snapshot(manufacturer)
+                    logger.info(f"Built vector snapshot for {manufacturer} with {len(engine)} vectors")
+                self._exact_engines[manufacturer] = engine
+            return engine
+
+    def _invalidate_exact(self, manufacturer: str):
+        """Drop the exact search snapshot after the manufacturer's chunks change."""
+        with self._exact_lock:
+            self._exact_engines.pop(manufacturer, None)
+            delete_snapshot(manufacturer)
+
+    def _local_engine(self, manufacturer: str):
+        """The local engine for a query: the one the retrieval mode names, or in auto mode exact search unless the collection is large."""
+        if self.retrieval_mode == "ann":
+            return self._ann_index(manufacturer)
+        if self.retrieval_mode == "exact":
+            return self._exact_engine(manufacturer)
+        with self._exact_lock:
+            engine = self._exact_engines.get(manufacturer)
+        if engine is not None:
+            return engine
+        snapshot = self._snapshot
+        count = (snapshot.counts.get(manufacturer, 0) if snapshot is not None
+                 else self.products.count_documents({"manufacturer": manufacturer}))
+        if count <= EXACT_SEARCH_MAX_VECTORS:
+            return self._exact_engine(manufacturer)
+        return self._ann_index(manufacturer)
+
+    @staticmethod
+    def _lexical_fields(doc: Dict[str, Any]) -> Dict[str, str]:
+        """The filterable fields of a chunk in the lexical index."""
+        return {name: str(doc[name]) for name in ("manufacturer", "filename", "section") if doc.get(name) is not None}
+
+    def _lexical(self) -> lexical_index.BM25Index:
+        """Return the BM25 index over the products collection, loading it from disk or building it on first use."""
+        with self._lexical_lock:
+            if self._lexical_index is None:
+                index = lexical_index.load_or_create(LEXICAL_INDEX_NAME)
+                if not len(index):
+                    index = self.build_lexical_index(save=False)
+                self._lexical_index = index
+            return self._lexical_index
+
+    def build_lexical_index(self, save: bool = True) -> lexical_index.BM25Index:
+        """Rebuild the BM25 index from every chunk in the products collection."""
+        index = lexical_index.BM25Index()
+        for manufacturer in self.products.distinct("manufacturer"):
+            index.add_many((str(doc["_id"]), doc.get("content", ""), self._lexical_fields(doc)) for doc in
+                           self.iter_documents(manufacturer, fields=["content", "manufacturer", "filename", "section"]))
+        logger.info(f"Built lexical index with {len(index)} chunks")
+        if save:
+            index.save(lexical_index.index_path(LEXICAL_INDEX_NAME))
+            self._lexical_index = index
+        return index
+
+    def save_lexical_index(self):
+        """Persist the BM25 index if it changed since it was loaded."""
+        if self._lexical_index is not None and self._lexical_index.dirty:
+            try:
+                self._lexical_index.save(lexical_index.index_path(LEXICAL_INDEX_NAME))
+            except Exception as e:
+                logger.error(f"Error saving lexical index: {str(e)}")
+
+    def save_ann_indexes(self):
+        """Persist every local ANN index changed since it was loaded."""
+        with self._ann_lock:
+            indexes = list(self._ann_indexes.items())
+        for manufacturer, index in indexes:
+            if index.dirty:
+                try:
+                    index.save(index_path(manufacturer))
+                except Exception as e:
+                    logger.error(f"Error saving ANN index for {manufacturer}: {str(e)}")
+
+    @staticmethod
+    def _promote_fields(doc: Dict[str, Any], manufacturer: str) -> Dict[str, Any]:
+        """Return a copy of doc with the indexed metadata fields (PROMOTED_FIELDS) at the top level."""
+        metadata = doc.get("metadata", {})
+        promoted = {field: metadata[field] for field in PROMOTED_FIELDS if metadata.get(field) is not None}
+        return {**doc, **promoted, "manufacturer": manufacturer}
+
+    def _write_operation(self, doc: Dict[str, Any], manufacturer: str):
+        """Upsert chunks with a deterministic chunk ID, insert anything else."""
+        doc = self._promote_fields(self._encode_document(doc), manufacturer)
+        chunk_id = doc.get("metadata", {}).get("chunk_id")
+        if chunk_id is None:
+            return InsertOne(doc)
+        return ReplaceOne({"_id": chunk_id}, {**doc, "_id": chunk_id}, upsert=True)
+
+    def store_vectorized_data(self, vectorized_data: Dict[str, List[Dict[str, Any]]]) -> int:
+        """
+        Store the vectorized data in MongoDB. Returns the number of documents stored.
+
+        Chunks are keyed by their deterministic chunk ID and written as unordered,
+        batched upserts, so storing the same chunks again replaces them instead of
+        adding duplicates. A failed batch doesn't stop the others, and every chunk
+        known to be written is added to the local search indexes. The caller bumps
+        the data version once the whole ingest run is stored (bump_data_version).
+        """
+        stored = 0
+        collection = self.products
         for manufacturer, docs in vectorized_data.items():
-            collection = self.db[f"{manufacturer}_products"]
+            written = []
+            for i in range(0, len(docs), self.bulk_batch_size):
+                batch = docs[i:i+self.bulk_batch_size]
+                try:
+                    result = collection.bulk_write([self._write_operation(doc, manufacturer) for doc in batch], ordered=False)
+                    stored += result.upserted_count + result.matched_count + result.inserted_count
+                    written.extend(batch)
+                except BulkWriteError as e:
+                    # Unordered, so every operation without a write error was applied
+                    details = e.details
+                    stored += details.get("nUpserted", 0) + details.get("nMatched", 0) + details.get("nInserted", 0)
+                    failed = {error["index"] for error in details.get("writeErrors", [])}
+                    written.extend(doc for j, doc in enumerate(batch) if j not in failed)
+                    logger.error(f"Error storing documents for {manufacturer}: {len(failed)} write errors")
+                except Exception as e:
+                    logger.error(f"Error inserting documents for {manufacturer}: {str(e)}")
+            logger.info(f"Stored {len(written)} of {len(docs)} documents for {manufacturer}")
             try:
-                result = collection.insert_many(docs)
-                logger.info(f"Inserted {len(result.inserted_ids)} documents for {manufacturer}")
-                self.create_vector_index(f"{manufacturer}_products")
+                self._index_vectors(manufacturer, written)
             except Exception as e:
-                logger.error(f"Error inserting documents for {manufacturer}: {str(e)}")
+                logger.error(f"Error indexing documents for {manufacturer}: {str(e)}")
+        return stored
+
+    def _index_vectors(self, manufacturer: str, docs: List[Dict[str, Any]]):
+        """Add stored chunks to the search indexes. Only chunks with a chunk ID are tracked locally."""
+        keyed = [doc for doc in docs if doc.get("vector") is not None and doc.get("metadata", {}).get("chunk_id")]
+        if not keyed:
+            return
+        self.ensure_indexes(len(keyed[0]["vector"]))
+        self._invalidate_exact(manufacturer)
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate_chunks(doc["metadata"]["chunk_id"] for doc in keyed)
+        if self._lexical_index is not None or lexical_index.index_path(LEXICAL_INDEX_NAME).exists():
+            self._lexical().add_many((doc["metadata"]["chunk_id"], doc.get("content", ""),
+                                      self._lexical_fields(self._promote_fields(doc, manufacturer))) for doc in keyed)
+        try:
+            self._ann_index(manufacturer).upsert([doc["metadata"]["chunk_id"] for doc in keyed],
+                                                 np.asarray([doc["vector"] for doc in keyed], dtype=np.float32))
+        except Exception as e:
+            logger.error(f"Error updating ANN index for {manufacturer}: {str(e)}")
+
+    def _fetch_documents(self, ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """Content and metadata of chunks by string id: from the context snapshot when it holds them, the rest with one query."""
+        ids = {str(doc_id) for doc_id in ids}
+        snapshot = self._snapshot
+        found = snapshot.get_documents(ids) if snapshot is not None else {}
+        missing = [_to_id(doc_id) for doc_id in ids if doc_id not in found]
+        if missing:
+            for doc in self.products.find({"_id": {"$in": missing}}, {"content": 1, "metadata": 1}):
+                found[str(doc["_id"])] = doc
+        return found
+
+    def _fetch_scored(self, matches: List[Tuple[List[Any], np.ndarray]]) -> List[List[Dict[str, Any]]]:
+        """Fetch the content and metadata of scored matches, in the same shape as $vectorSearch results."""
+        found = self._fetch_documents(doc_id for ids, _ in matches for doc_id in ids)
+        results = []
+        for ids, scores in matches:
+            docs = []
+            for doc_id, score in zip(ids, scores):
+                doc = found.get(str(doc_id))
+                if doc is not None:
+                    docs.append({**doc, "score": float(score)})
+            results.append(docs)
+        return results
+
+    def _local_search(self, manufacturer: Union[str, List[str]], query: np.ndarray, limit: int) -> Tuple[List[Any], np.ndarray]:
+        """Search each manufacturer's local engine and merge the results by score."""
+        manufacturers = [manufacturer] if isinstance(manufacturer, str) else list(manufacturer)
+        if len(manufacturers) == 1:
+            return self._local_engine(manufacturers[0]).search(query, limit)
+        ids, scores = [], []
+        for name in manufacturers:
+            found_ids, found_scores = self._local_engine(name).search(query, limit)
+            ids.extend(found_ids)
+            scores.extend(found_scores.tolist())
+        order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")[:limit]
+        return [ids[i] for i in order], np.asarray(scores, dtype=np.float32)[order]
+
+    def retrieve_similar_documents_local(self, manufacturer: Union[str, List[str]], query_vector: List[float], limit: int = 5):
+        """Retrieve similar documents with the local exact or ANN engine, in the same shape as $vectorSearch results."""
+        try:
+            return self._fetch_scored([self._local_search(manufacturer, np.asarray(query_vector, dtype=np.float32), limit)])[0]
+        except Exception as e:
+            logger.error(f"Error retrieving similar documents from the local index: {str(e)}")
+            return []
+
+    def retrieve_similar_documents_batch(self, manufacturer: str, query_vectors: List[List[float]], limit: int = 5):
+        """
+        Retrieve similar documents for many query vectors with the local engine.
+
+        Exact search scores all queries with blocked matrix products, and the matched
+        documents are fetched with one query. Atlas mode has no batched form and loops.
+
+        Returns:
+            List[List[Dict[str, Any]]]: The matches for each query vector, best first.
+        """
+        if self.retrieval_mode == "atlas":
+            return [self.retrieve_similar_documents(manufacturer, vector, limit) for vector in query_vectors]
+        try:
+            engine = self._local_engine(manufacturer)
+            queries = np.asarray(query_vectors, dtype=np.float32)
+            if isinstance(engine, ExactSearchEngine):
+                matches = engine.search_batch(queries, limit)
+            else:
+                matches = [engine.search(query, limit) for query in queries]
+            return self._fetch_scored(matches)
+        except Exception as e:
+            logger.error(f"Error retrieving similar documents in batch: {str(e)}")
+            return [[] for _ in query_vectors]
+
+    def retrieve_similar_documents(self, manufacturer: Union[str, List[str]], query_vector: List[float], limit: int = 5,
+                                   sections: Optional[List[str]] = None):
+        """
+        Retrieve similar documents based on vector similarity.
 
-    def retrieve_similar_documents(self, manufacturer: str, query_vector: List[float], limit: int = 5):
-        """Retrieve similar documents based on vector similarity."""
-        collection = self.db[f"{manufacturer}_products"]
+        `manufacturer` can be a list, to search several manufacturers with one query.
+        Uses $vectorSearch in atlas and auto mode; auto mode falls back to the local
+        engines when Atlas Search is unavailable. ann and exact mode only search locally.
+        `sections` is a pre-filter in Atlas; local engines over-fetch and filter.
+        Raises ValueError for a section no chunk belongs to.
+        """
+        self._check_sections(sections)
+        if self.retrieval_mode in ("ann", "exact") or (self.retrieval_mode == "auto" and time.monotonic() < self._vector_search_retry_at):
+            return self._retrieve_local_in_sections(manufacturer, query_vector, limit, sections)
+        search_filter = _manufacturer_filter(manufacturer)
+        if sections:
+            search_filter = {"$and": [search_filter, {"section": {"$in": list(sections)}}]}
         try:
-            similar_docs = collection.aggregate([
+            # $vectorSearch indexes both legacy arrays and packed float32/int8 vectors
+            similar_docs = self.products.aggregate([
                 {
-                    "$search": {
+                    "$vectorSearch": {
                         "index": "vector_index",
-                        "knnBeta": {
-                            "vector": query_vector,
-                            "path": "vector",
-                            "k": limit
-                        }
+                        "queryVector": [float(x) for x in query_vector],
+                        "path": "vector",
+                        "filter": search_filter,
+                        "numCandidates": limit * 10,
+                        "limit": limit
                     }
                 },
                 {
                     "$project": {
                         "content": 1,
                         "metadata": 1,
-                        "score": {"$meta": "searchScore"}
+                        "score": {"$meta": "vectorSearchScore"}
                     }
                 }
             ])
             return list(similar_docs)
         except Exception as e:
-            logger.error(f"Error retrieving similar documents: {str(e)}")
+            if self.retrieval_mode == "atlas":
+                logger.error(f"Error retrieving similar documents: {str(e)}")
+                return []
+            self._vector_search_failed(e)
+            return self._retrieve_local_in_sections(manufacturer, query_vector, limit, sections)
+
+    def _vector_search_failed(self, error: Exception):
+        """
+        Decide how long auto mode skips $vectorSearch after it raised `error`.
+
+        A server without the stage (not Atlas) is skipped for the life of the handler,
+        other server errors (e.g. the index is missing or still building) for
+        VECTOR_SEARCH_RETRY_TTL seconds. Timeouts and network errors only send the
+        failing query to the local engines.
+        """
+        if isinstance(error, OperationFailure) and (error.code == _UNRECOGNIZED_STAGE_CODE or "Unrecognized pipeline stage" in str(error)):
+            self._vector_search_retry_at = float("inf")
+            logger.warning(f"$vectorSearch is not supported by this deployment, using local search: {str(error)}")
+        elif isinstance(error, OperationFailure) and not isinstance(error, ExecutionTimeout):
+            self._vector_search_retry_at = time.monotonic() + VECTOR_SEARCH_RETRY_TTL
+            logger.warning(f"$vectorSearch unavailable, using local search for {VECTOR_SEARCH_RETRY_TTL:.0f}s: {str(error)}")
+        else:
+            logger.warning(f"$vectorSearch failed, using local search for this query: {str(error)}")
+
+    def _retrieve_local_in_sections(self, manufacturer: Union[str, List[str]], query_vector: List[float], limit: int,
+                                    sections: Optional[List[str]]):
+        if not sections:
+            return self.retrieve_similar_documents_local(manufacturer, query_vector, limit)
+        docs = self.retrieve_similar_documents_local(manufacturer, query_vector, limit * HYBRID_CANDIDATES_PER_RESULT)
+        return [doc for doc in docs if doc.get("metadata", {}).get("section") in sections][:limit]
+
+    def list_sections(self) -> List[str]:
+        """Names of the sections with stored chunks, from the context snapshot when there is one."""
+        snapshot = self.context_snapshot()
+        if snapshot is not None:
+            return sorted(snapshot.section_counts)
+        try:
+            return sorted(section for section in self.products.distinct("section") if section)
+        except Exception as e:
+            logger.error(f"Error listing sections: {str(e)}")
+            return []
+
+    def _check_sections(self, sections: Optional[List[str]]):
+        """Raise ValueError if a section filter names a section no chunk belongs to, rather than match nothing."""
+        if not sections:
+            return
+        known = set(self.list_sections())
+        unknown = [section for section in sections if section not in known]
+        if unknown:
+            raise ValueError(f"Unknown sections: {', '.join(unknown)}. Available: {', '.join(sorted(known))}")
+
+    def list_manufacturers(self) -> List[str]:
+        """Names of the manufacturers with stored chunks."""
+        try:
+            return sorted(self.products.distinct("manufacturer"))
+        except Exception as e:
+            logger.error(f"Error listing manufacturers: {str(e)}")
             return []
 
+    def hybrid_search(self, query: str, manufacturers: Optional[List[str]] = None, sections: Optional[List[str]] = None,
+                      k: int = 5, candidates: Optional[int] = None, query_vector: Optional[List[float]] = None,
+                      rrf_k: int = RRF_K) -> HybridSearchResult:
+        """
+        Search with BM25 and vector similarity at once and fuse the rankings with reciprocal rank fusion.
+
+        BM25 catches exact model codes ("FTXM35R") that embeddings blur; vectors catch
+        intent ("quiet unit for a bedroom") with no shared words. The two stages run
+        concurrently, each returning `candidates` results under the same manufacturer
+        and section filters. Chunks found only by BM25 are then fetched in one query.
+
+        Args:
+            query (str): The user's question.
+            manufacturers (Optional[List[str]]): Restrict to these manufacturers. Default is all.
+            sections (Optional[List[str]]): Restrict to these sections (see list_sections).
+            k (int): Number of fused results.
+            candidates (Optional[int]): Results taken from each stage. Default is k * HYBRID_CANDIDATES_PER_RESULT.
+            query_vector (Optional[List[float]]): The query embedding, if already computed.
+            rrf_k (int): The RRF constant; larger values flatten the rank weights.
+
+        Returns:
+            HybridSearchResult: Documents with "score" (fused), "lexical_rank" and "vector_rank"
+                                (None when a stage missed it), plus timings for the snapshot check,
+                                lexical, embed, vector, fusion and fetch stages and the total, in ms,
+                                and the query embedding for reuse (e.g. by the answer cache).
+                                Raises ValueError if `sections` names a section no chunk belongs to.
+        """
+        start = time.perf_counter()
+        candidates = candidates or k * HYBRID_CANDIDATES_PER_RESULT
+        timings: Dict[str, float] = {}
+        # Chunk content and the BM25 index come from the snapshot, rebuilt only after an ingest
+        snapshot = self.context_snapshot()
+        timings["snapshot_ms"] = (time.perf_counter() - start) * 1000
+        self._check_sections(sections)
+        manufacturers = manufacturers or (sorted(snapshot.counts) if snapshot is not None else self.list_manufacturers())
+
+        def lexical_stage():
+            stage_start = time.perf_counter()
+            include = {"manufacturer": manufacturers}
+            if sections:
+                include["section"] = sections
+            ranked = self._lexical().search(query, candidates, include=include)
+            timings["lexical_ms"] = (time.perf_counter() - stage_start) * 1000
+            return [doc_id for doc_id, _ in ranked]
+
+        def vector_stage():
+            stage_start = time.perf_counter()
+            vector = query_vector
+            if vector is None:
+                # Imported here so handlers that never run hybrid search don't load the embedding backend
+                from vectorization import embed_query
+                vector = embed_query(query)
+            timings["embed_ms"] = (time.perf_counter() - stage_start) * 1000
+            stage_start = time.perf_counter()
+            docs = self.retrieve_similar_documents(manufacturers, vector, candidates, sections=sections)
+            timings["vector_ms"] = (time.perf_counter() - stage_start) * 1000
+            return vector, docs
+
+        lexical_future = self._search_pool.submit(lexical_stage)
+        vector_future = self._search_pool.submit(vector_stage)
+        try:
+            lexical_ids = lexical_future.result()
+        except Exception as e:
+            logger.error(f"Lexical search failed: {str(e)}")
+            lexical_ids = []
+        try:
+            vector, vector_docs = vector_future.result()
+        except Exception as e:
+            logger.error(f"Vector search failed: {str(e)}")
+            vector, vector_docs = None, []
+
+        stage_start = time.perf_counter()
+        vector_ids = [str(doc["_id"]) for doc in vector_docs]
+        fused = reciprocal_rank_fusion([lexical_ids, vector_ids], rrf_k)[:k]
+        lexical_rank = {doc_id: rank for rank, doc_id in enumerate(lexical_ids, start=1)}
+        vector_rank = {doc_id: rank for rank, doc_id in enumerate(vector_ids, start=1)}
+        timings["fusion_ms"] = (time.perf_counter() - stage_start) * 1000
+
+        stage_start = time.perf_counter()
+        found = {str(doc["_id"]): doc for doc in vector_docs}
+        missing = [doc_id for doc_id, _ in fused if doc_id not in found]
+        if missing:
+            found.update(self._fetch_documents(missing))
+        timings["fetch_ms"] = (time.perf_counter() - stage_start) * 1000
+
+        documents = []
+        for doc_id, score in fused:
+            doc = found.get(doc_id)
+            if doc is not None:
+                documents.append({**doc, "score": score, "lexical_rank": lexical_rank.get(doc_id),
+                                  "vector_rank": vector_rank.get(doc_id)})
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        logger.info("Hybrid search: " + ", ".join(f"{name} {value:.1f}ms" for name, value in timings.items()))
+        return HybridSearchResult(documents=documents, timings=timings, query_vector=vector)
+
     def update_document(self, manufacturer: str, document_id: str, update_data: Dict[str, Any]):
         """Update a specific document."""
-        collection = self.db[f"{manufacturer}_products"]
         try:
-            result = collection.update_one({"_id": ObjectId(document_id)}, {"$set": update_data})
+            result = self.products.update_one({"_id": _to_id(document_id), "manufacturer": manufacturer}, {"$set": update_data})
             if result.modified_count > 0:
                 logger.info(f"Updated document {document_id} for {manufacturer}")
+                self.bump_data_version()
             else:
                 logger.warning(f"No document found with id {document_id} for {manufacturer}")
         except Exception as e:
@@ -114,68 +823,281 @@ class MongoDBHandler:
 
     def delete_document(self, manufacturer: str, document_id: str):
         """Delete a specific document."""
-        collection = self.db[f"{manufacturer}_products"]
         try:
-            result = collection.delete_one({"_id": ObjectId(document_id)})
+            result = self.products.delete_one({"_id": _to_id(document_id), "manufacturer": manufacturer})
             if result.deleted_count > 0:
                 logger.info(f"Deleted document {document_id} for {manufacturer}")
+                self.bump_data_version()
             else:
                 logger.warning(f"No document found with id {document_id} for {manufacturer}")
         except Exception as e:
             logger.error(f"Error deleting document {document_id} for {manufacturer}: {str(e)}")
 
+    def delete_chunks(self, manufacturer: str, chunk_ids: List[str], batch_size: int = 1000) -> int:
+        """
+        Delete chunks by their deterministic chunk ID.
+
+        Chunks stored before the chunk ID became the _id keep an ObjectId _id and have
+        the chunk ID in metadata.chunk_id. They are found through the (manufacturer, _id)
+        index, restricted to ObjectIds, and deleted as well. As with store_vectorized_data,
+        the caller bumps the data version once the run is done.
+        """
+        deleted = 0
+        removed = list(chunk_ids)
+        try:
+            for i in range(0, len(chunk_ids), batch_size):
+                batch = chunk_ids[i:i+batch_size]
+                result = self.products.delete_many({"_id": {"$in": batch}})
+                deleted += result.deleted_count
+                legacy_ids = [doc["_id"] for doc in self.products.find(
+                    {"manufacturer": manufacturer, "_id": {"$type": "objectId"}, "metadata.chunk_id": {"$in": batch}}, {"_id": 1})]
+                if legacy_ids:
+                    result = self.products.delete_many({"_id": {"$in": legacy_ids}})
+                    deleted += result.deleted_count
+                    removed.extend(str(doc_id) for doc_id in legacy_ids)
+            logger.info(f"Deleted {deleted} chunks for {manufacturer}")
+            self._ann_index(manufacturer).remove(removed)
+            self._invalidate_exact(manufacturer)
+            if self._lexical_index is not None or lexical_index.index_path(LEXICAL_INDEX_NAME).exists():
+                self._lexical().remove(removed)
+            if self.answer_cache is not None:
+                self.answer_cache.invalidate_chunks(removed)
+        except Exception as e:
+            logger.error(f"Error deleting chunks for {manufacturer}: {str(e)}")
+        return deleted
+
+    @staticmethod
+    def _projection(fields: Optional[Sequence[str]], include_vectors: bool) -> Optional[Dict[str, int]]:
+        """Build a find() projection: the listed fields (all if None), with the vector only if asked for."""
+        if fields is None:
+            return None if include_vectors else {"vector": 0}
+        projection = {field: 1 for field in fields if field != "vector"}
+        if include_vectors:
+            projection["vector"] = 1
+        # An empty inclusion projection would return whole documents
+        return projection or {"_id": 1}
+
+    def iter_documents(self, manufacturer: str, fields: Optional[Sequence[str]] = ("content", "metadata"),
+                       include_vectors: bool = False, query: Optional[Dict[str, Any]] = None,
+                       after_id: Any = None, limit: Optional[int] = None,
+                       batch_size: int = MONGODB_CURSOR_BATCH_SIZE, page_size: int = MONGODB_PAGE_SIZE,
+                       decode: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a manufacturer's documents in _id order without materializing them.
+
+        Documents are read in pages of `page_size` with range queries (_id > last seen),
+        each walking the (manufacturer, _id) index, so no server cursor has to stay open
+        while the caller is slow, and a later call can resume from any _id.
+
+        Args:
+            manufacturer (str): The manufacturer whose documents to read.
+            fields (Optional[Sequence[str]]): Fields to return; None for all fields. Default is content and metadata.
+            include_vectors (bool): Whether to return the vector. Vectors are the bulk of each document.
+            query (Optional[Dict[str, Any]]): Extra filter, e.g. {"filename": "catalog.pdf"}.
+            after_id (Any): Resume after this _id, e.g. the last _id of a previous page.
+            limit (Optional[int]): Stop after this many documents.
+            batch_size (int): Documents per network round trip.
+            page_size (int): Documents per range query.
+            decode (bool): Decode packed vectors into NumPy arrays.
+
+        Yields:
+            Dict[str, Any]: The projected documents.
+        """
+        projection = self._projection(fields, include_vectors)
+        types = _ID_TYPES[_ID_TYPES.index("objectId"):] if isinstance(after_id, ObjectId) else _ID_TYPES
+        remaining = limit
+        for id_type in types:
+            last = after_id if after_id is not None and id_type == types[0] else None
+            while remaining is None or remaining > 0:
+                id_filter = {"$type": id_type}
+                if last is not None:
+                    id_filter["$gt"] = last
+                page_limit = page_size if remaining is None else min(page_size, remaining)
+                cursor = (self.products.find({**(query or {}), "manufacturer": manufacturer, "_id": id_filter}, projection)
+                          .sort("_id", ASCENDING).limit(page_limit).batch_size(batch_size))
+                count = 0
+                for doc in cursor:
+                    count += 1
+                    last = doc["_id"]
+                    yield self._decode_document(doc) if decode else doc
+                if remaining is not None:
+                    remaining -= count
+                if count < page_limit:
+                    break
+
+    def get_documents_page(self, manufacturer: str, after_id: Any = None, page_size: int = 50,
+                           fields: Optional[Sequence[str]] = ("content", "metadata")) -> Tuple[List[Dict[str, Any]], Any]:
+        """
+        Fetch one page of documents for browsing.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Any]: The documents, and the after_id for the next page (None on the last page).
+        """
+        try:
+            docs = list(self.iter_documents(manufacturer, fields=fields, after_id=after_id,
+                                            limit=page_size, page_size=page_size))
+        except Exception as e:
+            logger.error(f"Error retrieving documents for {manufacturer}: {str(e)}")
+            return [], None
+        return docs, docs[-1]["_id"] if len(docs) == page_size else None
+
     def get_all_documents(self, manufacturer: str, limit: int = 100):
-        """Retrieve all documents for a manufacturer, with a limit."""
-        collection = self.db[f"{manufacturer}_products"]
+        """Retrieve all documents for a manufacturer, with a limit. Prefer iter_documents, which can skip the vectors."""
         try:
-            documents = collection.find().limit(limit)
-            return list(documents)
+            return list(self.iter_documents(manufacturer, fields=None, include_vectors=True, limit=limit))
         except Exception as e:
             logger.error(f"Error retrieving documents for {manufacturer}: {str(e)}")
             return []
 
-def main():
-    mongo_handler = MongoDBHandler()
-    
-    try:
-        mongo_handler.connect()
+    def get_documents_by_manufacturer(self, manufacturers: List[str], limit: int = 10,
+                                      projection: Dict[str, Any] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Retrieve the first `limit` chunks of each manufacturer, in document order, with one query.
 
-        # Example usage (uncomment and modify as needed):
-        # from vectorization import process_and_vectorize_data
-        # from document_processing import process_manufacturer_data
-        # from data_ingestion import ingest_data
+        Served from the context snapshot's samples when one has been built and holds
+        enough chunks per manufacturer. Otherwise one aggregation chains a
+        $match/$sort/$limit pipeline per manufacturer with $unionWith; each reads only
+        its first `limit` entries of the (manufacturer, filename, chunk_index) index.
+        Servers without $unionWith (before MongoDB 4.4) fall back to the same indexed
+        query as one find per manufacturer.
 
-        # # Ingest and process data
-        # ingested_data = ingest_data()
-        # processed_data = process_manufacturer_data(ingested_data)
-        # vectorized_data = process_and_vectorize_data(processed_data)
+        Args:
+            manufacturers (List[str]): The manufacturers to fetch.
+            limit (int): Maximum number of chunks per manufacturer.
+            projection (Dict[str, Any]): Fields to return. Default is content and metadata.
 
-        # # Store data in MongoDB
-        # mongo_handler.store_vectorized_data(vectorized_data)
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: Manufacturer name to its chunks.
+        """
+        if projection is None and limit <= CONTEXT_SNAPSHOT_SAMPLE_SIZE and self._snapshot is not None:
+            snapshot = self.context_snapshot()
+            if snapshot is not None:
+                return {manufacturer: snapshot.samples.get(manufacturer, [])[:limit] for manufacturer in manufacturers}
+        projection = projection or {"content": 1, "metadata": 1}
+        sort = {"manufacturer": 1, "filename": 1, "chunk_index": 1}
+        results = {manufacturer: [] for manufacturer in manufacturers}
+        if not manufacturers:
+            return results
+        if self._union_available:
+            # manufacturer routes each document to its list; an exclusion projection keeps it anyway
+            added = "manufacturer" not in projection and any(value for field, value in projection.items() if field != "_id")
+            stage_projection = {**projection, "manufacturer": 1} if added else projection
 
-        # # Test retrieval
-        # sample_vector = vectorized_data['Daikin'][0]['vector']
-        # similar_docs = mongo_handler.retrieve_similar_documents('Daikin', sample_vector)
-        # print(f"Retrieved {len(similar_docs)} similar documents")
+            def first_chunks(manufacturer: str) -> List[Dict[str, Any]]:
+                return [{"$match": {"manufacturer": manufacturer}}, {"$sort": sort}, {"$limit": limit},
+                        {"$project": stage_projection}]
+            pipeline = first_chunks(manufacturers[0])
+            pipeline += [{"$unionWith": {"coll": PRODUCTS_COLLECTION, "pipeline": first_chunks(manufacturer)}}
+                         for manufacturer in manufacturers[1:]]
+            try:
+                for doc in self.products.aggregate(pipeline):
+                    manufacturer = doc.pop("manufacturer") if added else doc["manufacturer"]
+                    results[manufacturer].append(doc)
+                return results
+            except Exception as e:
+                logger.warning(f"$unionWith unavailable, fetching manufacturers one by one: {str(e)}")
+                self._union_available = False
+                results = {manufacturer: [] for manufacturer in manufacturers}
+        try:
+            for manufacturer in manufacturers:
+                results[manufacturer] = list(self.products.find({"manufacturer": manufacturer}, projection)
+                                             .sort(list(sort.items())).limit(limit))
+        except Exception as e:
+            logger.error(f"Error retrieving documents for {manufacturers}: {str(e)}")
+        return results
+
+    def migrate_legacy_collections(self, drop_legacy: bool = False, batch_size: int = None) -> Dict[str, int]:
+        """
+        Copy every legacy {manufacturer}_products collection into the products collection.
 
-        # # Test update
-        # if similar_docs:
-        #     doc_id = str(similar_docs[0]['_id'])
-        #     mongo_handler.update_document('Daikin', doc_id, {"updated_field": "new_value"})
+        Documents keep their _id and get the PROMOTED_FIELDS at the top level. Writes are
+        upserts, so an interrupted migration can simply be run again.
 
-        # # Test deletion
-        # if similar_docs:
-        #     doc_id = str(similar_docs[0]['_id'])
-        #     mongo_handler.delete_document('Daikin', doc_id)
+        Args:
+            drop_legacy (bool): Drop each legacy collection once all its documents are copied.
+            batch_size (int): Operations per bulk_write. Default is the handler's bulk batch size.
 
-        # # Test get all documents
-        # all_docs = mongo_handler.get_all_documents('Daikin', limit=10)
-        # print(f"Retrieved {len(all_docs)} documents for Daikin")
+        Returns:
+            Dict[str, int]: Manufacturer name to the number of documents migrated.
+        """
+        batch_size = batch_size or self.bulk_batch_size
+        counts = {}
+        dimensions = None
+        for name in sorted(self.db.list_collection_names()):
+            manufacturer = name[:-len(LEGACY_COLLECTION_SUFFIX)]
+            if not name.endswith(LEGACY_COLLECTION_SUFFIX) or not manufacturer or name == PRODUCTS_COLLECTION:
+                continue
+            legacy = self.db[name]
+            migrated = 0
+            try:
+                operations = []
+                for doc in legacy.find().batch_size(batch_size):
+                    if dimensions is None and doc.get("vector") is not None:
+                        dimensions = len(decode_vector(doc["vector"]))
+                    operations.append(ReplaceOne({"_id": doc["_id"]}, self._promote_fields(doc, manufacturer), upsert=True))
+                    if len(operations) >= batch_size:
+                        self.products.bulk_write(operations, ordered=False)
+                        migrated += len(operations)
+                        operations = []
+                if operations:
+                    self.products.bulk_write(operations, ordered=False)
+                    migrated += len(operations)
+                counts[manufacturer] = migrated
+                logger.info(f"Migrated {migrated} documents from {name} to {PRODUCTS_COLLECTION}")
+                if drop_legacy and migrated == legacy.count_documents({}):
+                    legacy.drop()
+                    logger.info(f"Dropped legacy collection {name}")
+            except Exception as e:
+                logger.error(f"Error migrating {name}: {str(e)}")
+            # Ids are unchanged, so the ANN index stays valid; the snapshot is rebuilt from the new collection
+            self._invalidate_exact(manufacturer)
+        self.ensure_indexes(dimensions)
+        if any(counts.values()):
+            self.bump_data_version()
+        return counts
 
+    def get_vectors(self, manufacturer: str, batch_size: int = 1000) -> Tuple[List[Any], np.ndarray]:
+        """
+        Load every vector for a manufacturer into one contiguous float32 matrix.
+
+        Returns:
+            Tuple[List[Any], np.ndarray]: The document IDs and the (n, dim) matrix, row-aligned.
+        """
+        ids, values = [], []
+        try:
+            for doc in self.iter_documents(manufacturer, fields=[], include_vectors=True, query={"vector": {"$exists": True}},
+                                           batch_size=batch_size, decode=False):
+                ids.append(doc["_id"])
+                values.append(doc["vector"])
+        except Exception as e:
+            logger.error(f"Error loading vectors for {manufacturer}: {str(e)}")
+        return ids, decode_vectors(values)
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the products collection.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help=f"Copy the per-manufacturer *{LEGACY_COLLECTION_SUFFIX} collections into '{PRODUCTS_COLLECTION}'")
+    migrate_parser.add_argument("--drop-legacy", action="store_true", help="Drop each legacy collection once fully copied")
+    migrate_parser.add_argument("--batch-size", type=int, default=MONGODB_BULK_BATCH_SIZE)
+    subparsers.add_parser("ensure-indexes", help=f"Create the indexes of '{PRODUCTS_COLLECTION}'")
+    args = parser.parse_args()
+
+    mongo_handler = MongoDBHandler()
+    try:
+        mongo_handler.connect()
+        if args.command == "migrate":
+            counts = mongo_handler.migrate_legacy_collections(drop_legacy=args.drop_legacy, batch_size=args.batch_size)
+            for manufacturer, count in counts.items():
+                print(f"{manufacturer}: {count} documents migrated")
+            if not counts:
+                print("No legacy collections found")
+        elif args.command == "ensure-indexes":
+            mongo_handler.ensure_indexes()
+            print(f"Indexes ensured on {PRODUCTS_COLLECTION}")
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
     finally:
         mongo_handler.close_connection()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
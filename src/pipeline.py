@@ -0,0 +1,190 @@
+# pipeline.py
+
+import os
+import queue
+import logging
+import threading
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+from langchain.docstore.document import Document
+
+from data_ingestion import extract_pages
+from document_processing import iter_split_pages
+from extraction_cache import file_hash
+from vectorization import backend, embed_documents
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Embed-and-store batches are filled across files up to one embedding request: at most
+# PIPELINE_BATCH_TOKENS estimated tokens and PIPELINE_BATCH_SIZE chunks, the backend's
+# per-request limits by default. PIPELINE_MAX_IN_FLIGHT batches may wait between the
+# splitter and the embedder, so peak memory is roughly
+# (PIPELINE_MAX_IN_FLIGHT + PIPELINE_WORKERS) batches plus one file's pages.
+PIPELINE_BATCH_TOKENS = int(os.getenv('PIPELINE_BATCH_TOKENS', 0)) or backend.max_batch_tokens
+PIPELINE_BATCH_SIZE = int(os.getenv('PIPELINE_BATCH_SIZE', 0)) or backend.max_batch_size
+PIPELINE_MAX_IN_FLIGHT = int(os.getenv('PIPELINE_MAX_IN_FLIGHT', 4))
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', 4))
+
+_DONE = object()
+
+class _FileProgress:
+    """Tracks how many of a file's chunks have been stored."""
+
+    def __init__(self, entry: Dict[str, Any]):
+        self.entry = entry
+        self.chunk_ids: List[str] = []
+        self.produced: Optional[int] = None  # Set once the splitter has finished the file
+        self.stored = 0
+        self.failed = False
+
+    @property
+    def complete(self) -> bool:
+        return self.produced is not None and self.stored == self.produced
+
+def iter_file_chunks(entry: Dict[str, Any]) -> Iterator[Document]:
+    """
+    Extract and split one file, yielding its chunks as they are ready.
+    """
+    path = entry["path"]
+    metadata = {
+        "source": path,
+        "filename": os.path.basename(path),
+        "manufacturer": entry["manufacturer"],
+        "file_hash": entry.get("file_hash") or file_hash(path)
+    }
+    yield from iter_split_pages(extract_pages(path, content_hash=metadata["file_hash"]), metadata)
+
+def run_pipeline(entries: List[Dict[str, Any]],
+                 mongo_handler,
+                 batch_size: int = PIPELINE_BATCH_SIZE,
+                 batch_tokens: int = PIPELINE_BATCH_TOKENS,
+                 max_in_flight: int = PIPELINE_MAX_IN_FLIGHT,
+                 workers: int = PIPELINE_WORKERS,
+                 on_file_done: Optional[Callable[[Dict[str, Any], List[str]], None]] = None) -> Dict[str, Any]:
+    """
+    Stream files through extract -> split -> embed -> store with bounded memory.
+
+    A producer thread extracts and splits one file at a time and packs the chunks
+    into batches by estimated tokens, carrying a partial batch over to the next
+    file, so small files and short spec-table chunks share requests. Batches go on a
+    bounded queue; when max_in_flight batches are waiting the producer blocks, so
+    extraction never runs ahead of embedding. Worker threads embed each batch and
+    write it to MongoDB immediately, then drop it.
+
+    The data version is not bumped per batch; the caller bumps it once the run is
+    done (MongoDBHandler.bump_data_version), so readers rebuild their state once.
+
+    Args:
+        entries (List[Dict[str, Any]]): Files to ingest, each with "path", "manufacturer"
+                                        and optionally "file_hash" (see IngestionPlan).
+        mongo_handler (MongoDBHandler): A connected handler to store batches with.
+        batch_size (int): Maximum chunks per embed-and-store batch.
+        batch_tokens (int): Maximum estimated tokens per embed-and-store batch.
+        max_in_flight (int): Maximum number of batches queued between splitter and embedder.
+        workers (int): Number of embed-and-store threads.
+        on_file_done (Optional[Callable]): Called with (entry, chunk_ids) once every chunk
+                                           of a file has been stored.
+
+    Returns:
+        Dict[str, Any]: Counts of files, chunks and batches, the files and chunk IDs that
+                        failed, and one sample vector per manufacturer.
+    """
+    batches: "queue.Queue" = queue.Queue(maxsize=max_in_flight)
+    lock = threading.Lock()
+    stats = {"files": 0, "chunks": 0, "batches": 0, "failed_files": [], "failed_chunks": [], "sample_vectors": {}}
+
+    def finish_if_complete(progress: _FileProgress):
+        # Called with the lock held
+        if progress.complete and not progress.failed:
+            stats["files"] += 1
+            if on_file_done:
+                on_file_done(progress.entry, progress.chunk_ids)
+
+    def produce():
+        batch: List[Tuple[_FileProgress, Document]] = []
+        tokens = 0
+        try:
+            for entry in entries:
+                progress = _FileProgress(entry)
+                produced = 0
+                extraction_failed = False
+                try:
+                    for chunk in iter_file_chunks(entry):
+                        chunk_tokens = backend.count_tokens(chunk.page_content)
+                        if batch and (tokens + chunk_tokens > batch_tokens or len(batch) >= batch_size):
+                            batches.put(batch)  # Blocks while max_in_flight batches wait
+                            batch, tokens = [], 0
+                        batch.append((progress, chunk))
+                        tokens += chunk_tokens
+                        produced += 1
+                except Exception as e:
+                    logger.error(f"Error extracting {entry['path']}: {str(e)}")
+                    extraction_failed = True
+                with lock:
+                    if extraction_failed and not progress.failed:
+                        progress.failed = True
+                        stats["failed_files"].append(entry["path"])
+                    progress.produced = produced
+                    finish_if_complete(progress)
+            if batch:
+                batches.put(batch)
+        finally:
+            for _ in range(workers):
+                batches.put(_DONE)
+
+    def consume():
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                return
+            # The batch may span files, and so manufacturers
+            files = list({id(progress): progress for progress, _ in item}.values())
+            stored = 0
+            vectorized_docs = []
+            failed_chunks = []
+            try:
+                result = embed_documents([chunk for _, chunk in item])
+                vectorized_docs, failed_chunks = result.vectorized, result.failed
+                by_manufacturer: Dict[str, List[Dict[str, Any]]] = {}
+                for doc in vectorized_docs:
+                    by_manufacturer.setdefault(doc["metadata"]["manufacturer"], []).append(doc)
+                if by_manufacturer:
+                    stored = mongo_handler.store_vectorized_data(by_manufacturer)
+            except Exception as e:
+                # Keep consuming so the producer never blocks on a dead worker
+                logger.error(f"Error embedding or storing a batch of {len(files)} files: {str(e)}")
+            failed_ids = {chunk.metadata["chunk_id"] for chunk in failed_chunks}
+            with lock:
+                stats["batches"] += 1
+                stats["chunks"] += stored
+                stats["failed_chunks"].extend(chunk.metadata["chunk_id"] for chunk in failed_chunks)
+                for doc in vectorized_docs:
+                    stats["sample_vectors"].setdefault(doc["metadata"]["manufacturer"], doc["vector"])
+                stored_ids = {doc["metadata"]["chunk_id"] for doc in vectorized_docs} if stored == len(vectorized_docs) else set()
+                for progress, chunk in item:
+                    chunk_id = chunk.metadata["chunk_id"]
+                    if chunk_id in stored_ids:
+                        progress.chunk_ids.append(chunk_id)
+                    elif not progress.failed:
+                        # A store shortfall can't be attributed to a file, so every file of the batch is retried
+                        reason = "could not be embedded" if chunk_id in failed_ids else "was not stored"
+                        logger.error(f"A chunk of {progress.entry['path']} {reason}; it will be retried on the next run")
+                        progress.failed = True
+                        stats["failed_files"].append(progress.entry["path"])
+                    progress.stored += 1
+                for progress in files:
+                    finish_if_complete(progress)
+
+    logger.info(f"Streaming {len(entries)} files (batches of up to {batch_size} chunks and {batch_tokens} tokens, "
+                f"max in flight: {max_in_flight}, workers: {workers})")
+    threads = [threading.Thread(target=produce, name="pipeline-producer", daemon=True)]
+    threads += [threading.Thread(target=consume, name=f"pipeline-worker-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    logger.info(f"Pipeline finished: {stats['files']} files, {stats['chunks']} chunks in {stats['batches']} batches, "
+                f"{len(stats['failed_files'])} failed files, {len(stats['failed_chunks'])} failed chunks")
+    return stats
@@ -0,0 +1,248 @@
+# prompt_cache.py
+
+import os
+import json
+import hashlib
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from context_packer import count_tokens
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Mark system prompts for Anthropic prompt caching; set to 0 to send plain strings
+PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', '1') != '0'
+# Shortest prefix the stub caches, like the API's minimum for Opus and Sonnet
+STUB_MIN_CACHEABLE_TOKENS = int(os.getenv('STUB_MIN_CACHEABLE_TOKENS', 1024))
+
+def text_block(text: str, cache: bool = False) -> Dict[str, Any]:
+    """A text content block, marked as a prompt cache breakpoint if cache is set."""
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+def build_system(*parts: str, volatile: str = "", cache: bool = PROMPT_CACHE_ENABLED) -> Any:
+    """
+    Build a system prompt from its stable parts, cached as a prefix, followed by a volatile part.
+
+    The breakpoint goes on the last stable part, so the prompt cache covers the
+    instructions and any fixed catalog context, and every later request that starts
+    with the same parts reads them from the cache. Content that changes per question
+    (the chunks retrieved for it) goes in `volatile`, after the breakpoint, so it
+    doesn't turn each request into a cache write. History and the question belong
+    in the messages.
+
+    Args:
+        parts (str): The stable parts, most stable first.
+        volatile (str): Per-question context, sent uncached after them.
+        cache (bool): Whether to mark the breakpoint; when not, the parts are joined into one string.
+
+    Returns:
+        Any: A list of text blocks, or the joined string when caching is disabled.
+    """
+    parts = [part for part in parts if part]
+    if not cache:
+        return "\n\n".join(parts + ([volatile] if volatile else []))
+    blocks = [text_block(part, cache=i == len(parts) - 1) for i, part in enumerate(parts)]
+    if volatile:
+        blocks.append(text_block(volatile))
+    return blocks
+
+def describe_usage(usage: Dict[str, int]) -> str:
+    """One-line summary of a response's token usage, including prompt cache reads and writes."""
+    return (f"input {usage.get('input_tokens', 0)}, cache read {usage.get('cache_read_input_tokens') or 0}, "
+            f"cache write {usage.get('cache_creation_input_tokens') or 0}, output {usage.get('output_tokens', 0)}")
+
+@dataclass
+class PromptCacheStats:
+    """Token usage summed over the calls of a session."""
+    calls: int = 0
+    input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    output_tokens: int = 0
+
+    def record(self, usage: Dict[str, int]):
+        self.calls += 1
+        self.input_tokens += usage.get("input_tokens") or 0
+        self.cache_read_input_tokens += usage.get("cache_read_input_tokens") or 0
+        self.cache_creation_input_tokens += usage.get("cache_creation_input_tokens") or 0
+        self.output_tokens += usage.get("output_tokens") or 0
+
+    @property
+    def read_ratio(self) -> float:
+        """Share of prompt tokens served from the cache."""
+        prompt = self.input_tokens + self.cache_read_input_tokens + self.cache_creation_input_tokens
+        return self.cache_read_input_tokens / prompt if prompt else 0.0
+
+class StubMessagesServer:
+    """
+    A local stand-in for the Messages endpoint that imitates prompt caching.
+
+    Point an Anthropic client at `url` (base_url) to check prompt layouts without
+    spending tokens. The prefix up to each cache_control breakpoint (system blocks,
+    then message content) is hashed. A prefix seen before is reported as
+    cache_read_input_tokens, a new one of at least min_cacheable_tokens as
+    cache_creation_input_tokens, and the rest as input_tokens. Tokens are estimated
+    with context_packer.count_tokens. Answers are streamed or returned whole, and
+    echo the question.
+    """
+
+    def __init__(self, port: int = 0, min_cacheable_tokens: int = STUB_MIN_CACHEABLE_TOKENS):
+        self.min_cacheable_tokens = min_cacheable_tokens
+        self._cache: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.requests: List[Dict[str, Any]] = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def serve(self):
+        """Serve in the calling thread until interrupted."""
+        self._server.serve_forever()
+
+    def start(self) -> "StubMessagesServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @staticmethod
+    def _blocks(request: Dict[str, Any]) -> List[Tuple[Dict[str, Any], str]]:
+        """Every content block of the prompt in cache order, with the text it contributes."""
+        blocks = []
+        system = request.get("system") or []
+        for block in ([text_block(system)] if isinstance(system, str) else system):
+            blocks.append((block, block.get("text", "")))
+        for message in request.get("messages", []):
+            content = message["content"]
+            for block in ([text_block(content)] if isinstance(content, str) else content):
+                blocks.append((block, f"{message['role']}: {block.get('text', '')}"))
+        return blocks
+
+    def usage(self, request: Dict[str, Any]) -> Dict[str, int]:
+        """The usage the API would report for the request's prompt, updating the stub's cache."""
+        digest = hashlib.sha256(request.get("model", "").encode('utf-8'))
+        tokens = 0
+        read = written = 0
+        with self._lock:
+            for block, text in self._blocks(request):
+                digest.update(text.encode('utf-8'))
+                tokens += count_tokens(text)
+                if not block.get("cache_control"):
+                    continue
+                key = digest.hexdigest()
+                if key in self._cache:
+                    read, written = tokens, 0
+                elif tokens >= self.min_cacheable_tokens:
+                    self._cache[key] = tokens
+                    written = tokens - read
+        return {"input_tokens": tokens - read - written, "cache_read_input_tokens": read,
+                "cache_creation_input_tokens": written}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.startswith("/v1/messages"):
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                stub.requests.append(request)
+                usage = stub.usage(request)
+                last = request["messages"][-1]["content"]
+                question = last if isinstance(last, str) else last[-1].get("text", "")
+                words = f"Stub answer to: {question}".split(" ")
+                usage["output_tokens"] = len(words)
+                message = {"id": "msg_stub", "type": "message", "role": "assistant", "model": request.get("model"),
+                           "content": [], "stop_reason": None, "stop_sequence": None, "usage": {**usage, "output_tokens": 0}}
+                if not request.get("stream"):
+                    body = json.dumps({**message, "content": [text_block(" ".join(words))], "stop_reason": "end_turn",
+                                       "usage": usage}).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                events = [("message_start", {"type": "message_start", "message": message}),
+                          ("content_block_start", {"type": "content_block_start", "index": 0,
+                                                   "content_block": {"type": "text", "text": ""}})]
+                events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                    "delta": {"type": "text_delta", "text": word if i == 0 else " " + word}})
+                           for i, word in enumerate(words)]
+                events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                           ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                              "usage": usage}),
+                           ("message_stop", {"type": "message_stop"})]
+                for event, data in events:
+                    self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Check prompt caching against a local stub of the Messages endpoint.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Run the stub; point ANTHROPIC_BASE_URL at it")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    subparsers.add_parser("check", help="Send a multi-turn conversation through the stub and print the usage of each call")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        stub = StubMessagesServer(args.port)
+        print(f"Stub Messages endpoint on {stub.url}")
+        stub.serve()
+        return
+
+    import anthropic
+    from llm_streaming import stream_answer
+    catalog = "\n".join(f"Model PUZ-ZM{i}: cooling {i / 10:.1f} kW, piping up to {30 + i} m." for i in range(200))
+    stats = PromptCacheStats()
+    with StubMessagesServer() as stub:
+        client = anthropic.Anthropic(api_key="stub", base_url=stub.url)
+        history = ""
+        for question in ["Max piping for PUZ-ZM100?", "And its cooling capacity?", "Compare it with PUZ-ZM120."]:
+            # The retrieved chunks differ per question and follow the cached catalog
+            retrieved = f"Relevant details:\n{question} see the PUZ-ZM section of the catalog."
+            system = build_system("You answer questions about HVAC product documents.", f"Catalog:\n{catalog}",
+                                  volatile=retrieved)
+            content = f"Chat history:\n{history}\n\nQuestion: {question}" if history else question
+            result = stream_answer(client, "claude-3-opus-20240229", system, [{"role": "user", "content": content}])
+            stats.record(result.usage)
+            print(f"{question:32} {describe_usage(result.usage)}")
+            history += f"User: {question}\nAssistant: {result.text}\n"
+    print(f"{stats.calls} calls, {stats.read_ratio:.0%} of prompt tokens read from the cache")
+
+if __name__ == "__main__":
+    main()
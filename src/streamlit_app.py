@@ -3,6 +3,10 @@
 import streamlit as st
 import anthropic
 from mongodb_integration import MongoDBHandler
+from context_packer import pack_context
+from answer_cache import get_default_cache as get_answer_cache
+from llm_streaming import CancelToken, stream_answer
+from prompt_cache import PromptCacheStats, build_system, describe_usage
 from dotenv import load_dotenv
 import os
 import pandas as pd
@@ -10,12 +14,30 @@ import pandas as pd
 # Load environment variables
 load_dotenv()
 
-# Initialize Anthropic client
-client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
-# Initialize MongoDB handler
-mongo_handler = MongoDBHandler()
-mongo_handler.connect()
+# Candidate chunks retrieved by hybrid search for each question, and the tokens of them sent to Claude
+CONTEXT_CHUNKS = int(os.getenv('CONTEXT_CHUNKS', 20))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 6000))
+# First chunks of each manufacturer sent as a fixed catalog overview. They change only
+# after an ingest, so together with the instructions they form the cached prompt prefix.
+CATALOG_CONTEXT_CHUNKS = int(os.getenv('CATALOG_CONTEXT_CHUNKS', 3))
+CHAT_MODEL = "claude-3-opus-20240229"
+
+# Clients are created once per process and reused by every rerun and session.
+# The handler shares the pooled MongoDB client and holds the context snapshot (chunks,
+# samples and BM25 index) that every session reads; it is rebuilt only after an ingest.
+@st.cache_resource
+def get_anthropic_client():
+    return anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+
+@st.cache_resource
+def get_mongo_handler():
+    handler = MongoDBHandler()
+    handler.connect()
+    handler.context_snapshot()
+    return handler
+
+client = get_anthropic_client()
+mongo_handler = get_mongo_handler()
 
 st.title("Product Comparison Chatbot")
 
@@ -25,22 +47,28 @@ debug_mode = st.sidebar.checkbox("Debug Mode")
 # Initialize chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# A new question cancels the answer still streaming for the previous one
+if "cancel_token" not in st.session_state:
+    st.session_state.cancel_token = CancelToken()
+
+if "prompt_cache_stats" not in st.session_state:
+    st.session_state.prompt_cache_stats = PromptCacheStats()
 
 # Display chat messages from history on app rerun
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
-# Function to query MongoDB and format results
-def query_mongodb(manufacturer, limit=10):
-    docs = mongo_handler.get_all_documents(manufacturer, limit)
-    return [{"content": doc["content"], "metadata": doc["metadata"]} for doc in docs]
+# Function to query MongoDB and format results: one query for all manufacturers
+def query_mongodb(manufacturers, limit=10):
+    docs_by_manufacturer = mongo_handler.get_documents_by_manufacturer(manufacturers, limit)
+    return {manufacturer: [{"content": doc["content"], "metadata": doc["metadata"]} for doc in docs]
+            for manufacturer, docs in docs_by_manufacturer.items()}
 
 # Function to generate product comparison table
 def generate_comparison_table(manufacturers):
     data = []
-    for manufacturer in manufacturers:
-        docs = query_mongodb(manufacturer, limit=5)
+    for manufacturer, docs in query_mongodb(manufacturers, limit=5).items():
         for doc in docs:
             data.append({
                 "Manufacturer": manufacturer,
@@ -52,8 +80,7 @@ def generate_comparison_table(manufacturers):
 # Function to print sample data
 def print_sample_data():
     manufacturers = ["Daikin", "Melco"]  # Add all your manufacturers here
-    for manufacturer in manufacturers:
-        docs = query_mongodb(manufacturer, limit=5)
+    for manufacturer, docs in query_mongodb(manufacturers, limit=5).items():
         st.write(f"Sample data for {manufacturer}:")
         for doc in docs:
             st.write(f"Filename: {doc['metadata'].get('filename', 'Unknown')}")
@@ -74,36 +101,73 @@ if prompt := st.chat_input("What would you like to know about our products?"):
 
     # Get chatbot response
     manufacturers = ["Daikin", "Melco"]  # Add all your manufacturers here
-    context = f"You are a helpful assistant with knowledge about HVAC products from {', '.join(manufacturers)}. "
-    context += "You have access to a MongoDB database with product information. "
-    context += "Here's a sample of the data for each manufacturer:\n\n"
-    
-    for manufacturer in manufacturers:
-        docs = query_mongodb(manufacturer, limit=10)
-        context += f"{manufacturer} products:\n"
-        for doc in docs:
-            context += f"- Product: {doc['metadata'].get('filename', 'Unknown')}\n"
-            context += f"  Details: {doc['content'][:500]}...\n\n"
+    # Stable to volatile: the instructions and the catalog overview are the same for every
+    # question and are cached; the products retrieved for this question follow them uncached
+    instructions = f"You are a helpful assistant with knowledge about HVAC products from {', '.join(manufacturers)}. "
+    instructions += "You have access to a MongoDB database with product information. "
+    instructions += "When answering questions, use the product information below. If you need more details or a comparison, say 'GENERATE_TABLE'."
     
-    context += "\nWhen answering questions, use this product information. If you need more details or a comparison, say 'GENERATE_TABLE'."
+    # Model codes are matched lexically and intent by vector similarity; the best distinct
+    # candidates that fit the token budget are sent, neighbouring chunks of a file joined
+    search = mongo_handler.hybrid_search(prompt, manufacturers=manufacturers, k=CONTEXT_CHUNKS)
+    packed = pack_context([{
+        "_id": doc["_id"],
+        "content": doc["content"],
+        "score": doc["score"],
+        "source": f"{doc['metadata'].get('manufacturer', 'Unknown')} product: {doc['metadata'].get('filename', 'Unknown')}",
+        "position": doc["metadata"].get("chunk_index")
+    } for doc in search.documents], CONTEXT_TOKEN_BUDGET, header=lambda source, first, last: f"- {source}", order="source")
+    context = "Here are the product details most relevant to the question:\n\n" + packed.text
+    catalog_docs = [doc for docs in mongo_handler.get_documents_by_manufacturer(manufacturers, CATALOG_CONTEXT_CHUNKS).values()
+                    for doc in docs]
+    catalog = "Catalog overview:\n\n" + "\n\n".join(
+        f"- {doc['metadata'].get('manufacturer', 'Unknown')} product: {doc['metadata'].get('filename', 'Unknown')}\n{doc['content']}"
+        for doc in catalog_docs) if catalog_docs else ""
+    system = build_system(instructions, catalog, volatile=context)
 
     if debug_mode:
+        snapshot = mongo_handler.context_snapshot()
+        if snapshot is not None:
+            st.sidebar.write(f"Context snapshot: data version {snapshot.version}, {sum(snapshot.counts.values())} chunks, "
+                             f"built {snapshot.age():.0f}s ago in {snapshot.build_ms:.0f}ms")
+        st.sidebar.write("Retrieval latency (ms):")
+        st.sidebar.json({stage: round(ms, 1) for stage, ms in search.timings.items()})
+        st.sidebar.write(f"Context: {len(packed.chunks)} of {len(search.documents)} chunks, "
+                         f"{packed.tokens_used}/{packed.budget} tokens ({packed.skipped_duplicates} near-duplicates skipped)")
         st.sidebar.write("Context sent to Claude:")
-        st.sidebar.text(context)
-
-    response = client.messages.create(
-        model="claude-3-opus-20240229",
-        max_tokens=1000,
-        system=context,
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    # Display assistant response in chat message container
+        st.sidebar.text("\n\n".join(part for part in (instructions, catalog, context) if part))
+
+    # The same question over the same chunks gets the same answer, without calling the model
+    answer_cache = get_answer_cache()
+    chunk_ids = [doc["_id"] for doc in packed.chunks] + [doc["_id"] for doc in catalog_docs]
+    cached = answer_cache.get(prompt, CHAT_MODEL, chunk_ids, query_vector=search.query_vector) if answer_cache else None
+    should_cancel = st.session_state.cancel_token.start()
+
+    # Display assistant response in chat message container, token by token as it streams
     with st.chat_message("assistant"):
-        response_text = response.content[0].text
-        st.markdown(response_text)
+        placeholder = st.empty()
+        complete = True
+        if cached:
+            response_text = cached.answer
+            placeholder.markdown(response_text)
+            if debug_mode:
+                st.sidebar.write(f"Answer cache hit ({cached.match}, similarity {cached.similarity:.3f}, {cached.age_s / 60:.0f} min old)")
+        else:
+            result = stream_answer(client, CHAT_MODEL, system, [{"role": "user", "content": prompt}], max_tokens=1000,
+                                   on_text=lambda text: placeholder.markdown(text + "▌"), should_cancel=should_cancel)
+            response_text = result.text
+            placeholder.markdown(response_text)
+            complete = result.complete
+            if result.usage:
+                st.session_state.prompt_cache_stats.record(result.usage)
+            if debug_mode and result.ttft_ms is not None:
+                st.sidebar.write(f"Time to first token: {result.ttft_ms:.0f}ms, full answer: {result.total_ms:.0f}ms")
+            if debug_mode and result.usage:
+                stats = st.session_state.prompt_cache_stats
+                st.sidebar.write(f"Tokens: {describe_usage(result.usage)}; "
+                                 f"{stats.read_ratio:.0%} of prompt tokens read from the cache over {stats.calls} calls")
+            if complete and answer_cache:
+                answer_cache.put(prompt, CHAT_MODEL, chunk_ids, response_text, query_vector=search.query_vector)
         
         # Check if the response includes the trigger to generate a table
         if "GENERATE_TABLE" in response_text:
@@ -111,8 +175,6 @@ if prompt := st.chat_input("What would you like to know about our products?"):
             comparison_table = generate_comparison_table(manufacturers)
             st.dataframe(comparison_table)
 
-    # Add assistant response to chat history
-    st.session_state.messages.append({"role": "assistant", "content": response_text})
-
-# Close MongoDB connection when the app is closed
-mongo_handler.close_connection()
\ No newline at end of file
+    # Add assistant response to chat history; a cancelled, partial answer is not kept
+    if complete:
+        st.session_state.messages.append({"role": "assistant", "content": response_text})
\ No newline at end of file
@@ -0,0 +1,79 @@
+# vector_codec.py
+
+import os
+from typing import List, Sequence, Union
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# How vectors are written to MongoDB: float32 (default), float16, int8, or list (legacy BSON array of doubles)
+VECTOR_ENCODING = os.getenv('VECTOR_ENCODING', 'float32')
+
+# BSON binary subtype 9 is the "vector" subtype that Atlas Vector Search indexes.
+# Its payload is a dtype byte, a padding byte, then the packed values.
+VECTOR_SUBTYPE = 9
+FLOAT32_DTYPE = 0x27
+INT8_DTYPE = 0x03
+# float16 has no subtype-9 dtype, so it uses a user-defined subtype with the same layout.
+# Atlas cannot index it; it is for client-side search only.
+FLOAT16_SUBTYPE = 0x80
+FLOAT16_DTYPE = 0x10
+
+ENCODINGS = ("float32", "float16", "int8", "list")
+
+def encode_vector(vector: Union[Sequence[float], np.ndarray], encoding: str = VECTOR_ENCODING) -> Union[Binary, List[float]]:
+    """
+    Pack a vector for storage.
+
+    int8 scales the vector so its largest component is +/-127. The scale is not
+    stored: cosine similarity and ranking by normalized dot product only depend on
+    direction, so decoded int8 vectors are only meaningful after normalization.
+
+    Args:
+        vector (Union[Sequence[float], np.ndarray]): The embedding.
+        encoding (str): One of ENCODINGS.
+
+    Returns:
+        Union[Binary, List[float]]: A BSON Binary, or a plain list for the "list" encoding.
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    if encoding == "float32":
+        return Binary(bytes([FLOAT32_DTYPE, 0]) + array.astype('<f4').tobytes(), VECTOR_SUBTYPE)
+    if encoding == "float16":
+        return Binary(bytes([FLOAT16_DTYPE, 0]) + array.astype('<f2').tobytes(), FLOAT16_SUBTYPE)
+    if encoding == "int8":
+        peak = float(np.max(np.abs(array))) or 1.0
+        quantized = np.clip(np.rint(array * (127.0 / peak)), -127, 127).astype(np.int8)
+        return Binary(bytes([INT8_DTYPE, 0]) + quantized.tobytes(), VECTOR_SUBTYPE)
+    if encoding == "list":
+        return array.tolist()
+    raise ValueError(f"Unknown vector encoding '{encoding}'. Available: {', '.join(ENCODINGS)}")
+
+def decode_vector(value: Union[bytes, Binary, Sequence[float]]) -> np.ndarray:
+    """
+    Decode a stored vector (any encoding, including legacy arrays) into a float32 NumPy array.
+    """
+    if not isinstance(value, (bytes, Binary)):
+        return np.asarray(value, dtype=np.float32)
+    dtype, payload = value[0], memoryview(value)[2:]
+    if dtype == FLOAT32_DTYPE:
+        return np.frombuffer(payload, dtype='<f4').astype(np.float32)
+    if dtype == FLOAT16_DTYPE:
+        return np.frombuffer(payload, dtype='<f2').astype(np.float32)
+    if dtype == INT8_DTYPE:
+        return np.frombuffer(payload, dtype=np.int8).astype(np.float32)
+    raise ValueError(f"Unsupported vector dtype byte 0x{dtype:02x}")
+
+def decode_vectors(values: Sequence[Union[bytes, Binary, Sequence[float]]]) -> np.ndarray:
+    """
+    Decode many stored vectors into one contiguous (n, dim) float32 matrix.
+    """
+    if not values:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.empty((len(values), len(decode_vector(values[0]))), dtype=np.float32)
+    for i, value in enumerate(values):
+        matrix[i] = decode_vector(value)
+    return matrix
@@ -0,0 +1,217 @@
+# vector_search.py
+
+import os
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from typing import List, Any, Optional, Sequence, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+from cache_paths import CACHE_DIR
+from ann_index import normalize_rows, top_k
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Snapshots of each manufacturer's embedding matrix, memory-mapped by the exact search engine
+VECTOR_SNAPSHOT_DIR = Path(os.getenv('VECTOR_SNAPSHOT_DIR', CACHE_DIR / 'vectors'))
+# Queries per matrix product in search_batch; bounds the (queries, n) score matrix
+EXACT_SEARCH_QUERY_BLOCK = int(os.getenv('EXACT_SEARCH_QUERY_BLOCK', 64))
+
+METRICS = ("cosine", "dot")
+
+# Snapshot file layout: magic, header length (uint64 LE), JSON header (ids, dimensions,
+# metric) padded to SNAPSHOT_ALIGNMENT bytes, then the float32 rows
+SNAPSHOT_MAGIC = b"VSNAP001"
+SNAPSHOT_ALIGNMENT = 64
+
+def snapshot_path(manufacturer: str) -> Path:
+    """The snapshot file of a manufacturer: ids and matrix together, so they are replaced as one."""
+    return VECTOR_SNAPSHOT_DIR / f"{manufacturer}.vsnap"
+
+def _legacy_snapshot_paths(manufacturer: str) -> Tuple[Path, Path]:
+    # Older versions wrote the matrix and the ids to two files
+    return VECTOR_SNAPSHOT_DIR / f"{manufacturer}.f32", VECTOR_SNAPSHOT_DIR / f"{manufacturer}.json"
+
+class ExactSearchEngine:
+    """
+    Exact top-k search over one contiguous float32 matrix.
+
+    A query is a single matrix-vector product followed by argpartition, so it
+    is O(n * dim) with no per-document Python work. For cosine similarity the
+    rows are normalized once when the engine is built, and dot product is used
+    at query time. The matrix can be a read-only memmap of a snapshot, so
+    loading is near-instant and pages are shared between processes.
+
+    `version` is the data version the vectors were read at; it is saved with the
+    snapshot so a loader can tell whether the snapshot is still current.
+    """
+
+    def __init__(self, ids: Sequence[Any], matrix: np.ndarray, metric: str = "cosine", prepared: bool = False,
+                 version: Optional[str] = None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'. Available: {', '.join(METRICS)}")
+        self.ids = list(ids)
+        self.metric = metric
+        self.version = version
+        if prepared or metric == "dot":
+            self.matrix = matrix if matrix.dtype == np.float32 else matrix.astype(np.float32)
+        else:
+            self.matrix = normalize_rows(matrix) if len(matrix) else np.asarray(matrix, dtype=np.float32)
+        if len(self.ids) != len(self.matrix):
+            raise ValueError(f"{len(self.ids)} ids for {len(self.matrix)} vectors")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _prepare_queries(self, queries: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            return normalize_rows(queries)
+        queries = np.asarray(queries, dtype=np.float32)
+        return queries[None, :] if queries.ndim == 1 else queries
+
+    def search(self, query: np.ndarray, k: int = 5) -> Tuple[List[Any], np.ndarray]:
+        """
+        Find the k most similar vectors to one query.
+
+        Returns:
+            Tuple[List[Any], np.ndarray]: The ids and scores of the matches, best first.
+        """
+        if not len(self.ids):
+            return [], np.zeros(0, dtype=np.float32)
+        scores = self.matrix @ self._prepare_queries(query)[0]
+        best = top_k(scores, k)
+        return [self.ids[i] for i in best], scores[best]
+
+    def search_batch(self, queries: np.ndarray, k: int = 5) -> List[Tuple[List[Any], np.ndarray]]:
+        """
+        Find the k most similar vectors for many queries at once.
+
+        Queries are scored in blocks of EXACT_SEARCH_QUERY_BLOCK with one matrix-matrix
+        product each, which is much faster than looping over search().
+
+        Returns:
+            List[Tuple[List[Any], np.ndarray]]: One (ids, scores) pair per query.
+        """
+        queries = self._prepare_queries(queries)
+        if not len(self.ids):
+            return [([], np.zeros(0, dtype=np.float32)) for _ in range(len(queries))]
+        k = min(k, len(self.ids))
+        results = []
+        for start in range(0, len(queries), EXACT_SEARCH_QUERY_BLOCK):
+            scores = queries[start:start+EXACT_SEARCH_QUERY_BLOCK] @ self.matrix.T
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+            order = np.argsort(-candidate_scores, axis=1)
+            best = np.take_along_axis(candidates, order, axis=1)
+            best_scores = np.take_along_axis(candidate_scores, order, axis=1)
+            results.extend(([self.ids[i] for i in row], row_scores) for row, row_scores in zip(best, best_scores))
+        return results
+
+    def save_snapshot(self, manufacturer: str):
+        """
+        Write the ids and the prepared matrix to one file, so the next load can memory-map them.
+
+        The file is written under a temporary name and renamed into place, so a reader
+        sees either the old snapshot or the new one, never the ids of one with the
+        vectors of the other. A reader that already mapped the old file keeps it.
+        """
+        path = snapshot_path(manufacturer)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        header = json.dumps({
+            "ids": [str(doc_id) for doc_id in self.ids],
+            "dimensions": int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0,
+            "metric": self.metric,
+            "version": self.version
+        }).encode('utf-8')
+        prefix = len(SNAPSHOT_MAGIC) + 8
+        header += b" " * (-(prefix + len(header)) % SNAPSHOT_ALIGNMENT)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            np.ascontiguousarray(self.matrix, dtype='<f4').tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_snapshot(cls, manufacturer: str, metric: str = "cosine") -> Optional["ExactSearchEngine"]:
+        """
+        Memory-map a saved snapshot.
+
+        Returns None if there is none, it was built for another metric, or its size
+        doesn't match its ids and dimensions (e.g. a truncated file).
+        """
+        path = snapshot_path(manufacturer)
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    raise ValueError("not a vector snapshot")
+                header_length = int.from_bytes(f.read(8), 'little')
+                meta = json.loads(f.read(header_length))
+                offset = f.tell()
+                size = os.fstat(f.fileno()).st_size
+            if meta["metric"] != metric:
+                return None
+            shape = (len(meta["ids"]), meta["dimensions"])
+            if size != offset + shape[0] * shape[1] * 4:
+                raise ValueError(f"{size - offset} bytes of vectors for {shape[0]} x {shape[1]}")
+            if not meta["ids"]:
+                return cls([], np.zeros(shape, dtype=np.float32), metric, prepared=True, version=meta.get("version"))
+            matrix = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=shape)
+            return cls(meta["ids"], matrix, metric, prepared=True, version=meta.get("version"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable vector snapshot for {manufacturer}: {str(e)}")
+            return None
+
+def delete_snapshot(manufacturer: str):
+    """Remove a manufacturer's snapshot so the next search rebuilds it from MongoDB."""
+    for path in (snapshot_path(manufacturer), *_legacy_snapshot_paths(manufacturer)):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact top-k search.")
+    parser.add_argument("--manufacturer", help="Benchmark the snapshot of this manufacturer")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark on N random vectors instead")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    if args.synthetic:
+        engine = ExactSearchEngine([f"v{i}" for i in range(args.synthetic)],
+                                   rng.standard_normal((args.synthetic, args.dim)).astype(np.float32))
+    elif args.manufacturer:
+        engine = ExactSearchEngine.load_snapshot(args.manufacturer)
+        if engine is None:
+            parser.error(f"No snapshot for {args.manufacturer}; run a search in 'exact' mode first")
+    else:
+        parser.error("Pass --manufacturer or --synthetic")
+    queries = rng.standard_normal((args.queries, engine.matrix.shape[1])).astype(np.float32)
+
+    start = time.perf_counter()
+    for query in queries:
+        engine.search(query, args.k)
+    single = (time.perf_counter() - start) / len(queries)
+    start = time.perf_counter()
+    engine.search_batch(queries, args.k)
+    batched = (time.perf_counter() - start) / len(queries)
+    print(f"{len(engine)} vectors x {engine.matrix.shape[1]} dims, k={args.k}")
+    print(f"search:       {single * 1000:.3f} ms/query")
+    print(f"search_batch: {batched * 1000:.3f} ms/query")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 import os
 import logging
-from typing import List, Dict, Any
-import voyageai
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 from document_processing import process_manufacturer_data
 from data_ingestion import ingest_data
 from langchain.docstore.document import Document
+from embedding_dispatcher import EmbeddingDispatcher, pack_batches
+from embedding_backends import get_backend
+from embedding_cache import get_default_cache
 
 # Load environment variables
 load_dotenv()
@@ -14,46 +17,136 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Initialize Voyage AI client
-voyage_client = voyageai.Client(api_key=os.getenv('VOYAGE_API_KEY'))
+# Embedding backend, chosen by EMBEDDING_BACKEND ("voyage" or the offline "hashed").
+# Its model name is recorded in the ingestion manifest so a change triggers re-embedding.
+backend = get_backend()
+EMBEDDING_MODEL = backend.model
 
-def vectorize_chunks(chunks: List[Document], batch_size: int = 128) -> List[Dict[str, Any]]:
+# Concurrency, rate budget and retry policy for embedding requests. A budget of 0 means unlimited.
+EMBED_MAX_IN_FLIGHT = int(os.getenv('EMBED_MAX_IN_FLIGHT', 4))
+EMBED_REQUESTS_PER_MINUTE = float(os.getenv('EMBED_REQUESTS_PER_MINUTE', 0)) or None
+EMBED_TOKENS_PER_MINUTE = float(os.getenv('EMBED_TOKENS_PER_MINUTE', 0)) or None
+EMBED_MAX_RETRIES = int(os.getenv('EMBED_MAX_RETRIES', 5))
+
+# Shared by every caller so the in-flight limit and rate budget are process-wide
+dispatcher = EmbeddingDispatcher(lambda texts: backend.embed(texts, input_type="document"),
+                                 max_in_flight=EMBED_MAX_IN_FLIGHT,
+                                 requests_per_minute=EMBED_REQUESTS_PER_MINUTE,
+                                 tokens_per_minute=EMBED_TOKENS_PER_MINUTE,
+                                 max_retries=EMBED_MAX_RETRIES,
+                                 is_retryable=backend.is_retryable,
+                                 token_estimator=backend.count_tokens)
+
+@dataclass
+class EmbeddingResult:
+    """Outcome of embed_documents: the vectorized chunks and the chunks that still failed."""
+    vectorized: List[Dict[str, Any]] = field(default_factory=list)
+    failed: List[Document] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+def embed_documents(chunks: List[Document],
+                    batch_size: Optional[int] = None,
+                    max_tokens: Optional[int] = None) -> EmbeddingResult:
     """
-    Convert text chunks into vector embeddings using Voyage AI.
+    Embed chunks concurrently through the shared dispatcher.
+
+    Chunks already in the embedding cache are not sent again. Batches are retried with exponential backoff. Chunks whose batch still fails
+    are returned in `failed` instead of being dropped.
 
     Args:
         chunks (List[Document]): A list of Document objects.
-        batch_size (int): The number of chunks to process in each batch. Default is 128.
+        batch_size (Optional[int]): Maximum chunks per request. Defaults to the backend's limit.
+        max_tokens (Optional[int]): Estimated-token budget per request. Defaults to the backend's limit.
 
     Returns:
-        List[Dict[str, Any]]: A list of dictionaries, each containing the original content,
-                              metadata, and the vector embedding.
+        EmbeddingResult: The vectorized chunks, in input order, and the failed chunks.
     """
-    logger.info(f"Vectorizing {len(chunks)} chunks using Voyage AI")
-    vectorized_docs = []
+    batch_size = batch_size or backend.max_batch_size
+    texts = [chunk.page_content for chunk in chunks]
+    cache = get_default_cache()
+    vectors = cache.get_many(texts, EMBEDDING_MODEL, "document") if cache else [None] * len(chunks)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if cache:
+        logger.info(f"Embedding cache: {len(chunks) - len(missing)} hits, {len(missing)} misses")
 
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i+batch_size]
-        
-        # Prepare texts for batch embedding
-        texts = [chunk.page_content for chunk in batch]
+    # Only cache misses are sent to the provider, packed by estimated tokens
+    max_tokens = max_tokens or backend.max_batch_tokens
+    packed = pack_batches([backend.count_tokens(texts[j]) for j in missing], max_tokens, batch_size)
+    batches = [[missing[k] for k in batch] for batch in packed]
+    dispatch_result = dispatcher.dispatch([[texts[j] for j in batch] for batch in batches])
 
-        try:
-            # Get embeddings from Voyage AI in batch
-            result = voyage_client.embed(texts, model="voyage-2", input_type="document")
-            
-            for chunk, embedding in zip(batch, result.embeddings):
-                vectorized_docs.append({
-                    "content": chunk.page_content,
-                    "metadata": chunk.metadata,
-                    "vector": embedding
-                })
-            logger.info(f"Successfully vectorized batch of {len(batch)} chunks")
-        except Exception as e:
-            logger.error(f"Error vectorizing batch: {str(e)}")
+    result = EmbeddingResult()
+    failed = set()
+    for i, (batch, embeddings) in enumerate(zip(batches, dispatch_result.embeddings)):
+        if embeddings is None:
+            failed.update(batch)
+            result.errors.append(dispatch_result.errors[i])
+            continue
+        for j, embedding in zip(batch, embeddings):
+            vectors[j] = embedding
+        if cache:
+            cache.put_many([texts[j] for j in batch], embeddings, EMBEDDING_MODEL, "document")
+
+    for i, chunk in enumerate(chunks):
+        if i in failed:
+            result.failed.append(chunk)
+            continue
+        result.vectorized.append({
+            "content": chunk.page_content,
+            "metadata": chunk.metadata,
+            "vector": vectors[i]
+        })
+    if dispatch_result.retries:
+        logger.info(f"Embedding needed {dispatch_result.retries} retries")
+    if dispatch_result.timings:
+        throughput = dispatch_result.throughput()
+        logger.info(f"Embedded {throughput['chunks']} chunks (~{throughput['tokens']} tokens) in "
+                    f"{len(dispatch_result.timings)} requests: {throughput['chunks_per_s']:.1f} chunks/s, "
+                    f"{throughput['tokens_per_s']:.0f} tokens/s")
+    return result
+
+def embed_query(text: str) -> List[float]:
+    """
+    Embed a search query, going through the same cache as document embeddings.
+
+    Args:
+        text (str): The query text.
+
+    Returns:
+        List[float]: The query vector.
+    """
+    cache = get_default_cache()
+    vector = cache.get(text, EMBEDDING_MODEL, "query") if cache else None
+    if vector is None:
+        vector = backend.embed([text], input_type="query")[0]
+        if cache:
+            cache.put(text, vector, EMBEDDING_MODEL, "query")
+    return vector
+
+def vectorize_chunks(chunks: List[Document], batch_size: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Convert text chunks into vector embeddings using the configured embedding backend.
+
+    Args:
+        chunks (List[Document]): A list of Document objects.
+        batch_size (Optional[int]): Maximum chunks per request. Batches are packed by estimated
+                                    tokens up to the backend's per-request limit.
+
+    Returns:
+        List[Dict[str, Any]]: A list of dictionaries, each containing the original content,
+                              metadata, and the vector embedding. Chunks that could not be
+                              embedded after retries are logged and left out; use
+                              embed_documents to get them back.
+    """
+    logger.info(f"Vectorizing {len(chunks)} chunks using {backend.name} ({EMBEDDING_MODEL})")
+    result = embed_documents(chunks, batch_size)
+    if result.failed:
+        failed_ids = [chunk.metadata.get("chunk_id", chunk.metadata.get("source", "Unknown")) for chunk in result.failed]
+        logger.error(f"Failed to vectorize {len(result.failed)} chunks after retries: {failed_ids} "
+                     f"(errors: {sorted(set(result.errors))})")
 
-    logger.info(f"Finished vectorizing. Total vectorized documents: {len(vectorized_docs)}")
-    return vectorized_docs
+    logger.info(f"Finished vectorizing. Total vectorized documents: {len(result.vectorized)}")
+    return result.vectorized
 
 def process_and_vectorize_data(processed_data: Dict[str, List[Document]]) -> Dict[str, List[Dict[str, Any]]]:
     """
@@ -0,0 +1,9 @@
+# conftest.py
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules under src and PDF_Chatbot import each other by name, as when run from those directories
+sys.path.insert(0, os.path.join(ROOT, 'PDF_Chatbot'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
@@ -0,0 +1,34 @@
+# test_answer_cache.py
+
+import pytest
+from bson.objectid import ObjectId
+
+import answer_cache
+from answer_cache import AnswerCache
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnswerCache(tmp_path / "answers.sqlite3")
+
+def test_invalidating_a_chunk_drops_every_answer_built_from_it(cache):
+    cache.put("quietest unit?", "model", ["c1", "c2"], "FTXM20R")
+    cache.put("cheapest unit?", "model", ["c2", "c3"], "FTXF20D")
+    cache.put("largest unit?", "model", ["c4"], "FTXM71R")
+
+    assert cache.invalidate_chunks(["c2"]) == 2
+    assert cache.get("quietest unit?", "model", ["c1", "c2"]) is None
+    assert cache.get("cheapest unit?", "model", ["c2", "c3"]) is None
+    assert cache.get("largest unit?", "model", ["c4"]).answer == "FTXM71R"
+    assert cache.invalidate_chunks(["c2", "unknown"]) == 0
+
+def test_chunk_ids_are_matched_as_strings(cache):
+    chunk_id = ObjectId()
+    cache.put("quietest unit?", "model", [chunk_id], "FTXM20R")
+    assert cache.invalidate_chunks([str(chunk_id)]) == 1
+
+def test_invalidation_spans_lookup_batches(cache, monkeypatch):
+    monkeypatch.setattr(answer_cache, "_LOOKUP_BATCH", 2)
+    for i in range(5):
+        cache.put(f"question {i}?", "model", [f"c{i}"], f"answer {i}")
+    assert cache.invalidate_chunks(f"c{i}" for i in range(5)) == 5
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,42 @@
+# test_context_packer.py
+
+from context_packer import pack_context, trim_overlap
+
+def words(text):
+    return len(text.split())
+
+def chunk(content, score=None, source="a.pdf", position=None):
+    return {"content": content, "score": score, "source": source, "position": position}
+
+def test_near_duplicates_are_packed_once():
+    text = "the outdoor unit runs quietly at night in cooling mode"
+    packed = pack_context([chunk(text, 0.9), chunk(text + " too", 0.8), chunk("heating capacity table", 0.7)],
+                          budget=1000, counter=words, safety=1.0)
+    assert packed.skipped_duplicates == 1
+    assert [c["content"] for c in packed.chunks] == [text, "heating capacity table"]
+
+def test_budget_skips_chunks_that_no_longer_fit():
+    chunks = [chunk("one two three four five six", 0.9, "a"), chunk("seven eight nine ten eleven twelve", 0.8, "b"),
+              chunk("short", 0.1, "c")]
+    packed = pack_context(chunks, budget=14, counter=words, safety=1.0)
+    assert [c["source"] for c in packed.chunks] == ["a", "c"]
+    assert packed.skipped_over_budget == 1
+    assert packed.tokens_used <= 14
+
+def test_consecutive_chunks_are_merged_without_their_overlap():
+    first = "the indoor unit has a washable filter and an auto restart function after power failure"
+    second = "an auto restart function after power failure and a weekly timer"
+    assert trim_overlap(first, second) == " and a weekly timer"
+    packed = pack_context([chunk(second, 0.9, position=4), chunk(first, 0.5, position=3)],
+                          budget=1000, counter=words, safety=1.0)
+    assert packed.text == "[a.pdf]\n" + first + " and a weekly timer"
+    assert [c["position"] for c in packed.chunks] == [3, 4]
+
+def test_source_order_is_stable_whatever_the_scores():
+    chunks = [chunk("zeta unit data", 0.9, "z.pdf"), chunk("alpha unit specs", 0.5, "a.pdf")]
+    by_score = pack_context(chunks, budget=1000, counter=words, safety=1.0)
+    assert by_score.text.startswith("[z.pdf]")
+    rescored = [{**chunks[0], "score": 0.1}, chunks[1]]
+    stable = [pack_context(c, budget=1000, counter=words, safety=1.0, order="source").text for c in (chunks, rescored)]
+    assert stable[0] == stable[1]
+    assert stable[0].startswith("[a.pdf]")
@@ -0,0 +1,40 @@
+# test_conversation_memory.py
+
+from conversation_memory import ConversationMemory
+
+def words(text):
+    return len(text.split())
+
+def make_memory(**kwargs):
+    folds = []
+
+    def summarize(summary, turns):
+        folds.append(len(turns))
+        return (summary + " " + " ".join(turn["user"] for turn in turns)).strip()
+
+    return ConversationMemory(summarize, counter=words, **kwargs), folds
+
+def test_old_turns_are_folded_into_the_summary():
+    memory, folds = make_memory(keep_turns=2, max_recent_tokens=1000, summary_max_tokens=100)
+    for i in range(4):
+        memory.add_turn(f"question{i}", f"answer{i}")
+    memory.wait()
+    assert sum(folds) == 2
+    assert memory.summary == "question0 question1"
+    assert memory.render().endswith("User: question2\nAssistant: answer2\nUser: question3\nAssistant: answer3")
+
+def test_an_oversized_turn_is_truncated_to_the_budget():
+    memory, _ = make_memory(max_recent_tokens=50, summary_max_tokens=10)
+    memory.add_turn("which unit is quietest " * 20, "the FTXM20R at 19 dB " * 40)
+    stats = memory.stats()
+    assert stats["recent_turns"] == 1
+    assert stats["recent_tokens"] <= 50
+    assert words(memory.render()) <= 10 * 2 + 50
+    assert "FTXM20R" in memory.render()
+
+def test_a_short_question_leaves_the_rest_to_the_answer():
+    memory, _ = make_memory(max_recent_tokens=50)
+    memory.add_turn("quietest unit?", "the FTXM20R " * 100)
+    rendered = memory.render()
+    assert rendered.startswith("User: quietest unit?\n")
+    assert words(rendered) == 50
@@ -0,0 +1,58 @@
+# test_data_ingestion.py
+
+import pytest
+
+import data_ingestion
+from data_ingestion import _page_shards, extract_pages, load_pdf
+from extraction_cache import ExtractionCache
+
+NUM_PAGES = 23
+
+def make_pdf(texts):
+    """A minimal PDF with one line of Helvetica text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+@pytest.fixture
+def pdf_path(tmp_path, monkeypatch):
+    cache = ExtractionCache(tmp_path / "extraction")
+    monkeypatch.setattr(data_ingestion, "get_default_cache", lambda: cache)
+    path = tmp_path / "catalog.pdf"
+    path.write_bytes(make_pdf(f"Page {i + 1} PUZ-ZM{i}VKA" for i in range(NUM_PAGES)))
+    return str(path)
+
+def test_page_shards_cover_every_page_once():
+    for num_pages, num_shards in [(23, 8), (5, 8), (100, 3)]:
+        shards = _page_shards(num_pages, num_shards)
+        assert len(shards) <= num_shards
+        assert [page for start, end in shards for page in range(start, end)] == list(range(num_pages))
+
+@pytest.mark.parametrize("as_bytes", [False, True])
+def test_sharded_extraction_matches_serial_loading(pdf_path, as_bytes):
+    serial = load_pdf(pdf_path, workers=1, per_page=True)
+    assert serial == [f"Page {i + 1} PUZ-ZM{i}VKA" for i in range(NUM_PAGES)]
+
+    with open(pdf_path, "rb") as f:
+        source = f.read() if as_bytes else pdf_path
+    sharded = extract_pages(source, workers=3, parallel_threshold=1, use_cache=False)
+    assert sharded == serial
+    assert load_pdf(pdf_path, workers=3) == "\n".join(serial)
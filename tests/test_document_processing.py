@@ -0,0 +1,22 @@
+# test_document_processing.py
+
+from document_processing import chunk_section, heading_text, iter_split_pages
+
+def test_heading_text():
+    assert heading_text("TECHNISCHE DATEN") == "TECHNISCHE DATEN"
+    assert heading_text("  Indoor   Units: ") == "Indoor Units"
+    assert heading_text("Features and Benefits") == "Features and Benefits"
+    for line in ["PUZ-ZM100VKA", "Cooling capacity 3.5 kW", "The unit must be installed by a qualified person.", ""]:
+        assert heading_text(line) is None
+
+def test_chunk_section_carries_the_last_heading():
+    assert chunk_section("FEATURES\nQuiet operation.") == ("FEATURES", "FEATURES")
+    assert chunk_section("row a\nSOUND LEVELS\nrow b", "FEATURES") == ("FEATURES", "SOUND LEVELS")
+    assert chunk_section("row c", None) == (None, None)
+
+def test_sections_follow_chunks_across_pages():
+    pages = ["FEATURES\n" + "quiet operation " * 80 + "\nTECHNICAL DATA\nrow a", "row b " * 20]
+    chunks = list(iter_split_pages(pages, {"file_hash": "f" * 64}, chunk_size=400, chunk_overlap=0))
+    assert chunks[0].metadata["section"] == "FEATURES"
+    assert chunks[-1].metadata["page"] == 2
+    assert chunks[-1].metadata["section"] == "TECHNICAL DATA"
@@ -0,0 +1,48 @@
+# test_embedding_cache.py
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(tmp_path / "embeddings.sqlite3", max_entries=10)
+
+def test_replaced_entries_are_not_counted_twice(cache):
+    cache.put_many(["a", "b", "b"], [[0.1], [0.2], [0.2]], "model", "document")
+    cache.put("a", [0.1], "model", "document")
+    assert cache._count == 2 == cache.stats()["entries"]
+
+def test_least_recently_used_entries_are_evicted_past_the_limit(cache):
+    cache.put_many([f"text {i}" for i in range(10)], [[float(i)] for i in range(10)], "model", "document")
+    assert cache.get("text 0", "model", "document") == [0.0]
+    cache.put("text 10", [10.0], "model", "document")
+    assert cache.stats()["entries"] == cache._count == 9
+    assert cache.get("text 0", "model", "document") == [0.0]
+    assert cache.get("text 1", "model", "document") is None
+
+def test_the_count_is_resynced_when_evicting(cache):
+    # Another process writing to the same file
+    EmbeddingCache(cache.path).put_many([f"other {i}" for i in range(10)], [[0.0]] * 10, "model", "document")
+    cache.put("text", [1.0], "model", "document")
+    cache.put_many([f"text {i}" for i in range(10)], [[0.0]] * 10, "model", "document")
+    assert cache.stats()["entries"] == cache._count == 9
+
+def test_the_default_cache_is_created_once(monkeypatch, tmp_path):
+    created = []
+
+    def slow_cache():
+        time.sleep(0.05)
+        created.append(EmbeddingCache(tmp_path / "embeddings.sqlite3"))
+        return created[-1]
+
+    monkeypatch.setattr(embedding_cache, "_default_cache", None)
+    monkeypatch.setattr(embedding_cache, "EmbeddingCache", slow_cache)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        caches = list(pool.map(lambda _: embedding_cache.get_default_cache(), range(4)))
+    assert len(created) == 1
+    assert all(c is created[0] for c in caches)
@@ -0,0 +1,78 @@
+# test_embedding_dispatcher.py
+
+import time
+import urllib.error
+
+from embedding_dispatcher import (EmbeddingDispatcher, HTTPEmbeddingClient, RateLimiter, StubEmbeddingServer,
+                                  pack_batches)
+
+def make_dispatcher(server, **kwargs):
+    client = HTTPEmbeddingClient(server.url)
+    return EmbeddingDispatcher(lambda texts: client.embed(texts, model="stub").embeddings,
+                               backoff_base=0.001, **kwargs)
+
+def test_dispatch_embeds_every_batch_in_order():
+    batches = [[f"chunk {i}-{j}" for j in range(3)] for i in range(5)]
+    with StubEmbeddingServer(latency=0, failure_rate=0, dimensions=4) as server:
+        result = make_dispatcher(server, max_in_flight=3).dispatch(batches)
+        single = HTTPEmbeddingClient(server.url).embed(batches[2], model="stub").embeddings
+
+    assert result.failed_batches == []
+    assert [len(embeddings) for embeddings in result.embeddings] == [3] * 5
+    assert result.embeddings[2] == single
+    assert server.requests == 5 + 1
+    assert result.throughput()["chunks"] == 15
+
+def test_failed_requests_are_retried():
+    with StubEmbeddingServer(latency=0, failure_rate=0, fail_statuses=[429, 503]) as server:
+        result = make_dispatcher(server, max_in_flight=1, max_retries=3).dispatch([["a", "b"], ["c"]])
+
+    assert result.failed_batches == []
+    assert result.retries == 2
+    assert server.requests == 4
+
+def test_batches_that_keep_failing_are_reported():
+    with StubEmbeddingServer(latency=0, failure_rate=1.0) as server:
+        result = make_dispatcher(server, max_retries=2).dispatch([["a"], ["b"]])
+
+    assert result.embeddings == [None, None]
+    assert result.failed_batches == [0, 1]
+    assert all("HTTPError" in error for error in result.errors.values())
+    assert server.requests == 2 * 3
+
+def test_non_retryable_errors_fail_at_once():
+    with StubEmbeddingServer(latency=0, failure_rate=0, fail_statuses=[400]) as server:
+        dispatcher = make_dispatcher(server, max_in_flight=1,
+                                     is_retryable=lambda e: not isinstance(e, urllib.error.HTTPError) or e.code != 400)
+        result = dispatcher.dispatch([["bad"], ["good"]])
+
+    assert result.failed_batches == [0]
+    assert result.embeddings[1] is not None
+    assert server.requests == 2
+
+def test_wrong_number_of_embeddings_is_an_error():
+    dispatcher = EmbeddingDispatcher(lambda texts: [[0.0]], max_retries=0)
+    result = dispatcher.dispatch([["a", "b"]])
+    assert result.failed_batches == [0]
+    assert "Expected 2 embeddings" in result.errors[0]
+
+def test_rate_limiter_waits_once_the_request_budget_is_spent():
+    limiter = RateLimiter(requests_per_minute=120)
+    start = time.monotonic()
+    for _ in range(120):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.2
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.4
+
+def test_rate_limiter_waits_for_tokens_but_lets_oversized_requests_through():
+    limiter = RateLimiter(tokens_per_minute=1200)
+    start = time.monotonic()
+    limiter.acquire(5000)
+    assert time.monotonic() - start < 0.2
+    limiter.acquire(10)
+    assert time.monotonic() - start >= 0.4
+
+def test_pack_batches_respects_token_and_item_limits():
+    assert pack_batches([5, 5, 5, 20, 1, 1], max_tokens=10, max_items=5) == [[0, 1], [2], [3], [4, 5]]
+    assert pack_batches([1] * 5, max_tokens=100, max_items=2) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,34 @@
+# test_hybrid_search.py
+
+import pytest
+
+from answer_cache import AnswerCache
+from context_snapshot import ContextSnapshot
+from mongodb_integration import MongoDBHandler, reciprocal_rank_fusion
+
+def test_rrf_rewards_documents_both_rankings_agree_on():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]], k=60)
+    assert [doc_id for doc_id, _ in fused] == ["b", "a", "d", "c"]
+    assert dict(fused)["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert dict(fused)["d"] == pytest.approx(1 / 62)
+
+def test_rrf_uses_ranks_only_and_handles_empty_rankings():
+    assert reciprocal_rank_fusion([[], []]) == []
+    assert [doc_id for doc_id, _ in reciprocal_rank_fusion([["x", "y"], []])] == ["x", "y"]
+    # A smaller k weights the top ranks more heavily
+    top, second = (score for _, score in reciprocal_rank_fusion([["x", "y"]], k=1))
+    assert top / second == pytest.approx(1.5)
+
+def test_snapshot_counts_sections():
+    docs = [{"_id": f"c{i}", "content": "", "manufacturer": "Daikin", "metadata": {"section": section}}
+            for i, section in enumerate(["FEATURES", "FEATURES", "TECHNICAL DATA", None])]
+    snapshot = ContextSnapshot.build(1, docs, lambda doc: {})
+    assert snapshot.section_counts == {"FEATURES": 2, "TECHNICAL DATA": 1}
+
+def test_unknown_sections_are_rejected(tmp_path, monkeypatch):
+    handler = MongoDBHandler(retrieval_mode="exact", answer_cache=AnswerCache(tmp_path / "answers.sqlite3"))
+    monkeypatch.setattr(handler, "list_sections", lambda: ["FEATURES", "TECHNICAL DATA"])
+    handler._check_sections(None)
+    handler._check_sections(["FEATURES"])
+    with pytest.raises(ValueError, match="Unknown sections: Featurs"):
+        handler.retrieve_similar_documents("Daikin", [0.0], sections=["Featurs"])
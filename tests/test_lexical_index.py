@@ -0,0 +1,97 @@
+# test_lexical_index.py
+
+import math
+
+import pytest
+
+from lexical_index import BM25Index, tokenize
+
+DOCS = [
+    ("d1", "PUZ-ZM100VKA outdoor unit, cooling capacity 10.0 kW", {"filename": "melco.pdf", "manufacturer": "Melco"}),
+    ("d2", "Quiet indoor unit for bedrooms, sound level 19 dB", {"filename": "daikin.pdf", "manufacturer": "Daikin"}),
+    ("d3", "Outdoor unit piping length up to 75 m", {"filename": "melco.pdf", "manufacturer": "Melco"}),
+    ("d4", "Quiet quiet quiet night mode", {"filename": "daikin.pdf", "manufacturer": "Daikin"}),
+]
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    index.add_many(DOCS)
+    return index
+
+def reference_score(query, doc_text, corpus, k1, b):
+    """BM25 written out term by term over the tokenized corpus."""
+    docs = [tokenize(text) for text in corpus]
+    doc = tokenize(doc_text)
+    average = sum(len(d) for d in docs) / len(docs)
+    score = 0.0
+    for term in tokenize(query):
+        containing = sum(1 for d in docs if term in d)
+        tf = doc.count(term)
+        if not tf:
+            continue
+        idf = math.log(1 + (len(docs) - containing + 0.5) / (containing + 0.5))
+        score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / average))
+    return score
+
+def test_tokenize_keeps_product_codes_and_their_parts():
+    assert tokenize("The PUZ-ZM100VKA is quiet") == ["puz-zm100vka", "puz", "zm100vka", "quiet"]
+
+def test_ranking_matches_bm25(index):
+    results = index.search("quiet outdoor unit")
+    corpus = [text for _, text, _ in DOCS]
+    expected = sorted(((doc_id, reference_score("quiet outdoor unit", text, corpus, index.k1, index.b))
+                       for doc_id, text, _ in DOCS), key=lambda item: item[1], reverse=True)
+    assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in expected]
+    for (_, score), (_, reference) in zip(results, expected):
+        assert score == pytest.approx(reference, rel=1e-5)
+    assert index.search("quiet", k=1)[0][0] == "d4"
+    assert index.search("heat pump") == []
+
+def test_product_code_parts_match(index):
+    assert [doc_id for doc_id, _ in index.search("zm100vka")] == ["d1"]
+
+def test_include_and_exclude_filters(index):
+    assert {doc_id for doc_id, _ in index.search("unit", include={"manufacturer": ["Melco"]})} == {"d1", "d3"}
+    assert {doc_id for doc_id, _ in index.search("unit", exclude={"filename": ["melco.pdf"]})} == {"d2"}
+    assert index.search("unit", include={"manufacturer": []}) == []
+    assert len(index.search("unit", include={"manufacturer": None})) == 3
+    assert index.search("unit", include={"manufacturer": ["Melco"]}, exclude={"filename": ["melco.pdf"]}) == []
+
+def test_remove_where_drops_every_matching_document(index):
+    assert index.remove_where("filename", "melco.pdf") == 2
+    assert len(index) == 2
+    assert "d1" not in index
+    assert index.field_values("manufacturer") == {"Daikin": 2}
+    assert index.search("outdoor piping") == []
+    assert index.remove_where("filename", "melco.pdf") == 0
+
+def test_slots_freed_by_remove_are_reused(index):
+    assert index.remove(["d2", "missing"]) == 1
+    index.add("d5", "Wall mounted indoor unit", {"filename": "fujitsu.pdf", "manufacturer": "Fujitsu"})
+    assert len(index._doc_ids) == len(DOCS)
+    assert [doc_id for doc_id, _ in index.search("indoor")] == ["d5"]
+    assert index.search("bedrooms") == []
+    assert index.field_values("manufacturer") == {"Melco": 2, "Daikin": 1, "Fujitsu": 1}
+
+def test_adding_an_existing_id_replaces_it(index):
+    index.add("d2", "Ceiling cassette", {"filename": "daikin.pdf", "manufacturer": "Daikin"})
+    assert len(index) == len(DOCS)
+    assert index.search("bedrooms") == []
+    assert [doc_id for doc_id, _ in index.search("cassette")] == ["d2"]
+
+def test_save_and_load_round_trip(index, tmp_path):
+    index.remove(["d3"])
+    index.meta["built_from"] = "test"
+    path = tmp_path / "bm25" / "products.json.gz"
+    index.save(path)
+    assert not index.dirty
+
+    loaded = BM25Index.load(path)
+    assert loaded.meta == {"built_from": "test"}
+    assert len(loaded) == len(index)
+    for query, filters in [("quiet outdoor unit", {}), ("unit", {"include": {"manufacturer": ["Melco"]}})]:
+        results, reloaded = index.search(query, **filters), loaded.search(query, **filters)
+        assert [doc_id for doc_id, _ in reloaded] == [doc_id for doc_id, _ in results]
+        assert [score for _, score in reloaded] == pytest.approx([score for _, score in results])
+    assert loaded.remove_where("manufacturer", "Daikin") == 2
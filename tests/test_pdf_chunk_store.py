@@ -0,0 +1,70 @@
+# test_pdf_chunk_store.py
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from pdf_chunk_store import PDFChunkStore
+
+@pytest.fixture
+def store():
+    return PDFChunkStore(mongomock.MongoClient().db, batch_size=2)
+
+def contents(store):
+    return sorted(doc["content"] for doc in store.iter_chunks())
+
+def test_readers_see_the_old_generation_until_publish(store, monkeypatch):
+    store.replace_file("a.pdf", ["old 1", "old 2"], [("Intro", 1, 2)])
+    seen_before_publish = []
+    publish = store._publish
+
+    def checking_publish(*args):
+        # Every new chunk is written by now, but the pointer still names the old generation
+        seen_before_publish.extend(contents(store))
+        return publish(*args)
+
+    monkeypatch.setattr(store, "_publish", checking_publish)
+    assert store.replace_file("a.pdf", ["new 1", "new 2", "new 3"], [("Intro", 1, 3)]) == 3
+    assert seen_before_publish == ["old 1", "old 2"]
+    assert contents(store) == ["new 1", "new 2", "new 3"]
+    assert store.list_summaries(0)[0]["chunk_count"] == 3
+
+def test_a_superseded_upload_is_not_published(store):
+    store.replace_file("a.pdf", ["first"], [])
+    stale = store._next_generation("a.pdf")
+    store.replace_file("a.pdf", ["second"], [])
+    assert not store._publish("a.pdf", stale, {})
+    assert contents(store) == ["second"]
+
+def test_a_failed_upload_leaves_no_chunks(store, monkeypatch):
+    store.replace_file("a.pdf", ["kept"], [])
+
+    def lost_connection(*args):
+        raise ConnectionError("connection lost")
+
+    monkeypatch.setattr(store, "_publish", lost_connection)
+    with pytest.raises(ConnectionError):
+        store.replace_file("a.pdf", ["lost 1", "lost 2", "lost 3"], [])
+    assert contents(store) == ["kept"]
+    assert store.chunks.count_documents({"filename": "a.pdf"}) == 1
+
+def test_gc_keeps_the_replaced_generation_through_the_grace_period(store):
+    for version in range(3):
+        store.replace_file("a.pdf", [f"v{version}"], [])
+    # Publishing deleted v0, but v1 may still be streamed by a reader
+    assert sorted(store.chunks.distinct("content")) == ["v1", "v2"]
+    assert store.collect_garbage() == 0
+
+    store.files.update_one({"_id": "a.pdf"}, {"$set": {"updated_at": datetime.now(timezone.utc) - timedelta(hours=1)}})
+    assert store.collect_garbage(grace=300) == 1
+    assert sorted(store.chunks.distinct("content")) == ["v2"]
+    assert contents(store) == ["v2"]
+
+def test_gc_leaves_uploads_in_progress_alone(store):
+    store.replace_file("a.pdf", ["v0"], [])
+    writing = store._next_generation("a.pdf")
+    store.chunks.insert_one({"content": "being written", "filename": "a.pdf", "generation": writing})
+    assert store.collect_garbage(grace=0) == 0
+    assert store.chunks.count_documents({"generation": writing}) == 1
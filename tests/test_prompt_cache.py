@@ -0,0 +1,41 @@
+# test_prompt_cache.py
+
+import anthropic
+import pytest
+
+from llm_streaming import stream_answer
+from prompt_cache import PromptCacheStats, StubMessagesServer, build_system
+
+INSTRUCTIONS = "You answer questions about HVAC product documents."
+CATALOG = "Catalog:\n" + "\n".join(f"Model PUZ-ZM{i}: cooling {i / 10:.1f} kW, piping up to {30 + i} m." for i in range(100))
+
+def test_breakpoint_is_on_the_stable_prefix():
+    blocks = build_system(INSTRUCTIONS, CATALOG, volatile="Relevant details: ...", cache=True)
+    assert [block.get("cache_control") is not None for block in blocks] == [False, True, False]
+    assert blocks[-1]["text"] == "Relevant details: ..."
+    assert build_system(INSTRUCTIONS, "", volatile="details", cache=False) == INSTRUCTIONS + "\n\ndetails"
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_turns_after_the_first_read_the_prefix_from_the_cache(stream):
+    stats = PromptCacheStats()
+    usages = []
+    with StubMessagesServer(min_cacheable_tokens=200) as stub:
+        client = anthropic.Anthropic(api_key="stub", base_url=stub.url)
+        for question in ["Max piping for PUZ-ZM50?", "And its cooling capacity?", "Compare it with PUZ-ZM60."]:
+            # Each question retrieves different chunks; they follow the cached prefix
+            system = build_system(INSTRUCTIONS, CATALOG, volatile=f"Relevant details for: {question}", cache=True)
+            messages = [{"role": "user", "content": question}]
+            if stream:
+                usage = stream_answer(client, "claude-3-opus-20240229", system, messages).usage
+            else:
+                usage = client.messages.create(model="claude-3-opus-20240229", max_tokens=100, system=system,
+                                               messages=messages).usage.model_dump()
+            stats.record(usage)
+            usages.append(usage)
+
+    assert usages[0]["cache_creation_input_tokens"] > 0
+    assert not usages[0]["cache_read_input_tokens"]
+    for usage in usages[1:]:
+        assert usage["cache_read_input_tokens"] == usages[0]["cache_creation_input_tokens"]
+        assert not usage["cache_creation_input_tokens"]
+    assert stats.read_ratio > 0.5
@@ -0,0 +1,43 @@
+# test_vector_search.py
+
+import numpy as np
+import pytest
+
+import vector_search
+from vector_search import ExactSearchEngine
+
+@pytest.fixture(autouse=True)
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_search, "VECTOR_SNAPSHOT_DIR", tmp_path)
+
+def make_engine(n=20, dim=8, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return ExactSearchEngine([f"c{i}" for i in range(n)], matrix), matrix
+
+def test_snapshot_round_trip():
+    engine, matrix = make_engine()
+    engine.save_snapshot("Daikin")
+    loaded = ExactSearchEngine.load_snapshot("Daikin")
+    assert loaded.ids == engine.ids
+    assert np.allclose(loaded.matrix, engine.matrix)
+    assert loaded.search(matrix[7], 1)[0] == ["c7"]
+
+def test_resaving_replaces_ids_and_vectors_together():
+    make_engine(n=20)[0].save_snapshot("Daikin")
+    engine, matrix = make_engine(n=30, seed=1)
+    engine.save_snapshot("Daikin")
+    loaded = ExactSearchEngine.load_snapshot("Daikin")
+    assert len(loaded) == 30
+    assert loaded.search(matrix[25], 1)[0] == ["c25"]
+
+def test_truncated_snapshot_is_ignored():
+    make_engine()[0].save_snapshot("Daikin")
+    path = vector_search.snapshot_path("Daikin")
+    path.write_bytes(path.read_bytes()[:-4])
+    assert ExactSearchEngine.load_snapshot("Daikin") is None
+
+def test_missing_and_deleted_snapshots():
+    assert ExactSearchEngine.load_snapshot("Daikin") is None
+    make_engine()[0].save_snapshot("Daikin")
+    vector_search.delete_snapshot("Daikin")
+    assert ExactSearchEngine.load_snapshot("Daikin") is None